@@ -1,24 +1,45 @@
 import os
+import re
+import time
+_boot_started = time.perf_counter()
+import gc
+import json
 import uuid
+import mimetypes
+import hashlib
+import hmac
+import functools
+import threading
+import base64
+import shutil
+import tempfile
+import heapq
 import sqlite3
-import psycopg2
-import psycopg2.extras
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
-import cloudinary.utils
-import boto3
+import click
 from io import BytesIO
+from decimal import Decimal
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from flask import (Flask, render_template, request, redirect,
-                   url_for, flash, session, send_from_directory, abort, jsonify)
-import firebase_admin
-from firebase_admin import credentials, auth
+from flask import (Flask, render_template, request, redirect, g, has_app_context,
+                   url_for, flash, session, send_file, send_from_directory, abort, jsonify,
+                   Request)
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from werkzeug.security import check_password_hash, generate_password_hash
 from flask_wtf.csrf import CSRFProtect
 from flask_talisman import Talisman
-from utils import with_retry, CircuitBreaker, get_monitoring_stats
+from utils import (with_retry, cooperative_sleep, CircuitBreaker, ConnectionPool, CachedValue,
+                   TTLCache, DiskCache, BootTimer, LazyImport, get_monitoring_stats)
+from extract import ExtractionWorker, EXTRACTABLE_EXTENSIONS
+from ingest import IngestedFile, content_matches, SNIFF_BYTES
+from jobs import JobQueue
+from preview import PreviewRenderer, PREVIEWABLE_EXTENSIONS, IMAGE_EXTENSIONS
+from reconcile import external_sort, ascending, merge_join, list_directory
+from metrics import Metrics
+
+boot_timer = BootTimer(_boot_started)
+boot_timer.mark('imports')
 
 # ─────────────────────────── Circuit Breakers ───────────────────────
 db_cb = CircuitBreaker(failure_threshold=5, recovery_timeout=30)
@@ -36,6 +57,97 @@ AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 S3_BUCKET_NAME        = os.getenv('S3_BUCKET_NAME')
 AWS_REGION            = os.getenv('AWS_REGION', 'ap-south-1')
 DB_NAME               = 'users.db'  # local SQLite fallback only
+DB_POOL_MIN           = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX           = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT       = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_PING_AFTER    = float(os.getenv('DB_POOL_PING_AFTER', '30'))   # idle seconds before a checkout is pinged
+DB_POOL_MAX_IDLE      = float(os.getenv('DB_POOL_MAX_IDLE', '300'))    # Neon drops idle sockets after ~5 min
+NOTIFICATIONS_TTL     = float(os.getenv('NOTIFICATIONS_TTL', '30'))     # max staleness across hosts
+FACETS_TTL            = float(os.getenv('FACETS_TTL', '300'))
+FACETS_RECOMPUTE_INTERVAL = float(os.getenv('FACETS_RECOMPUTE_INTERVAL', '3600'))
+CACHE_STAMP_DIR       = os.getenv('CACHE_STAMP_DIR', tempfile.gettempdir())  # shared by workers on a host
+SIGNED_URL_TTL        = int(os.getenv('SIGNED_URL_TTL', '3600'))
+SIGNED_URL_MIN_REMAINING = int(os.getenv('SIGNED_URL_MIN_REMAINING', '600'))  # re-sign below this
+SIGNED_URL_CACHE_SIZE = int(os.getenv('SIGNED_URL_CACHE_SIZE', '4096'))
+PROXY_POOL_SIZE       = int(os.getenv('PROXY_POOL_SIZE', '10'))
+PROXY_CONNECT_TIMEOUT = float(os.getenv('PROXY_CONNECT_TIMEOUT', '5'))
+PROXY_READ_TIMEOUT    = float(os.getenv('PROXY_READ_TIMEOUT', '30'))
+OBJECT_CACHE_DIR      = os.getenv('OBJECT_CACHE_DIR',
+                                  os.path.join(tempfile.gettempdir(), 'noteshare-object-cache'))
+OBJECT_CACHE_MAX_BYTES = int(os.getenv('OBJECT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))  # 0 disables
+OBJECT_CACHE_MAX_OBJECT = int(os.getenv('OBJECT_CACHE_MAX_OBJECT', str(30 * 1024 * 1024)))
+DIRECT_UPLOAD_MAX_BYTES = int(os.getenv('DIRECT_UPLOAD_MAX_BYTES', str(30 * 1024 * 1024)))
+DIRECT_UPLOAD_TTL     = int(os.getenv('DIRECT_UPLOAD_TTL', '900'))  # seconds a signed upload stays valid
+CHUNK_UPLOAD_DIR      = os.getenv('CHUNK_UPLOAD_DIR',
+                                  os.path.join(tempfile.gettempdir(), 'noteshare-chunks'))
+# S3 rejects multipart parts under 5MB (except the last), so that is the floor
+CHUNK_UPLOAD_SIZE     = max(int(os.getenv('CHUNK_UPLOAD_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+CHUNK_UPLOAD_MAX_BYTES = int(os.getenv('CHUNK_UPLOAD_MAX_BYTES', str(500 * 1024 * 1024)))
+CHUNK_UPLOAD_TTL      = int(os.getenv('CHUNK_UPLOAD_TTL', str(24 * 3600)))  # abandoned sessions are swept after this
+JOB_WORKERS           = int(os.getenv('JOB_WORKERS', '1'))   # 0: run `flask jobs-work` separately
+JOB_POLL_INTERVAL     = float(os.getenv('JOB_POLL_INTERVAL', '2'))
+JOB_MAX_ATTEMPTS      = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_BACKOFF           = float(os.getenv('JOB_BACKOFF', '30'))       # seconds before the first retry
+EXTRACT_WORKERS       = int(os.getenv('EXTRACT_WORKERS', '1'))
+EXTRACT_QUEUE_SIZE    = int(os.getenv('EXTRACT_QUEUE_SIZE', '32'))
+EXTRACT_TIME_BUDGET   = float(os.getenv('EXTRACT_TIME_BUDGET', '20'))  # seconds per file
+EXTRACT_MEMORY_MB     = int(os.getenv('EXTRACT_MEMORY_MB', '256'))
+PREVIEW_WORKERS       = int(os.getenv('PREVIEW_WORKERS', '2'))     # rendering processes per worker
+PREVIEW_WIDTH         = int(os.getenv('PREVIEW_WIDTH', '320'))
+PREVIEW_TIME_BUDGET   = float(os.getenv('PREVIEW_TIME_BUDGET', '20'))  # seconds per file
+PREVIEW_MEMORY_MB     = int(os.getenv('PREVIEW_MEMORY_MB', '256'))
+EVENT_IMAGE_WIDTHS    = sorted(int(w) for w in os.getenv('EVENT_IMAGE_WIDTHS', '320,640,1280').split(','))
+METRICS_DIR           = os.getenv('METRICS_DIR')      # shared by a server's workers; unset: per process
+METRICS_TOKEN         = os.getenv('METRICS_TOKEN')    # bearer token for scrapers; admins can always read
+
+# ─────────────────────────── Metrics ────────────────────────────────
+# Served in Prometheus text format from /metrics. gunicorn.conf.py points
+# METRICS_DIR at a directory shared by the server's workers, so a scrape
+# answered by any one of them covers them all.
+metrics = Metrics(METRICS_DIR, prefix='noteshare_')
+metrics.counter('http_requests_total', 'Requests served, by endpoint, method and status.')
+metrics.histogram('http_request_duration_seconds', 'Time to produce a response, by endpoint, method and status.')
+metrics.histogram('db_queries_per_request', 'Database queries issued while serving a request.',
+                  buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+metrics.histogram('db_time_per_request_seconds', 'Time spent in database queries while serving a request.')
+metrics.counter('db_queries_total', 'Database queries from requests, jobs and commands.')
+metrics.histogram('storage_call_duration_seconds',
+                  'Storage calls, retries included, by backend, operation and outcome.',
+                  buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+metrics.gauge('circuit_breaker_state', 'Circuit breaker state: 0 closed, 1 half-open, 2 open.')
+metrics.gauge('db_pool_connections', 'Open database connections in the pool, by state.')
+metrics.counter('retries_total', 'Retried storage and database calls.')
+metrics.counter('circuit_trips_total', 'Times a circuit breaker opened.')
+
+_BREAKER_STATES = {'CLOSED': 0, 'HALF_OPEN': 1, 'OPEN': 2}
+
+def _collect_process_metrics():
+    for name, breaker in (('db', db_cb), ('storage', storage_cb)):
+        metrics.set('circuit_breaker_state', _BREAKER_STATES[breaker.state], breaker=name)
+    pool = db_pool.stats()
+    metrics.set('db_pool_connections', pool['in_use'], state='in_use')
+    metrics.set('db_pool_connections', pool['idle'], state='idle')
+    stats = get_monitoring_stats()
+    metrics.set('retries_total', stats['total_retries'])
+    metrics.set('circuit_trips_total', stats['circuit_trips'])
+
+metrics.add_collector(_collect_process_metrics)
+
+def timed_storage(operation):
+    """Record how long each call to the storage backend takes, retries included."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started, outcome = time.perf_counter(), 'error'
+            try:
+                result = fn(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                metrics.observe('storage_call_duration_seconds', time.perf_counter() - started,
+                                backend=get_storage_type(), operation=operation, outcome=outcome)
+        return wrapper
+    return decorator
 
 # ─────────────────────────── Firebase Auth Setup ────────────────────
 def initialize_firebase():
@@ -52,14 +164,14 @@ def initialize_firebase():
         if firebase_creds_json:
             import json
             cred_dict = json.loads(firebase_creds_json)
-            cred = credentials.Certificate(cred_dict)
+            cred = firebase_admin.credentials.Certificate(cred_dict)
             firebase_admin.initialize_app(cred)
             print('[OK] Firebase Admin Initialized from environment variable')
             return
 
         # Option 2: Check for local firebase_key.json file
         if os.path.exists('firebase_key.json'):
-            cred = credentials.Certificate('firebase_key.json')
+            cred = firebase_admin.credentials.Certificate('firebase_key.json')
             firebase_admin.initialize_app(cred)
             print('[OK] Firebase Admin Initialized from firebase_key.json')
             return
@@ -74,40 +186,63 @@ def initialize_firebase():
     except Exception as e:
         print(f'[WARN] Firebase initialization failed: {e}')
 
-initialize_firebase()
+_firebase_lock = threading.Lock()
+
+def get_firebase_auth():
+    """firebase_admin.auth, initializing Firebase on the first sign-in; None if unavailable."""
+    with _firebase_lock:
+        if not firebase_admin._apps:
+            started = time.perf_counter()
+            initialize_firebase()
+            boot_timer.deferred('firebase init', time.perf_counter() - started)
+    return firebase_admin.auth if firebase_admin._apps else None
 
 # ─────────────────────────── Storage Setup ──────────────────────────
-cloudinary_active = False
-if CLOUDINARY_CLOUD_NAME and CLOUDINARY_API_KEY and CLOUDINARY_API_SECRET:
-    try:
-        cloudinary.config(
-            cloud_name=CLOUDINARY_CLOUD_NAME,
-            api_key=CLOUDINARY_API_KEY,
-            api_secret=CLOUDINARY_API_SECRET,
-            secure=True
-        )
-        cloudinary_active = True
-        print('[OK] Cloudinary Connected')
-    except Exception as e:
-        print(f'[ERROR] Cloudinary: {e}')
+# Only the configured backend's SDK is ever imported, on first use
+def _configure_cloudinary(module):
+    module.config(
+        cloud_name=CLOUDINARY_CLOUD_NAME,
+        api_key=CLOUDINARY_API_KEY,
+        api_secret=CLOUDINARY_API_SECRET,
+        secure=True
+    )
+    print('[OK] Cloudinary configured')
 
-s3_client = None
-if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY and S3_BUCKET_NAME:
-    try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name=AWS_REGION
-        )
-        print('[OK] AWS S3 Connected')
-    except Exception as e:
-        print(f'[ERROR] S3: {e}')
+cloudinary     = LazyImport('cloudinary', ('uploader', 'api', 'utils', 'exceptions'),
+                            setup=_configure_cloudinary, timer=boot_timer)
+boto3          = LazyImport('boto3', timer=boot_timer)
+psycopg2       = LazyImport('psycopg2', ('extras',), timer=boot_timer)
+firebase_admin = LazyImport('firebase_admin', ('auth', 'credentials'), timer=boot_timer)
+
+if CLOUDINARY_CLOUD_NAME and CLOUDINARY_API_KEY and CLOUDINARY_API_SECRET:
+    STORAGE_TYPE = 'cloudinary'
+elif AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY and S3_BUCKET_NAME:
+    STORAGE_TYPE = 's3'
+else:
+    STORAGE_TYPE = 'local'
+print(f'[OK] Storage backend: {STORAGE_TYPE}')
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                started = time.perf_counter()
+                _s3_client = boto3.client(
+                    's3',
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    region_name=AWS_REGION
+                )
+                boot_timer.deferred('s3 client', time.perf_counter() - started)
+                print('[OK] AWS S3 client ready')
+    return _s3_client
 
 def get_storage_type():
-    if cloudinary_active: return 'cloudinary'
-    if s3_client:         return 's3'
-    return 'local'
+    return STORAGE_TYPE
 
 # ─────────────────────────── Storage Helpers ────────────────────────
 def sanitize_public_id(filename):
@@ -118,15 +253,24 @@ def sanitize_public_id(filename):
 
 class StorageService:
     @staticmethod
-    @with_retry(max_attempts=3, circuit_breaker=storage_cb)
     def upload(file, stored_name):
+        return StorageService.upload_with_url(file, stored_name)[0]
+
+    @staticmethod
+    @timed_storage('upload')
+    @with_retry(max_attempts=3, circuit_breaker=storage_cb)
+    def upload_with_url(file, stored_name):
+        """
+        Upload an IngestedFile and return (resource_type, delivery_url); the URL
+        is None outside Cloudinary. Each attempt reads the spool from the start.
+        """
         storage = get_storage_type()
         if storage == 'cloudinary':
             res_type = _cloudinary_res_type(stored_name)
             # Upload with explicit public_id — do NOT use use_filename/unique_filename
             # as they override or conflict with public_id on some SDK versions
             result = cloudinary.uploader.upload(
-                file,
+                file.path or file.getvalue(),   # the SDK may close file objects it is given
                 public_id=stored_name,
                 resource_type=res_type,
                 overwrite=True
@@ -134,31 +278,92 @@ class StorageService:
             actual_public_id = result.get('public_id', 'UNKNOWN')
             actual_res_type  = result.get('resource_type', res_type)
             print(f'[UPLOAD] Cloudinary OK: public_id={actual_public_id} type={actual_res_type}')
-            return actual_res_type
+            return actual_res_type, result.get('secure_url')
 
         elif storage == 's3':
-            s3_client.upload_fileobj(file, S3_BUCKET_NAME, stored_name,
-                                     ExtraArgs={'ContentType': file.content_type})
-            return 'raw'
+            get_s3_client().upload_fileobj(file.rewind(), S3_BUCKET_NAME, stored_name,
+                                     ExtraArgs={'ContentType': file.content_type or 'application/octet-stream'})
+            return 'raw', None
         else:
             file.save(os.path.join(app.config['UPLOAD_FOLDER'], stored_name))
-            return 'raw'
+            return 'raw', None
 
     @staticmethod
-    @with_retry(max_attempts=2, circuit_breaker=storage_cb)
     def delete(filename, res_type=None):
+        """Drop one reference to a stored object; the object goes with the last reference."""
+        if not release_stored_object(filename):
+            print(f'[OK] Kept shared object {filename}; other uploads still use it')
+            return
+        StorageService.destroy(filename, res_type)
+
+    @staticmethod
+    @timed_storage('delete')
+    @with_retry(max_attempts=2, circuit_breaker=storage_cb)
+    def destroy(filename, res_type=None):
+        """Remove the object from storage regardless of references."""
+        signed_url_cache.discard_where(lambda key: key[0] == filename)
+        object_cache.discard(filename)
         storage = get_storage_type()
         if storage == 'cloudinary':
             if not res_type:
                 res_type = _cloudinary_res_type(filename)
             cloudinary.uploader.destroy(filename, resource_type=res_type)
         elif storage == 's3':
-            s3_client.delete_object(Bucket=S3_BUCKET_NAME, Key=filename)
+            get_s3_client().delete_object(Bucket=S3_BUCKET_NAME, Key=filename)
         elif storage == 'local':
             path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             if os.path.exists(path):
                 os.remove(path)
 
+    @staticmethod
+    @timed_storage('delete_many')
+    @with_retry(max_attempts=2, circuit_breaker=storage_cb)
+    def destroy_many(items):
+        """
+        Remove many objects with batched calls: Cloudinary delete_resources
+        (100 public_ids per call), S3 delete_objects (1000 keys per call) or
+        local unlinks. ``items`` holds (stored_name, res_type) pairs. Returns
+        {stored_name: 'deleted' | 'not_found' | error message}.
+        """
+        names = {name for name, _ in items}
+        signed_url_cache.discard_where(lambda key: key[0] in names)
+        for name in names:
+            object_cache.discard(name)
+
+        results, storage = {}, get_storage_type()
+        if storage == 'cloudinary':
+            by_type = {}
+            for name, res_type in items:
+                public_id, _ = _cloudinary_public_id(name, _cloudinary_res_type(name, res_type))
+                by_type.setdefault(_cloudinary_res_type(name, res_type), {})[public_id] = name
+            for res_type, ids in by_type.items():
+                public_ids = list(ids)
+                for i in range(0, len(public_ids), 100):
+                    resp = cloudinary.api.delete_resources(public_ids[i:i + 100], resource_type=res_type)
+                    for public_id, status in resp.get('deleted', {}).items():
+                        results[ids.get(public_id, public_id)] = status
+        elif storage == 's3':
+            keys = sorted(names)
+            for i in range(0, len(keys), 1000):
+                batch = keys[i:i + 1000]
+                resp = get_s3_client().delete_objects(
+                    Bucket=S3_BUCKET_NAME,
+                    Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True}
+                )
+                results.update((k, 'deleted') for k in batch)
+                for err in resp.get('Errors', []):
+                    results[err['Key']] = err.get('Message') or err.get('Code', 'error')
+        else:
+            for name in names:
+                try:
+                    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], name))
+                    results[name] = 'deleted'
+                except FileNotFoundError:
+                    results[name] = 'not_found'
+                except OSError as e:
+                    results[name] = str(e)
+        return results
+
 # ─────────────────────────── Flask App ──────────────────────────────
 app = Flask(__name__)
 _secret_key_env = os.getenv('SECRET_KEY')
@@ -175,6 +380,12 @@ else:
         with open(_key_file, 'wb') as _f:
             _f.write(_new_key)
         app.secret_key = _new_key
+class IngestRequest(Request):
+    """Spool multipart file parts into IngestedFile, hashing and sniffing them as they are parsed."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestedFile(filename, content_type)
+
+app.request_class = IngestRequest
 app.config['UPLOAD_FOLDER']          = 'uploads'
 app.config['MAX_CONTENT_LENGTH']     = 30 * 1024 * 1024
 app.config['SESSION_COOKIE_HTTPONLY'] = True
@@ -197,7 +408,8 @@ csp = {
                     '*.firebaseapp.com', 'apis.google.com', '*.google.com'],
     'connect-src': ["'self'", '*.googleapis.com', '*.firebaseapp.com', 
                     '*.firebaseio.com', 'firebaseinstallations.googleapis.com', 
-                    'api.emailjs.com', 'cdn.jsdelivr.net'],
+                    'api.emailjs.com', 'cdn.jsdelivr.net',
+                    'api.cloudinary.com', '*.amazonaws.com'],  # direct uploads
 }
 
 # Apply Talisman with the relaxed CSP
@@ -224,7 +436,34 @@ ALLOWED_EXTENSIONS = {
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# ─────────────────────────── Request Metrics ────────────────────────
+# Registered ahead of the other hooks so the timing covers them too
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('_request_started', None)
+    if started is None:
+        return response
+    # Unrouted paths share one label value so scanners cannot mint new series
+    endpoint = request.endpoint or 'unmatched'
+    labels = dict(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    metrics.inc('http_requests_total', **labels)
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - started, **labels)
+    metrics.observe('db_queries_per_request', g.pop('_db_queries', 0), endpoint=endpoint)
+    metrics.observe('db_time_per_request_seconds', g.pop('_db_time', 0.0), endpoint=endpoint)
+    return response
+
 # ─────────────────────────── DB Helpers ─────────────────────────────
+def _record_query(started):
+    elapsed = time.perf_counter() - started
+    metrics.inc('db_queries_total')
+    if has_app_context():
+        g._db_queries = g.get('_db_queries', 0) + 1
+        g._db_time = g.get('_db_time', 0.0) + elapsed
+
 class CursorWrapper:
     def __init__(self, cursor, is_pg):
         self.cursor = cursor
@@ -233,7 +472,11 @@ class CursorWrapper:
     def execute(self, query, params=()):
         if self.is_pg:
             query = query.replace('?', '%s')
-        self.cursor.execute(query, params)
+        started = time.perf_counter()
+        try:
+            self.cursor.execute(query, params)
+        finally:
+            _record_query(started)
         return self
 
     @property
@@ -246,6 +489,10 @@ class CursorWrapper:
                 return None
         return self.cursor.lastrowid
 
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
     def fetchone(self):  return self.cursor.fetchone()
     def fetchall(self):  return self.cursor.fetchall()
     def close(self):
@@ -254,19 +501,25 @@ class CursorWrapper:
 
 
 class DBWrapper:
-    def __init__(self, conn, is_pg):
-        self.conn  = conn
-        self.is_pg = is_pg
+    def __init__(self, conn, is_pg, pool=None, scoped=False):
+        self.conn   = conn
+        self.is_pg  = is_pg
+        self.pool   = pool
+        self.scoped = scoped   # owned by the request; released at teardown
 
     def execute(self, query, params=()):
-        if self.is_pg:
-            query = query.replace('?', '%s')
-            cur = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cur.execute(query, params)
-            return CursorWrapper(cur, True)
-        else:
-            cur = self.conn.execute(query, params)
-            return CursorWrapper(cur, False)
+        started = time.perf_counter()
+        try:
+            if self.is_pg:
+                query = query.replace('?', '%s')
+                cur = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cur.execute(query, params)
+                return CursorWrapper(cur, True)
+            else:
+                cur = self.conn.execute(query, params)
+                return CursorWrapper(cur, False)
+        finally:
+            _record_query(started)
 
     def cursor(self):
         if self.is_pg:
@@ -275,221 +528,901 @@ class DBWrapper:
 
     def commit(self): self.conn.commit()
     def rollback(self): self.conn.rollback()
-    def close(self):  self.conn.close()
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.scoped:
+            # Shared by everything in the request, so a helper closing its
+            # handle must not discard the route's pending writes; teardown
+            # rolls back whatever is left uncommitted.
+            return
+        if self.pool:
+            _release_to_pool(self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
 
 
 @with_retry(max_attempts=3, base_delay=0.5, circuit_breaker=db_cb)
-def get_db_connection():
+def _connect():
     if DATABASE_URL:
         url = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
-        conn = psycopg2.connect(url)
-        return DBWrapper(conn, True)
-    conn = sqlite3.connect(DB_NAME)
+        return psycopg2.connect(url)
+    # Pooled connections may be handed to a different thread on the next checkout
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
-    return DBWrapper(conn, False)
+    return conn
+
+def _ping(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT 1')
+        cur.fetchone()
+    finally:
+        cur.close()
+    conn.rollback()
+    return True
+
+db_pool = ConnectionPool(
+    _connect,
+    min_size=DB_POOL_MIN,
+    max_size=DB_POOL_MAX,
+    timeout=DB_POOL_TIMEOUT,
+    validate=_ping,
+    ping_after=DB_POOL_PING_AFTER,
+    max_idle=DB_POOL_MAX_IDLE,
+)
+
+def _release_to_pool(conn):
+    """Reset a connection and hand it back; broken connections are discarded."""
+    try:
+        conn.rollback()
+    except Exception:
+        db_pool.release(conn, discard=True)
+        return
+    db_pool.release(conn)
+
+def get_db_connection():
+    """
+    Return a pooled connection. Inside an app context one connection is
+    checked out per request and returned by ``release_db_connection``;
+    outside (startup, CLI) the caller owns it until ``close()``.
+    """
+    if has_app_context():
+        db = g.get('_db')
+        if db is None or db.conn is None:
+            db = g._db = DBWrapper(db_pool.acquire(), bool(DATABASE_URL), pool=db_pool, scoped=True)
+        return db
+    return DBWrapper(db_pool.acquire(), bool(DATABASE_URL), pool=db_pool)
+
+# ─────────────────────────── Search Index ───────────────────────────
+# Searchable columns per table with their relevance weight (A > B > C).
+SEARCH_FIELDS = {
+    'files': (('original_filename', 'A'), ('subject', 'A'), ('description', 'B'),
+              ('category', 'C'), ('dept', 'C')),
+    'file_contents': (('content', 'C'),),
+    'events': (('title', 'A'), ('organizer', 'B'), ('description', 'B')),
+    'circulars': (('title', 'A'), ('description', 'B')),
+}
+# Tables keyed by something other than ``id``
+SEARCH_KEYS = {'file_contents': 'file_id'}
+# Side tables whose matches count towards the parent row, at a reduced rank
+SEARCH_ATTACHED = {'files': ('file_contents', 0.5)}
+_BM25_WEIGHTS = {'A': 10.0, 'B': 4.0, 'C': 2.0}
+_MAX_SEARCH_TERMS = 8
+
+def _sqlite_has_fts5():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE _probe USING fts5(x)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+SEARCH_BACKEND = 'tsvector' if DATABASE_URL else ('fts5' if _sqlite_has_fts5() else 'like')
+
+def ensure_search_index(c, table, rebuild=False):
+    """
+    Create the full-text index for ``table`` if it is missing.
+
+    Postgres gets a generated ``search_vector`` column with a GIN index and
+    SQLite an external-content FTS5 table fed by triggers, so both stay in
+    sync with every INSERT/UPDATE/DELETE without any route code involved.
+    """
+    fields = SEARCH_FIELDS[table]
+    cols = [col for col, _ in fields]
+    key = SEARCH_KEYS.get(table, 'id')
+
+    if SEARCH_BACKEND == 'tsvector':
+        vector = ' || '.join(
+            f"setweight(to_tsvector('simple', coalesce({col}, '')), '{weight}')" for col, weight in fields
+        )
+        c.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector '
+                  f'GENERATED ALWAYS AS ({vector}) STORED')
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_search ON {table} USING GIN (search_vector)')
+        if rebuild:
+            c.execute(f'REINDEX INDEX idx_{table}_search')
+        return
+
+    if SEARCH_BACKEND != 'fts5':
+        return
+
+    fts = f'{table}_fts'
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,))
+    exists = c.fetchone() is not None
+    col_list = ', '.join(cols)
+    new_vals = ', '.join(f'new.{col}' for col in cols)
+    old_vals = ', '.join(f'old.{col}' for col in cols)
+    c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+              f"{col_list}, content='{table}', content_rowid='{key}')")
+    c.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+              f'INSERT INTO {fts}(rowid, {col_list}) VALUES (new.{key}, {new_vals}); END')
+    c.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+              f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.{key}, {old_vals}); END")
+    c.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN '
+              f"INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.{key}, {old_vals}); "
+              f'INSERT INTO {fts}(rowid, {col_list}) VALUES (new.{key}, {new_vals}); END')
+    if rebuild or not exists:
+        c.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+def _search_terms(q):
+    return re.findall(r'[^\W_]+', q.lower())[:_MAX_SEARCH_TERMS]
+
+def search_query(table, q):
+    """
+    Return ``(sql, params)`` selecting rows of ``table`` that match ``q``.
+
+    Every term must match, the last one as a prefix so search-as-you-type
+    works. Rows carry a ``search_rank`` column (higher is more relevant) and
+    the SQL ends in a WHERE clause, so callers can append ``AND`` filters and
+    hand it to ``fetch_page`` with ``sort_col='search_rank'``.
+    """
+    fields = SEARCH_FIELDS[table]
+    terms = _search_terms(q)
+    side, side_factor = SEARCH_ATTACHED.get(table, (None, 0))
+    side_key = SEARCH_KEYS.get(side, 'id')
+
+    if terms and SEARCH_BACKEND == 'tsvector':
+        tsquery = ' & '.join(terms[:-1] + [terms[-1] + ':*'])
+        # ts_rank is float4; a rounded numeric survives the cursor's round trip
+        # exactly, so the keyset comparison neither repeats nor skips rows
+        if not side:
+            return (f"SELECT * FROM (SELECT {table}.*, "
+                    f"round(ts_rank(search_vector, to_tsquery('simple', ?))::numeric, 6) AS search_rank "
+                    f"FROM {table} WHERE search_vector @@ to_tsquery('simple', ?)) s WHERE 1=1",
+                    [tsquery, tsquery])
+        # Collect ids through both GIN indexes, then rank the union
+        return (f"SELECT * FROM (SELECT {table}.*, round((ts_rank({table}.search_vector, to_tsquery('simple', ?)) "
+                f"+ coalesce(ts_rank(x.search_vector, to_tsquery('simple', ?)) * {side_factor}, 0))::numeric, 6) "
+                f"AS search_rank "
+                f"FROM {table} LEFT JOIN {side} x ON x.{side_key} = {table}.id "
+                f"WHERE {table}.id IN (SELECT id FROM {table} WHERE search_vector @@ to_tsquery('simple', ?) "
+                f"UNION SELECT {side_key} FROM {side} WHERE search_vector @@ to_tsquery('simple', ?))) s WHERE 1=1",
+                [tsquery] * 4)
+
+    if terms and SEARCH_BACKEND == 'fts5':
+        match = ' '.join([f'"{t}"' for t in terms[:-1]] + [f'"{terms[-1]}"*'])
+        # bm25() is lower-is-better; negate so every backend ranks descending
+        sources = [(f'{table}_fts', ', '.join(str(_BM25_WEIGHTS[w]) for _, w in fields), 1)]
+        if side:
+            sources.append((f'{side}_fts', ', '.join(str(_BM25_WEIGHTS[w]) for _, w in SEARCH_FIELDS[side]),
+                            side_factor))
+        union = ' UNION ALL '.join(
+            f'SELECT rowid AS id, -bm25({fts}, {weights}) * {factor} AS r FROM {fts} WHERE {fts} MATCH ?'
+            for fts, weights, factor in sources
+        )
+        return (f'SELECT * FROM (SELECT {table}.*, m.search_rank FROM {table} JOIN '
+                f'(SELECT id, MAX(r) AS search_rank FROM ({union}) u GROUP BY id) m '
+                f'ON m.id = {table}.id) s WHERE 1=1',
+                [match] * len(sources))
+
+    like = ' OR '.join(f'{col} LIKE ?' for col, _ in fields)
+    params = [f'%{q}%'] * len(fields)
+    if side:
+        like += ' OR ' + ' OR '.join(
+            f'id IN (SELECT {side_key} FROM {side} WHERE {col} LIKE ?)' for col, _ in SEARCH_FIELDS[side]
+        )
+        params += [f'%{q}%'] * len(SEARCH_FIELDS[side])
+    return (f'SELECT * FROM (SELECT {table}.*, 0 AS search_rank FROM {table} WHERE {like}) s WHERE 1=1',
+            params)
+
+def rebuild_search_index():
+    conn = get_db_connection()
+    try:
+        c = conn.cursor()
+        for table in SEARCH_FIELDS:
+            ensure_search_index(c, table, rebuild=True)
+        conn.commit()
+    finally:
+        conn.close()
+
+# ─────────────────────────── Facets ─────────────────────────────────
+FACET_COLUMNS = ('subject', 'dept', 'semester', 'category')
+
+def adjust_facets(conn, row, delta):
+    """Add ``delta`` to the count of each facet value of a files row. Caller commits."""
+    for facet in FACET_COLUMNS:
+        value = row.get(facet)
+        if value:
+            conn.execute(
+                'INSERT INTO facet_counts (facet, value, doc_count) VALUES (?, ?, ?) '
+                'ON CONFLICT (facet, value) DO UPDATE SET doc_count = facet_counts.doc_count + excluded.doc_count',
+                (facet, value, delta)
+            )
+
+def _clean_facet_value(value):
+    return ' '.join((value or '').split())
+
+def normalize_facet_columns(conn):
+    """
+    Rewrite files so each facet value has a single spelling: whitespace is
+    collapsed and case variants take the most used form. Returns the number
+    of rows changed. Caller commits.
+    """
+    changed = 0
+    for facet in FACET_COLUMNS:
+        rows = conn.execute(
+            f'SELECT {facet} AS value, COUNT(*) AS n FROM files WHERE {facet} IS NOT NULL GROUP BY {facet}'
+        ).fetchall()
+        groups = {}
+        for r in rows:
+            groups.setdefault(_clean_facet_value(r['value']).lower(), []).append((r['value'], r['n']))
+        for key, variants in groups.items():
+            if not key:
+                continue
+            # Most used spelling wins; ties prefer the more capitalised form ("DBMS" over "dbms")
+            canonical = _clean_facet_value(
+                max(variants, key=lambda v: (v[1], sum(ch.isupper() for ch in v[0]), v[0]))[0])
+            for raw, n in variants:
+                if raw != canonical:
+                    conn.execute(f'UPDATE files SET {facet} = ? WHERE {facet} = ?', (canonical, raw))
+                    changed += n
+    recompute_facets(conn)
+    return changed
+
+FACETS_LOCK_ID = 5150002   # pg advisory lock key serializing recomputes
+
+def recompute_facets(conn):
+    """Rebuild facet_counts from files, correcting any drift. Caller commits."""
+    if conn.is_pg:
+        # Two concurrent rebuilds would collide on the (facet, value) key
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (FACETS_LOCK_ID,))
+    conn.execute('DELETE FROM facet_counts')
+    for facet in FACET_COLUMNS:
+        conn.execute(
+            f"INSERT INTO facet_counts (facet, value, doc_count) "
+            f"SELECT '{facet}', {facet}, COUNT(*) FROM files "
+            f"WHERE {facet} IS NOT NULL AND {facet} != '' GROUP BY {facet}"
+        )
+
+# ─────────────────────────── Migrations ─────────────────────────────
+# Ordered, append-only schema steps. Each step must be safe to re-run on a
+# database that predates this table (every early step uses IF NOT EXISTS).
+def _m001_base_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL CHECK(role IN ('admin','student'))
+    )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL CHECK(role IN ('admin','student'))
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS files (
+        id SERIAL PRIMARY KEY,
+        original_filename TEXT NOT NULL,
+        stored_filename TEXT NOT NULL,
+        uploader_username TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        semester TEXT NOT NULL,
+        category TEXT DEFAULT 'Study Material',
+        dept TEXT DEFAULT 'General',
+        description TEXT,
+        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        file_type TEXT NOT NULL,
+        file_size BIGINT NOT NULL,
+        storage_resource_type TEXT,
+        circular_type TEXT DEFAULT 'standalone', -- 'standalone', 'inter', 'intra'
+        related_circular_ids TEXT -- comma-separated IDs
+    )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        original_filename TEXT NOT NULL,
+        stored_filename TEXT NOT NULL,
+        uploader_username TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        semester TEXT NOT NULL,
+        category TEXT DEFAULT 'Study Material',
+        dept TEXT DEFAULT 'General',
+        description TEXT,
+        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        file_type TEXT NOT NULL,
+        file_size INTEGER NOT NULL,
+        storage_resource_type TEXT,
+        circular_type TEXT DEFAULT 'standalone', -- 'standalone', 'inter', 'intra'
+        related_circular_ids TEXT -- comma-separated IDs
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS comments (
+        id SERIAL PRIMARY KEY,
+        file_id INTEGER NOT NULL,
+        user_id INTEGER,
+        username TEXT,
+        guest_dept TEXT,
+        comment TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS comments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_id INTEGER NOT NULL,
+        user_id INTEGER,
+        username TEXT,
+        guest_dept TEXT,
+        comment TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS notifications (
+        id SERIAL PRIMARY KEY,
+        message TEXT NOT NULL,
+        link TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message TEXT NOT NULL,
+        link TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS events (
+        id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        event_date DATE,
+        event_type TEXT NOT NULL CHECK(event_type IN ('inter', 'intra')),
+        venue TEXT,
+        organizer TEXT,
+        register_link TEXT,
+        image_filename TEXT,
+        storage_resource_type TEXT,
+        uploader_username TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        event_date DATE,
+        event_type TEXT NOT NULL CHECK(event_type IN ('inter', 'intra')),
+        venue TEXT,
+        organizer TEXT,
+        register_link TEXT,
+        image_filename TEXT,
+        storage_resource_type TEXT,
+        uploader_username TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS circulars (
+        id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        dept TEXT,
+        stored_filename TEXT,
+        original_filename TEXT,
+        file_type TEXT,
+        storage_resource_type TEXT,
+        uploader_username TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS circulars (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        dept TEXT,
+        stored_filename TEXT,
+        original_filename TEXT,
+        file_type TEXT,
+        storage_resource_type TEXT,
+        uploader_username TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS event_rsvps (
+        id SERIAL PRIMARY KEY,
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(event_id, user_id)
+    )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS event_rsvps (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(event_id, user_id)
+    )''')
+
+def _m002_column_patches(c):
+    # Columns added to tables after their first release
+    patches = [
+        ('files', 'category', "TEXT DEFAULT 'Study Material'"),
+        ('files', 'dept',     "TEXT DEFAULT 'General'"),
+        ('files', 'description', 'TEXT'),
+        ('files', 'storage_resource_type', 'TEXT'),
+        ('events', 'is_archived', 'BOOLEAN DEFAULT FALSE' if DATABASE_URL else 'INTEGER DEFAULT 0'),
+        ('circulars', 'is_archived', 'BOOLEAN DEFAULT FALSE' if DATABASE_URL else 'INTEGER DEFAULT 0'),
+    ]
+
+    if DATABASE_URL:
+        for table, col, definition in patches:
+            c.execute(f"SELECT 1 FROM information_schema.columns WHERE table_name='{table}' AND column_name='{col}'")
+            if not c.fetchone():
+                c.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
+    else:
+        for table, col, definition in patches:
+            try:
+                c.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
+            except Exception as e:
+                pass
+
+def _m003_file_contents(c):
+    # Text extracted from uploaded documents, one row per file
+    c.execute('''CREATE TABLE IF NOT EXISTS file_contents (
+        file_id INTEGER PRIMARY KEY,
+        content TEXT NOT NULL,
+        extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+def _m004_search_index(c):
+    for table in SEARCH_FIELDS:
+        ensure_search_index(c, table)
+
+def _m005_query_indexes(c):
+    # Listing indexes end in id so keyset pages (sort_col, id) seek directly
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_upload_date ON files (upload_date, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_comments_file_ts ON comments (file_id, timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_event_rsvps_event ON event_rsvps (event_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_events_type_date ON events (event_type, event_date, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_circulars_dept_created ON circulars (dept, created_at, id)')
+
+def _m006_default_admin(c):
+    # Default Administrative Account
+    active_admins = [
+        ('DSCEAdmin', 'DSCE@Admin2552')
+    ]
+    for username, password in active_admins:
+        c.execute("SELECT id FROM users WHERE username = ?", (username, ))
+        if not c.fetchone():
+            c.execute(
+                "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                (username, generate_password_hash(password), 'admin')
+            )
+
+def _m007_facet_counts(c):
+    # Per-value document counts behind the notes filter dropdowns
+    c.execute('''CREATE TABLE IF NOT EXISTS facet_counts (
+        facet TEXT NOT NULL,
+        value TEXT NOT NULL,
+        doc_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (facet, value)
+    )''')
+    recompute_facets(c)
+
+def _m008_exact_filters(c):
+    normalize_facet_columns(c)
+    # Cover the notes filters with the upload_date DESC, id DESC page order
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_subject_date ON files (subject, upload_date, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_dept_date ON files (dept, upload_date, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_semester_date ON files (semester, upload_date, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_category_date ON files (category, upload_date, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_dept_sem_date ON files (dept, semester, upload_date, id)')
+
+def _add_column(c, table, col, definition):
+    if DATABASE_URL:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {col} {definition}')
+        return
+    c.execute(f'PRAGMA table_info({table})')
+    if col not in [r['name'] for r in c.fetchall()]:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
+
+def _m009_event_image_url(c):
+    # Resolved Cloudinary delivery URL, so event_image needs no Admin API call
+    _add_column(c, 'events', 'image_url', 'TEXT')
+
+def _m010_stored_objects(c):
+    # Content-addressed index of stored objects, shared by identical uploads
+    c.execute('''CREATE TABLE IF NOT EXISTS stored_objects (
+        stored_filename TEXT PRIMARY KEY,
+        sha256 TEXT NOT NULL,
+        file_ext TEXT NOT NULL,
+        storage_resource_type TEXT,
+        delivery_url TEXT,
+        size BIGINT,
+        ref_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (sha256, file_ext)
+    )''')
+
+def _m011_jobs(c):
+    # Durable background jobs; times are epoch seconds
+    c.execute(f'''CREATE TABLE IF NOT EXISTS jobs (
+        id {'SERIAL PRIMARY KEY' if DATABASE_URL else 'INTEGER PRIMARY KEY AUTOINCREMENT'},
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued' CHECK(status IN ('queued','running','done','dead')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        run_after BIGINT NOT NULL,
+        locked_at BIGINT,
+        last_error TEXT,
+        created_at BIGINT NOT NULL,
+        updated_at BIGINT NOT NULL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_after, id)')
+
+def _m012_stored_name_indexes(c):
+    # Lets reconcile-storage page through stored names in byte order. Steps
+    # run at import, before later module constants exist, and must not change
+    # once shipped, so the columns are listed here rather than looked up.
+    collate = ' COLLATE "C"' if DATABASE_URL else ''
+    for table, column in (('files', 'stored_filename'), ('events', 'image_filename'),
+                          ('circulars', 'stored_filename')):
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_stored_name ON {table} ({column}{collate}, id)')
+
+def _m013_file_previews(c):
+    # Stored name of the WebP preview, shared by every row using the same object
+    _add_column(c, 'files', 'preview_name', 'TEXT')
+    collate = ' COLLATE "C"' if DATABASE_URL else ''
+    c.execute(f'CREATE INDEX IF NOT EXISTS idx_files_preview_name ON files (preview_name{collate}, id)')
+
+def _m014_image_variants(c):
+    # Width-bounded WebP copies of a stored image, shared by every row using it
+    c.execute(f'''CREATE TABLE IF NOT EXISTS image_variants (
+        id {'SERIAL PRIMARY KEY' if DATABASE_URL else 'INTEGER PRIMARY KEY AUTOINCREMENT'},
+        stored_filename TEXT NOT NULL UNIQUE,
+        source_filename TEXT NOT NULL,
+        width INTEGER NOT NULL,
+        storage_resource_type TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    collate = ' COLLATE "C"' if DATABASE_URL else ''
+    c.execute('CREATE INDEX IF NOT EXISTS idx_image_variants_source ON image_variants (source_filename, width)')
+    c.execute(f'CREATE INDEX IF NOT EXISTS idx_image_variants_stored_name ON image_variants (stored_filename{collate}, id)')
+
+def _m015_direct_upload_claims(c):
+    # One row per published direct-upload ticket, keyed by its stored name, so
+    # that of two submits racing with one ticket only one can claim it. Rows
+    # cannot share that key with the tables: deduped files share stored names.
+    c.execute('''CREATE TABLE IF NOT EXISTS direct_upload_claims (
+        stored_name TEXT PRIMARY KEY,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # Tickets issued before this step may already be published
+    for table, column in (('files', 'stored_filename'), ('events', 'image_filename'),
+                          ('circulars', 'stored_filename')):
+        c.execute(f'INSERT INTO direct_upload_claims (stored_name) SELECT DISTINCT {column} FROM {table} '
+                  f'WHERE {column} IS NOT NULL ON CONFLICT (stored_name) DO NOTHING')
+
+def _m016_job_hosts(c):
+    # Host that must run the job, for jobs reading files left on that host's disk
+    _add_column(c, 'jobs', 'host', 'TEXT')
+
+MIGRATIONS = [
+    (1, 'base tables', _m001_base_tables),
+    (2, 'column patches', _m002_column_patches),
+    (3, 'file contents table', _m003_file_contents),
+    (4, 'full-text search index', _m004_search_index),
+    (5, 'hot query indexes', _m005_query_indexes),
+    (6, 'default admin account', _m006_default_admin),
+    (7, 'facet counts', _m007_facet_counts),
+    (8, 'exact-match filter columns', _m008_exact_filters),
+    (9, 'event image urls', _m009_event_image_url),
+    (10, 'content-addressed objects', _m010_stored_objects),
+    (11, 'background jobs', _m011_jobs),
+    (12, 'stored name indexes', _m012_stored_name_indexes),
+    (13, 'file previews', _m013_file_previews),
+    (14, 'image variants', _m014_image_variants),
+    (15, 'direct upload claims', _m015_direct_upload_claims),
+    (16, 'job hosts', _m016_job_hosts),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+SCHEMA_LOCK_ID = 5150001   # pg advisory lock key guarding migrations
+
+def _current_schema_version(conn):
+    try:
+        row = conn.execute('SELECT MAX(version) AS v FROM schema_version').fetchone()
+        return (row['v'] if row else None) or 0
+    except Exception:
+        conn.rollback()   # Postgres aborts the transaction on a missing table
+        return 0
 
 # ─────────────────────────── Schema Init ────────────────────────────
 @with_retry(max_attempts=5, base_delay=2, circuit_breaker=db_cb)
 def init_db():
+    """Bring the schema up to SCHEMA_VERSION; a current database costs one query."""
     conn = None
     try:
         conn = get_db_connection()
-        c = conn.cursor()
+        version = _current_schema_version(conn)
+        if version >= SCHEMA_VERSION:
+            return
 
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL CHECK(role IN ('admin','student'))
-        )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL CHECK(role IN ('admin','student'))
-        )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS files (
-            id SERIAL PRIMARY KEY,
-            original_filename TEXT NOT NULL,
-            stored_filename TEXT NOT NULL,
-            uploader_username TEXT NOT NULL,
-            subject TEXT NOT NULL,
-            semester TEXT NOT NULL,
-            category TEXT DEFAULT 'Study Material',
-            dept TEXT DEFAULT 'General',
-            description TEXT,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            file_type TEXT NOT NULL,
-            file_size BIGINT NOT NULL,
-            storage_resource_type TEXT,
-            circular_type TEXT DEFAULT 'standalone', -- 'standalone', 'inter', 'intra'
-            related_circular_ids TEXT -- comma-separated IDs
-        )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            original_filename TEXT NOT NULL,
-            stored_filename TEXT NOT NULL,
-            uploader_username TEXT NOT NULL,
-            subject TEXT NOT NULL,
-            semester TEXT NOT NULL,
-            category TEXT DEFAULT 'Study Material',
-            dept TEXT DEFAULT 'General',
-            description TEXT,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            file_type TEXT NOT NULL,
-            file_size INTEGER NOT NULL,
-            storage_resource_type TEXT,
-            circular_type TEXT DEFAULT 'standalone', -- 'standalone', 'inter', 'intra'
-            related_circular_ids TEXT -- comma-separated IDs
-        )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS comments (
-            id SERIAL PRIMARY KEY,
-            file_id INTEGER NOT NULL,
-            user_id INTEGER,
-            username TEXT,
-            guest_dept TEXT,
-            comment TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_id INTEGER NOT NULL,
-            user_id INTEGER,
-            username TEXT,
-            guest_dept TEXT,
-            comment TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS notifications (
-            id SERIAL PRIMARY KEY,
-            message TEXT NOT NULL,
-            link TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message TEXT NOT NULL,
-            link TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS events (
-            id SERIAL PRIMARY KEY,
-            title TEXT NOT NULL,
-            description TEXT,
-            event_date DATE,
-            event_type TEXT NOT NULL CHECK(event_type IN ('inter', 'intra')),
-            venue TEXT,
-            organizer TEXT,
-            register_link TEXT,
-            image_filename TEXT,
-            storage_resource_type TEXT,
-            uploader_username TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            event_date DATE,
-            event_type TEXT NOT NULL CHECK(event_type IN ('inter', 'intra')),
-            venue TEXT,
-            organizer TEXT,
-            register_link TEXT,
-            image_filename TEXT,
-            storage_resource_type TEXT,
-            uploader_username TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS circulars (
-            id SERIAL PRIMARY KEY,
-            title TEXT NOT NULL,
-            description TEXT,
-            dept TEXT,
-            stored_filename TEXT,
-            original_filename TEXT,
-            file_type TEXT,
-            storage_resource_type TEXT,
-            uploader_username TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS circulars (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            dept TEXT,
-            stored_filename TEXT,
-            original_filename TEXT,
-            file_type TEXT,
-            storage_resource_type TEXT,
-            uploader_username TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS event_rsvps (
-            id SERIAL PRIMARY KEY,
-            event_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            username TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(event_id, user_id)
-        )''' if DATABASE_URL else '''CREATE TABLE IF NOT EXISTS event_rsvps (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            event_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            username TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(event_id, user_id)
-        )''')
-
-        # Patch missing columns on existing tables (safe, idempotent)
-        patches = [
-            ('files', 'category', "TEXT DEFAULT 'Study Material'"),
-            ('files', 'dept',     "TEXT DEFAULT 'General'"),
-            ('files', 'description', 'TEXT'),
-            ('files', 'storage_resource_type', 'TEXT'),
-            ('events', 'is_archived', 'BOOLEAN DEFAULT FALSE' if DATABASE_URL else 'INTEGER DEFAULT 0'),
-            ('circulars', 'is_archived', 'BOOLEAN DEFAULT FALSE' if DATABASE_URL else 'INTEGER DEFAULT 0'),
-        ]
-        
+        c = conn.cursor()
         if DATABASE_URL:
-            for table, col, definition in patches:
-                c.execute(f"SELECT 1 FROM information_schema.columns WHERE table_name='{table}' AND column_name='{col}'")
-                if not c.fetchone():
-                    c.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
-        else:
-            for table, col, definition in patches:
-                try:
-                    c.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
-                except Exception as e:
-                    pass
-
-        # Default Administrative Account
-        active_admins = [
-            ('DSCEAdmin', 'DSCE@Admin2552')
-        ]
-        for username, password in active_admins:
-            c.execute("SELECT id FROM users WHERE username = ?", (username, ))
-            if not c.fetchone():
-                c.execute(
-                    "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
-                    (username, generate_password_hash(password), 'admin')
-                )
-
+            # Serialize workers booting at once; the lock ends with each transaction
+            c.execute('SELECT pg_advisory_xact_lock(?)', (SCHEMA_LOCK_ID,))
+        c.execute('CREATE TABLE IF NOT EXISTS schema_version ('
+                  'version INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+                  'applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
         conn.commit()
+
+        for number, name, step in MIGRATIONS:
+            if DATABASE_URL:
+                c.execute('SELECT pg_advisory_xact_lock(?)', (SCHEMA_LOCK_ID,))
+            c.execute('SELECT 1 FROM schema_version WHERE version = ?', (number,))
+            if c.fetchone():
+                conn.commit()
+                continue
+            step(c)
+            c.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (number, name))
+            conn.commit()
+            print(f'[OK] Migration {number} applied: {name}')
+
         print('[OK] Database schema ready')
     except Exception as e:
+        if conn:
+            try: conn.rollback()
+            except: pass
         print(f'[ERROR] DB init: {e}')
+        raise   # never boot against a half-migrated schema
     finally:
         if conn:
             try: conn.close()
             except: pass
 
+boot_timer.mark('app setup')
+
 # Run at startup
 init_db()
+boot_timer.mark('schema check')
 
 # Ensure local upload folder exists (dev fallback)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+@app.cli.command('search-rebuild')
+def search_rebuild_command():
+    """Rebuild the full-text search index for files, events and circulars."""
+    rebuild_search_index()
+    print(f'[OK] Search index rebuilt ({SEARCH_BACKEND})')
+
+@app.cli.command('facets-recompute')
+def facets_recompute_command():
+    """Recount facet values from the files table."""
+    conn = get_db_connection()
+    try:
+        recompute_facets(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    facets_cache.invalidate()
+    print('[OK] Facet counts recomputed')
+
+@app.cli.command('facets-normalize')
+def facets_normalize_command():
+    """Collapse case and whitespace variants of subject/dept/semester/category."""
+    conn = get_db_connection()
+    try:
+        changed = normalize_facet_columns(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    facets_cache.invalidate()
+    print(f'[OK] Normalized {changed} file rows')
+
+@app.cli.command('event-urls-backfill')
+def event_urls_backfill_command():
+    """Resolve and store Cloudinary delivery URLs for existing event images."""
+    if get_storage_type() != 'cloudinary':
+        print('[SKIP] Event image URLs are only stored for Cloudinary storage')
+        return
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('SELECT id, image_filename, storage_resource_type FROM events '
+                            'WHERE image_filename IS NOT NULL AND image_url IS NULL').fetchall()
+        by_type = {}
+        for r in rows:
+            res_type = _cloudinary_res_type(r['image_filename'], r['storage_resource_type'])
+            by_type.setdefault(res_type, []).append(r)
+
+        resolved = 0
+        for res_type, events in by_type.items():
+            # The Admin API resolves up to 100 public_ids per call
+            for i in range(0, len(events), 100):
+                batch = {_cloudinary_public_id(e['image_filename'], res_type)[0]: e['id']
+                         for e in events[i:i + 100]}
+                result = cloudinary.api.resources_by_ids(list(batch), resource_type=res_type,
+                                                         max_results=100)
+                for res in result.get('resources', []):
+                    event_id = batch.get(res['public_id'])
+                    if event_id is not None:
+                        conn.execute('UPDATE events SET image_url = ? WHERE id = ?',
+                                     (res['secure_url'], event_id))
+                        resolved += 1
+                conn.commit()
+    finally:
+        conn.close()
+    print(f'[OK] Resolved {resolved} of {len(rows)} event image URLs')
+
+@app.cli.command('extract-backfill')
+@click.option('--batch-size', default=50, show_default=True, help='Rows fetched per query.')
+@click.option('--force', is_flag=True, help='Re-extract files that already have content.')
+def extract_backfill_command(batch_size, force):
+    """Extract searchable text for existing uploads, streaming through files by id."""
+    exts = sorted(EXTRACTABLE_EXTENSIONS)
+    sql = (f"SELECT id, stored_filename, file_type, storage_resource_type FROM files "
+           f"WHERE id > ? AND file_type IN ({', '.join('?' * len(exts))})")
+    if not force:
+        sql += ' AND id NOT IN (SELECT file_id FROM file_contents)'
+    sql += ' ORDER BY id LIMIT ?'
+
+    last_id, done, failed = 0, 0, 0
+    while True:
+        conn = get_db_connection()
+        rows = conn.execute(sql, [last_id, *exts, batch_size]).fetchall()
+        conn.close()
+        if not rows:
+            break
+        for row in rows:
+            last_id = row['id']
+            fd, path = tempfile.mkstemp(prefix='extract_', suffix='.' + row['file_type'])
+            os.close(fd)
+            try:
+                _download_object(row['stored_filename'], row['storage_resource_type'], path)
+                ok = content_extractor.process(row['id'], path, row['file_type'])
+            except Exception as e:
+                print(f'[WARN] Backfill of file {row["id"]} failed: {e}')
+                ok = False
+            finally:
+                _discard_spool(path)
+            done, failed = done + ok, failed + (not ok)
+        print(f'[BACKFILL] up to id {last_id}: {done} extracted, {failed} failed')
+    print(f'[OK] Extraction backfill complete: {done} extracted, {failed} failed')
+
+@app.cli.command('dedup-backfill')
+@click.option('--batch-size', default=50, show_default=True, help='Rows fetched per query.')
+def dedup_backfill_command(batch_size):
+    """Hash stored objects that predate dedup and merge identical copies."""
+    tracked = merged = failed = 0
+    for _, table, column in DIRECT_UPLOAD_KINDS.values():
+        image_url = 'image_url' if table == 'events' else 'NULL AS image_url'
+        sql = (f'SELECT id, {column} AS stored_name, storage_resource_type, {image_url} FROM {table} '
+               f'WHERE id > ? AND {column} IS NOT NULL '
+               f'AND {column} NOT IN (SELECT stored_filename FROM stored_objects)')
+        if table == 'files':
+            sql += " AND file_type != 'link'"
+        sql += ' ORDER BY id LIMIT ?'
+
+        last_id = 0
+        while True:
+            conn = get_db_connection()
+            rows = conn.execute(sql, (last_id, batch_size)).fetchall()
+            conn.close()
+            if not rows:
+                break
+            for row in rows:
+                last_id = row['id']
+                try:
+                    merged += backfill_object_hash(table, column, row)
+                    tracked += 1
+                except Exception as e:
+                    print(f'[WARN] Hashing {table} {row["id"]} failed: {e}')
+                    failed += 1
+            print(f'[BACKFILL] {table} up to id {last_id}: {tracked} hashed, {merged} merged, {failed} failed')
+    print(f'[OK] Dedup backfill complete: {tracked} hashed, {merged} merged, {failed} failed')
+
+@app.cli.command('previews-backfill')
+@click.option('--batch-size', default=50, show_default=True, help='Rows fetched per query.')
+def previews_backfill_command(batch_size):
+    """Render previews for files that have none, or one from an older version."""
+    exts = sorted(PREVIEWABLE_EXTENSIONS)
+    sql = (f"SELECT id, stored_filename, file_type, storage_resource_type FROM files "
+           f"WHERE id > ? AND file_type IN ({', '.join('?' * len(exts))}) "
+           f"AND (preview_name IS NULL OR preview_name NOT LIKE ?) ORDER BY id LIMIT ?")
+    last_id, done, skipped, failed = 0, 0, 0, 0
+    while True:
+        conn = get_db_connection()
+        rows = conn.execute(sql, [last_id, *exts, f'%_preview{PREVIEW_VERSION}.webp', batch_size]).fetchall()
+        conn.close()
+        if not rows:
+            break
+        for row in rows:
+            last_id = row['id']
+            try:
+                if make_preview(row['stored_filename'], row['storage_resource_type'], row['file_type']):
+                    done += 1
+                else:
+                    skipped += 1
+            except Exception as e:
+                print(f'[WARN] Preview for file {row["id"]} failed: {e}')
+                failed += 1
+        print(f'[BACKFILL] up to id {last_id}: {done} rendered, {skipped} skipped, {failed} failed')
+    print(f'[OK] Preview backfill complete: {done} rendered, {skipped} skipped, {failed} failed')
+
+@app.cli.command('event-variants-backfill')
+@click.option('--batch-size', default=50, show_default=True, help='Rows fetched per query.')
+def event_variants_backfill_command(batch_size):
+    """Render width variants for event images that have none."""
+    if get_storage_type() == 'cloudinary':
+        print('[OK] Cloudinary resizes event images on the fly; nothing to backfill')
+        return
+    sql = ('SELECT id, image_filename, storage_resource_type FROM events WHERE id > ? '
+           'AND image_filename IS NOT NULL '
+           'AND image_filename NOT IN (SELECT source_filename FROM image_variants) ORDER BY id LIMIT ?')
+    last_id, done, skipped, failed, seen = 0, 0, 0, 0, set()
+    while True:
+        conn = get_db_connection()
+        rows = conn.execute(sql, (last_id, batch_size)).fetchall()
+        conn.close()
+        if not rows:
+            break
+        for row in rows:
+            last_id, name = row['id'], row['image_filename']
+            ext = name.rsplit('.', 1)[1].lower() if '.' in name else ''
+            if ext not in IMAGE_EXTENSIONS or name in seen:
+                continue
+            seen.add(name)
+            try:
+                if make_image_variants(name, row['storage_resource_type'], ext):
+                    done += 1
+                else:
+                    skipped += 1    # already no wider than the smallest variant
+            except Exception as e:
+                print(f'[WARN] Variants for event {row["id"]} failed: {e}')
+                failed += 1
+        print(f'[BACKFILL] up to id {last_id}: {done} rendered, {skipped} small enough, {failed} failed')
+    print(f'[OK] Event image backfill complete: {done} rendered, {skipped} small enough, {failed} failed')
+
+@app.cli.command('reconcile-storage')
+@click.option('--purge', is_flag=True, help='Delete stored objects that no row references.')
+@click.option('--purge-rows', is_flag=True, help='Delete rows whose stored object is missing.')
+@click.option('--min-age', default=24.0, show_default=True, help='Hours before an unreferenced object counts as orphaned.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows fetched per query and objects purged per batch.')
+@click.option('--report', type=click.File('w'), help='Write every orphan and dangling row to this file (TSV).')
+@click.option('--local-dir', type=click.Path(exists=True, file_okay=False), help='Compare against this directory instead of the configured storage.')
+def reconcile_storage_command(purge, purge_rows, min_age, batch_size, report, local_dir):
+    """Find stored objects no row uses and rows whose object is missing."""
+    counts = reconcile_storage(min_age=int(min_age * 3600), batch_size=batch_size, purge=purge,
+                               purge_rows=purge_rows, local_dir=local_dir, report=report)
+    print(f'[OK] Reconciled {counts["objects"]} objects: {counts["matched"]} referenced, '
+          f'{counts["orphans"]} orphaned ({counts["young_orphans"]} newer ones skipped), '
+          f'{counts["dangling"]} dangling rows')
+    if purge or purge_rows:
+        print(f'[OK] Purged {counts["purged_objects"]} objects and {counts["purged_rows"]} rows')
+
+@app.cli.command('jobs-work')
+def jobs_work_command():
+    """Run background jobs in this process until interrupted."""
+    print(f'[OK] Job worker started (poll every {JOB_POLL_INTERVAL}s)')
+    try:
+        job_queue.run_forever()
+    except KeyboardInterrupt:
+        job_queue.stop()
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    db = g.pop('_db', None)
+    if db is not None and db.conn is not None:
+        _release_to_pool(db.conn)
+        db.conn = None
+
 # ─────────────────────────── Template Filters ───────────────────────
+@app.template_filter('event_srcset')
+def event_srcset_filter(event):
+    """srcset value listing the width variants of an event image."""
+    return ', '.join(f"{url_for('event_image', event_id=event['id'], w=w)} {w}w"
+                     for w in event.get('image_widths') or [])
+
 @app.template_filter('file_icon')
 def file_icon_filter(filename):
     ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
@@ -509,25 +1442,70 @@ def file_icon_filter(filename):
 def inject_system_vars():
     return {
         'college_name': os.environ.get('COLLEGE_NAME', 'College Notes Platform'),
-        'college_short': os.environ.get('COLLEGE_SHORT', 'College')
+        'college_short': os.environ.get('COLLEGE_SHORT', 'College'),
+        'direct_upload_max': DIRECT_UPLOAD_MAX_BYTES,
+        'chunk_upload_max': CHUNK_UPLOAD_MAX_BYTES,
     }
 
 # ─────────────────────────── Context Processors ─────────────────────
-@app.context_processor
-def inject_notifications():
+def _load_notifications():
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         notifs = conn.execute(
             'SELECT * FROM notifications ORDER BY created_at DESC LIMIT 5'
         ).fetchall()
+    finally:
+        conn.close()
+    processed = []
+    for n in notifs:
+        n = dict(n)
+        if hasattr(n.get('created_at'), 'strftime'):
+            n['created_at'] = n['created_at'].strftime('%Y-%m-%d %H:%M')
+        processed.append(n)
+    return processed
+
+# Invalidated by every route that inserts a notification; the stamp file
+# carries the signal to the other workers on this host.
+notifications_cache = CachedValue(_load_notifications, ttl=NOTIFICATIONS_TTL,
+                                  stamp_path=os.path.join(CACHE_STAMP_DIR, 'noteshare-notifications.stamp'),
+                                  name='notifications')
+
+def _load_facets():
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            'SELECT facet, value, doc_count FROM facet_counts WHERE doc_count > 0 ORDER BY facet, value'
+        ).fetchall()
+    finally:
         conn.close()
-        processed = []
-        for n in notifs:
-            n = dict(n)
-            if hasattr(n.get('created_at'), 'strftime'):
-                n['created_at'] = n['created_at'].strftime('%Y-%m-%d %H:%M')
-            processed.append(n)
-        return dict(notifications=processed)
+    facets = {facet: {} for facet in FACET_COLUMNS}
+    for r in rows:
+        facets.setdefault(r['facet'], {})[r['value']] = r['doc_count']
+    return facets
+
+facets_cache = CachedValue(_load_facets, ttl=FACETS_TTL,
+                           stamp_path=os.path.join(CACHE_STAMP_DIR, 'noteshare-facets.stamp'),
+                           name='facets')
+
+def canonical_facet_value(facet, value):
+    """Map a filter or upload value onto the stored spelling, ignoring case."""
+    value = _clean_facet_value(value)
+    if not value:
+        return value
+    try:
+        known = facets_cache.get().get(facet, {})
+    except Exception:
+        return value
+    if value in known:
+        return value
+    lowered = value.lower()
+    matches = [(n, v) for v, n in known.items() if v.lower() == lowered]
+    return max(matches)[1] if matches else value
+
+@app.context_processor
+def inject_notifications():
+    try:
+        return dict(notifications=notifications_cache.get())
     except Exception:
         return dict(notifications=[])
 
@@ -549,7 +1527,8 @@ def forbidden(e):
 def require_login():
     # These endpoints do NOT require login (Public access)
     public_endpoints = {
-        'login', 'logout', 'static', 'health', 'home', 'firebase_login_token'
+        'login', 'logout', 'static', 'health', 'home', 'firebase_login_token',
+        'prometheus_metrics',   # checks its own token or admin session
     }
     if not request.endpoint or request.endpoint in public_endpoints:
         return
@@ -564,12 +1543,1303 @@ def _cloudinary_res_type(stored_filename, stored_res_type=None):
     ext = stored_filename.rsplit('.', 1)[1].lower() if '.' in stored_filename else ''
     return 'image' if ext in {'jpg','png','jpeg','gif','webp'} else 'raw'
 
+def _cloudinary_public_id(stored_name, res_type):
+    """Split a stored name into (public_id, format) as Cloudinary keys it."""
+    # Image public_ids carry no extension; raw public_ids include it
+    if res_type == 'image' and '.' in stored_name:
+        public_id, fmt = stored_name.rsplit('.', 1)
+        return public_id, fmt.lower()
+    return stored_name, ''
+
+# ─────────────────────────── Object Access ──────────────────────────
+signed_url_cache = TTLCache(maxsize=SIGNED_URL_CACHE_SIZE, name='signed_urls')
+
+def signed_object_url(stored_name, res_type=None, attachment=False, download_name=None):
+    """
+    Signed URL for a private Cloudinary or S3 object, as ``(url, expires_at)``.
+
+    URLs are reused from ``signed_url_cache`` until fewer than
+    SIGNED_URL_MIN_REMAINING seconds of validity are left, so a popular file
+    is signed about once per SIGNED_URL_TTL rather than once per hit.
+    """
+    storage = get_storage_type()
+    if storage == 'cloudinary':
+        res_type = _cloudinary_res_type(stored_name, res_type)
+    # Deduped objects are shared by rows with different filenames, and the
+    # download name is signed into the URL, so it is part of the key
+    key = (stored_name, res_type, bool(attachment), download_name if attachment else None)
+    cached = signed_url_cache.get(key, min_remaining=SIGNED_URL_MIN_REMAINING)
+    if cached:
+        return cached
+
+    expires_at = int(time.time()) + SIGNED_URL_TTL
+    if storage == 'cloudinary':
+        public_id, fmt = _cloudinary_public_id(stored_name, res_type)
+        url = cloudinary.utils.private_download_url(
+            public_id, fmt, resource_type=res_type,
+            type='upload', attachment=attachment,
+            expires_at=expires_at
+        )
+    elif storage == 's3':
+        params = {'Bucket': S3_BUCKET_NAME, 'Key': stored_name}
+        if attachment:
+            params['ResponseContentDisposition'] = f'attachment; filename="{download_name or stored_name}"'
+        url = get_s3_client().generate_presigned_url('get_object', Params=params, ExpiresIn=SIGNED_URL_TTL)
+    else:
+        raise ValueError('Local storage objects have no signed URL')
+
+    signed_url_cache.set(key, url, expires_at)
+    return url, expires_at
+
+def redirect_signed(url, expires_at):
+    """Redirect to a signed URL, letting the browser reuse it while it stays valid."""
+    resp = redirect(url)
+    max_age = max(int(expires_at - time.time()) - SIGNED_URL_MIN_REMAINING, 0)
+    # private: the redirect sits behind login, so shared caches must not replay it
+    resp.headers['Cache-Control'] = f'private, max-age={max_age}'
+    return resp
+
+@timed_storage('download')
+def _download_object(stored_name, res_type, dest):
+    """Copy a stored object to a local path, whichever backend holds it."""
+    if get_storage_type() == 'local':
+        shutil.copyfile(os.path.join(app.config['UPLOAD_FOLDER'], stored_name), dest)
+        return
+    url, _ = signed_object_url(stored_name, res_type)
+    with get_http_session().get(url, stream=True, timeout=(PROXY_CONNECT_TIMEOUT, 60)) as r:
+        r.raise_for_status()
+        with open(dest, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+
+def redirect_immutable(url):
+    """Redirect to a content-addressed delivery URL that never changes."""
+    resp = redirect(url)
+    resp.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return resp
+
+# ─────────────────────────── Inline Proxy ───────────────────────────
+_PROXY_REQUEST_HEADERS  = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+_PROXY_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Encoding', 'Content-Range',
+                           'Accept-Ranges', 'ETag', 'Last-Modified')
+PROXY_CHUNK_SIZE = 64 * 1024
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Keep-alive session shared by every proxied request in this worker."""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=PROXY_POOL_SIZE, pool_maxsize=PROXY_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _http_session = session
+    return _http_session
+
+@timed_storage('proxy')   # up to the upstream's headers; the body streams afterwards
+def proxy_object(stored_name, res_type=None):
+    """
+    Stream a cloud object back inline, forwarding Range and conditional
+    headers so viewers such as PDF.js can seek (206) and revalidate (304).
+    The upstream connection goes back to the pool when the body is done or
+    the client disconnects.
+    """
+    from flask import Response
+
+    url, _ = signed_object_url(stored_name, res_type)
+    headers = {h: request.headers[h] for h in _PROXY_REQUEST_HEADERS if h in request.headers}
+    upstream = get_http_session().get(url, headers=headers, stream=True,
+                                      timeout=(PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT))
+    if upstream.status_code >= 400 and upstream.status_code != 416:
+        upstream.close()
+        print(f'[ERROR] Inline proxy upstream returned {upstream.status_code} for {stored_name}')
+        abort(502)
+
+    def body():
+        try:
+            yield from _iter_upstream(upstream.raw)
+        finally:
+            upstream.close()
+
+    resp = Response(body() if upstream.status_code != 304 else b'',
+                    status=upstream.status_code, direct_passthrough=True)
+    for h in _PROXY_RESPONSE_HEADERS:
+        if h in upstream.headers:
+            resp.headers[h] = upstream.headers[h]
+    resp.headers.setdefault('Accept-Ranges', 'bytes')
+    resp.headers['Cache-Control'] = 'private, no-cache'   # reuse only after revalidating
+    # Runs even if the body generator was never started
+    resp.call_on_close(upstream.close)
+    return resp
+
+def _iter_upstream(raw):
+    """
+    Yield upstream bytes as soon as they arrive rather than once a full
+    chunk has buffered, so a slow origin trickles through to the client.
+    Bytes pass through still encoded, matching the forwarded headers.
+    """
+    read1 = getattr(raw, 'read1', None)    # urllib3 2.x
+    while True:
+        if read1 is not None:
+            chunk = read1(PROXY_CHUNK_SIZE, decode_content=False)
+        else:
+            chunk = raw.read(PROXY_CHUNK_SIZE, decode_content=False)
+        if not chunk:
+            return
+        yield chunk
+
+# ─────────────────────────── Object Cache ───────────────────────────
+object_cache = DiskCache(OBJECT_CACHE_DIR, OBJECT_CACHE_MAX_BYTES, name='objects')
+
+@timed_storage('download')
+def _fetch_for_cache(stored_name, res_type, f):
+    url, _ = signed_object_url(stored_name, res_type)
+    with get_http_session().get(url, stream=True,
+                                timeout=(PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT)) as r:
+        r.raise_for_status()
+        if int(r.headers.get('Content-Length') or 0) > OBJECT_CACHE_MAX_OBJECT:
+            return False
+        written = 0
+        for chunk in r.iter_content(chunk_size=256 * 1024):
+            written += len(chunk)
+            if written > OBJECT_CACHE_MAX_OBJECT:
+                return False
+            f.write(chunk)
+    return True
+
+def serve_object_inline(stored_name, res_type=None):
+    """
+    Serve a cloud object inline from the local disk cache, fetching it once
+    on a miss. send_file handles Range and conditional requests and hands the
+    body to the server's sendfile(). Objects too large to cache are proxied.
+    """
+    if object_cache.enabled:
+        path = object_cache.get(stored_name) or object_cache.fill(
+            stored_name, lambda f: _fetch_for_cache(stored_name, res_type, f))
+        if path:
+            try:
+                resp = send_file(
+                    path,
+                    mimetype=mimetypes.guess_type(stored_name)[0] or 'application/octet-stream',
+                    conditional=True,
+                    # Stored objects never change, so the key is a stable validator;
+                    # the file mtime moves with every LRU touch and would not be
+                    etag=os.path.basename(path).split('.')[0],
+                )
+            except FileNotFoundError:
+                # Evicted by another worker between the lookup and opening it
+                return proxy_object(stored_name, res_type)
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+    return proxy_object(stored_name, res_type)
+
+# ─────────────────────────── Content Extraction ─────────────────────
+def _store_file_content(file_id, text):
+    conn = get_db_connection()
+    try:
+        # Skip files deleted while their text was being extracted
+        conn.execute(
+            'INSERT INTO file_contents (file_id, content) '
+            'SELECT ?, ? WHERE EXISTS (SELECT 1 FROM files WHERE id = ?) '
+            'ON CONFLICT (file_id) DO UPDATE SET content = excluded.content, extracted_at = CURRENT_TIMESTAMP',
+            (file_id, text, file_id)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+content_extractor = ExtractionWorker(
+    _store_file_content,
+    workers=EXTRACT_WORKERS,
+    max_pending=EXTRACT_QUEUE_SIZE,
+    time_budget=EXTRACT_TIME_BUDGET,
+    memory_mb=EXTRACT_MEMORY_MB,
+)
+
+def ingest_upload(file):
+    """The IngestedFile behind an uploaded FileStorage, ingesting it now if needed."""
+    if isinstance(file.stream, IngestedFile):
+        return file.stream.rewind()
+    return IngestedFile.from_stream(file.stream, file.filename, file.content_type)
+
+def _spool_for_extraction(ingested, file_ext):
+    """Hand the extraction worker its own copy of an upload; None if not extractable."""
+    if file_ext not in EXTRACTABLE_EXTENSIONS:
+        return None
+    try:
+        return ingested.copy_to_temp(prefix='extract_', suffix='.' + file_ext)
+    except Exception as e:
+        print(f'[WARN] Could not spool upload for extraction: {e}')
+        return None
+
+def _discard_spool(path):
+    if path:
+        try: os.remove(path)
+        except OSError: pass
+
+# ─────────────────────────── Direct Uploads ─────────────────────────
+# The browser asks for a signed ticket, uploads straight to Cloudinary/S3
+# (or the local endpoint below), then submits the form with the ticket token
+# instead of the file. The upload routes verify the object before recording it.
+DIRECT_UPLOAD_KINDS = {
+    # kind: (stored name prefix, table, stored name column)
+    'files':     ('',          'files',     'stored_filename'),
+    'events':    ('event_',    'events',    'image_filename'),
+    'circulars': ('circular_', 'circulars', 'stored_filename'),
+}
+_direct_upload_signer = URLSafeTimedSerializer(app.secret_key, salt='direct-upload')
+
+def _same_format(a, b):
+    norm = {'jpeg': 'jpg'}
+    return norm.get(a, a) == norm.get(b, b)
+
+def _new_upload_ticket(kind, filename, size, max_bytes):
+    """Validate an upload request and pick its stored name; raises ValueError."""
+    if kind not in DIRECT_UPLOAD_KINDS:
+        raise ValueError('Unknown upload kind')
+    if not allowed_file(filename):
+        raise ValueError('File type not allowed')
+    if not 0 < size <= max_bytes:
+        raise ValueError(f'File too large (Max {max_bytes // (1024 * 1024)}MB)')
+
+    original_filename = secure_filename(filename)
+    file_ext    = original_filename.rsplit('.', 1)[1].lower()
+    stored_name = DIRECT_UPLOAD_KINDS[kind][0] + sanitize_public_id(original_filename) + '.' + file_ext
+    return {
+        'kind': kind, 'stored': stored_name, 'original': original_filename, 'ext': file_ext,
+        'res_type': _cloudinary_res_type(stored_name) if get_storage_type() == 'cloudinary' else 'raw',
+        'type': mimetypes.guess_type(original_filename)[0] or 'application/octet-stream',
+        'user': session.get('user_id'), 'max': max_bytes,
+    }
+
+def direct_upload_ticket(kind, filename, size):
+    """Signed parameters for uploading one file from the browser to storage."""
+    ticket       = _new_upload_ticket(kind, filename, size, DIRECT_UPLOAD_MAX_BYTES)
+    stored_name  = ticket['stored']
+    content_type = ticket['type']
+    res_type     = ticket['res_type']
+    storage      = get_storage_type()
+    token        = _direct_upload_signer.dumps(ticket)
+
+    if storage == 'cloudinary':
+        # overwrite=false: replaying the signed request cannot replace a published object
+        params = {'public_id': stored_name, 'timestamp': int(time.time()), 'overwrite': 'false'}
+        params['signature'] = cloudinary.utils.api_sign_request(params, CLOUDINARY_API_SECRET)
+        params['api_key'] = CLOUDINARY_API_KEY
+        url = cloudinary.utils.cloudinary_api_url('upload', resource_type=res_type)
+        return {'url': url, 'fields': params, 'token': token}
+    if storage == 's3':
+        post = get_s3_client().generate_presigned_post(
+            S3_BUCKET_NAME, stored_name,
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type},
+                        ['content-length-range', 1, DIRECT_UPLOAD_MAX_BYTES]],
+            ExpiresIn=DIRECT_UPLOAD_TTL,
+        )
+        return {'url': post['url'], 'fields': post['fields'], 'token': token}
+    return {'url': url_for('direct_upload_local', token=token), 'fields': {}, 'token': token}
+
+def _load_direct_upload(token, kind):
+    try:
+        ticket = _direct_upload_signer.loads(token, max_age=DIRECT_UPLOAD_TTL)
+    except BadSignature:
+        raise ValueError('Upload expired or invalid. Please try again.')
+    if ticket['kind'] != kind or ticket['user'] != session.get('user_id'):
+        raise ValueError('Upload does not belong to this form.')
+    return ticket
+
+def _inspect_direct_upload(ticket):
+    """
+    Return (size, format, delivery_url) for an uploaded object; raises if it is
+    missing. The format is the ticket's extension only if the object's leading
+    bytes match it: whatever the browser declared, the content decides.
+    """
+    stored_name, storage, ext = ticket['stored'], get_storage_type(), ticket['ext']
+    if storage == 'cloudinary':
+        public_id, _ = _cloudinary_public_id(stored_name, ticket['res_type'])
+        info = cloudinary.api.resource(public_id, resource_type=ticket['res_type'])
+        # Raw resources report no format at all, so read the bytes here too
+        resp = get_http_session().get(info['secure_url'], headers={'Range': f'bytes=0-{SNIFF_BYTES - 1}'},
+                                      stream=True, timeout=(PROXY_CONNECT_TIMEOUT, PROXY_READ_TIMEOUT))
+        try:
+            resp.raise_for_status()
+            start = resp.raw.read(SNIFF_BYTES, decode_content=True)
+        finally:
+            resp.close()
+        fmt = (info.get('format') or ext).lower() if content_matches(start, ext) else ''
+        return int(info.get('bytes') or 0), fmt, info['secure_url']
+    if storage == 's3':
+        s3 = get_s3_client()
+        head = s3.head_object(Bucket=S3_BUCKET_NAME, Key=stored_name)
+        start = s3.get_object(Bucket=S3_BUCKET_NAME, Key=stored_name,
+                              Range=f'bytes=0-{SNIFF_BYTES - 1}')['Body'].read()
+        return int(head['ContentLength']), ext if content_matches(start, ext) else '', None
+    path = os.path.join(app.config['UPLOAD_FOLDER'], stored_name)
+    with open(path, 'rb') as f:
+        start = f.read(SNIFF_BYTES)
+    return os.path.getsize(path), ext if content_matches(start, ext) else '', None
+
+def _claim_direct_upload(stored_name):
+    """Mark a ticket as published; False if another submit already did."""
+    conn = get_db_connection()
+    try:
+        claimed = conn.execute('INSERT INTO direct_upload_claims (stored_name) VALUES (?) '
+                               'ON CONFLICT (stored_name) DO NOTHING', (stored_name,)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    return claimed == 1
+
+def _release_direct_upload(stored_name):
+    conn = get_db_connection()
+    try:
+        conn.execute('DELETE FROM direct_upload_claims WHERE stored_name = ?', (stored_name,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def finalize_direct_upload(token, kind):
+    """
+    Check the object a browser uploaded with a ticket and return its details.
+    Objects that fail the size or type check are deleted; ValueError carries
+    a message for the user.
+    """
+    ticket = _load_direct_upload(token, kind)
+    stored_name, res_type = ticket['stored'], ticket['res_type']
+    if not _claim_direct_upload(stored_name):
+        raise ValueError('This upload has already been published.')
+
+    try:
+        size, fmt, delivery_url = _inspect_direct_upload(ticket)
+    except Exception as e:
+        print(f'[WARN] Direct upload {stored_name} not found in storage: {e}')
+        _release_direct_upload(stored_name)   # the browser may still send it
+        raise ValueError('Upload did not reach storage. Please try again.')
+
+    problem, max_bytes = None, ticket.get('max', DIRECT_UPLOAD_MAX_BYTES)
+    if not 0 < size <= max_bytes:
+        problem = f'File too large (Max {max_bytes // (1024 * 1024)}MB)'
+    elif not _same_format(fmt, ticket['ext']):
+        problem = 'Uploaded file does not match its extension'
+    if problem:
+        conn = get_db_connection()
+        try:
+            schedule_storage_delete(conn, stored_name, res_type)
+            conn.commit()
+        finally:
+            conn.close()
+        raise ValueError(problem)
+
+    return {'original_filename': ticket['original'], 'stored_name': stored_name,
+            'file_ext': ticket['ext'], 'size': size, 'res_type': res_type,
+            'image_url': delivery_url}
+
+def _fetch_for_extraction(stored_name, res_type, file_ext):
+    """Download a stored object to a temp file; runs on the extraction thread."""
+    fd, path = tempfile.mkstemp(prefix='extract_', suffix='.' + file_ext)
+    os.close(fd)
+    try:
+        _download_object(stored_name, res_type, path)
+    except Exception:
+        _discard_spool(path)
+        raise
+    return path
+
+# ─────────────────────────── Chunked Uploads ────────────────────────
+# Large files are sent as numbered chunks that can be retried or resumed.
+# Session state lives on local disk under CHUNK_UPLOAD_DIR (shared by the
+# workers on a host). On S3 each chunk becomes a multipart part as soon as it
+# arrives; Cloudinary and local storage keep chunks on disk until completion.
+# Completion returns a direct-upload token, finalized like any direct upload.
+# Re-sending a whole file to Cloudinary can take minutes, so that hand-off
+# runs as a job pinned to the host holding the chunks, and the browser polls
+# for it. A job worker must run on that host (JOB_WORKERS > 0, or
+# `flask jobs-work` beside the web server); a job that dies marks the
+# session 'failed'.
+_CHUNK_SESSION_ID = re.compile(r'[0-9a-f]{32}')
+
+def _chunk_session_dir(upload_id):
+    if not _CHUNK_SESSION_ID.fullmatch(upload_id):
+        abort(404)
+    return os.path.join(CHUNK_UPLOAD_DIR, upload_id)
+
+def _save_chunk_session(directory, meta):
+    tmp = os.path.join(directory, 'session.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(directory, 'session.json'))
+
+def load_chunk_session(upload_id):
+    """Return (directory, meta) for the current user's upload session, or abort."""
+    directory = _chunk_session_dir(upload_id)
+    try:
+        with open(os.path.join(directory, 'session.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        abort(404)
+    if meta['user'] != session.get('user_id'):
+        abort(403)
+    return directory, meta
+
+def received_chunks(directory):
+    """Indices of chunks that have been stored in full."""
+    return sorted(int(name.split('.')[0]) for name in os.listdir(directory)
+                  if name.endswith(('.part', '.etag')))
+
+def _discard_chunk_session(directory, meta):
+    if meta.get('s3_upload_id'):
+        try:
+            get_s3_client().abort_multipart_upload(Bucket=S3_BUCKET_NAME, Key=meta['stored'],
+                                             UploadId=meta['s3_upload_id'])
+        except Exception as e:
+            print(f'[WARN] Could not abort multipart upload {meta["stored"]}: {e}')
+    shutil.rmtree(directory, ignore_errors=True)
+
+def sweep_chunk_sessions():
+    """Remove upload sessions that have not been touched for CHUNK_UPLOAD_TTL."""
+    cutoff = time.time() - CHUNK_UPLOAD_TTL
+    try:
+        names = os.listdir(CHUNK_UPLOAD_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        directory = os.path.join(CHUNK_UPLOAD_DIR, name)
+        try:
+            if os.path.getmtime(directory) >= cutoff:
+                continue
+            with open(os.path.join(directory, 'session.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        _discard_chunk_session(directory, meta)
+
+def start_chunked_upload(kind, filename, size):
+    """Open a resumable upload session; returns its metadata."""
+    sweep_chunk_sessions()
+    meta = _new_upload_ticket(kind, filename, size, CHUNK_UPLOAD_MAX_BYTES)
+    meta.update(id=uuid.uuid4().hex, size=size, chunk_size=CHUNK_UPLOAD_SIZE,
+                chunks=-(-size // CHUNK_UPLOAD_SIZE), storage=get_storage_type())
+    if meta['storage'] == 's3':
+        meta['s3_upload_id'] = get_s3_client().create_multipart_upload(
+            Bucket=S3_BUCKET_NAME, Key=meta['stored'], ContentType=meta['type'])['UploadId']
+    directory = os.path.join(CHUNK_UPLOAD_DIR, meta['id'])
+    os.makedirs(directory)
+    _save_chunk_session(directory, meta)
+    return meta
+
+@with_retry(max_attempts=3, circuit_breaker=storage_cb)
+def _s3_upload_part(meta, index, path):
+    with open(path, 'rb') as body:
+        return get_s3_client().upload_part(Bucket=S3_BUCKET_NAME, Key=meta['stored'],
+                                     UploadId=meta['s3_upload_id'], PartNumber=index + 1,
+                                     Body=body)['ETag']
+
+def store_chunk(directory, meta, index, stream):
+    """
+    Spool one chunk from the request body to disk, then either send it on as
+    an S3 part or keep it for stitching. Re-sending a chunk replaces it.
+    """
+    if meta.get('state'):
+        raise ValueError('Upload is already complete')
+    if not 0 <= index < meta['chunks']:
+        raise ValueError('Chunk index out of range')
+    expected = min(meta['chunk_size'], meta['size'] - index * meta['chunk_size'])
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        written = 0
+        with os.fdopen(fd, 'wb') as out:
+            while written <= expected:
+                buf = stream.read(1024 * 1024)
+                if not buf:
+                    break
+                written += len(buf)
+                out.write(buf)
+        if written != expected:
+            raise ValueError(f'Chunk {index} should be {expected} bytes, got {written}')
+        if meta['storage'] == 's3':
+            etag = _s3_upload_part(meta, index, tmp)
+            with open(os.path.join(directory, f'{index}.etag.tmp'), 'w') as f:
+                f.write(etag)
+            os.replace(os.path.join(directory, f'{index}.etag.tmp'),
+                       os.path.join(directory, f'{index}.etag'))
+        else:
+            os.replace(tmp, os.path.join(directory, f'{index}.part'))
+    finally:
+        _discard_spool(tmp)
+    os.utime(directory)  # keeps an active session clear of the sweep
+
+def _stitch_chunks(directory, meta, dest):
+    """Concatenate chunk files into dest one at a time, deleting each as it goes."""
+    with open(dest + '.tmp', 'wb') as out:
+        for index in range(meta['chunks']):
+            part = os.path.join(directory, f'{index}.part')
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+            os.remove(part)
+    os.replace(dest + '.tmp', dest)
+
+def complete_chunked_upload(directory, meta):
+    """
+    Assemble the object in storage and return (direct-upload token, stored).
+    For Cloudinary the upload is queued and ``stored`` stays False until the
+    job has finished; the session's ``state`` then becomes 'stored', or
+    'failed' if the job gave up.
+    """
+    if meta.get('state') == 'failed':
+        raise ValueError('Storing the upload failed. Please upload it again.')
+    if meta.get('state') in ('storing', 'stored'):
+        return _chunk_upload_token(meta), meta['state'] == 'stored'
+    missing = sorted(set(range(meta['chunks'])) - set(received_chunks(directory)))
+    if missing:
+        raise ValueError(f'Missing chunks: {missing[:10]}')
+
+    if meta['storage'] == 's3':
+        parts = []
+        for index in range(meta['chunks']):
+            with open(os.path.join(directory, f'{index}.etag')) as f:
+                parts.append({'PartNumber': index + 1, 'ETag': f.read()})
+        get_s3_client().complete_multipart_upload(Bucket=S3_BUCKET_NAME, Key=meta['stored'],
+                                            UploadId=meta['s3_upload_id'],
+                                            MultipartUpload={'Parts': parts})
+    elif meta['storage'] == 'cloudinary':
+        meta['state'] = 'storing'
+        _save_chunk_session(directory, meta)
+        conn = get_db_connection()
+        try:
+            # The chunks are on this host's disk only
+            job_queue.enqueue(conn, 'push_chunked_upload', {'upload_id': meta['id']}, local=True)
+            conn.commit()
+        finally:
+            conn.close()
+        return _chunk_upload_token(meta), False
+    else:
+        _stitch_chunks(directory, meta, os.path.join(app.config['UPLOAD_FOLDER'], meta['stored']))
+
+    shutil.rmtree(directory, ignore_errors=True)
+    return _chunk_upload_token(meta), True
+
+def _chunk_upload_token(meta):
+    ticket = {k: meta[k] for k in ('kind', 'stored', 'original', 'ext', 'res_type', 'type', 'user', 'max')}
+    return _direct_upload_signer.dumps(ticket)
+
+def push_chunked_upload(upload_id):
+    """Job body: stitch a Cloudinary session's chunks and upload the whole file."""
+    directory = _chunk_session_dir(upload_id)
+    with open(os.path.join(directory, 'session.json')) as f:
+        meta = json.load(f)
+    if meta.get('state') == 'stored':
+        return
+    stitched = os.path.join(directory, 'stitched')
+    # A retried job reuses the file stitched by the failed attempt
+    if not os.path.exists(stitched):
+        _stitch_chunks(directory, meta, stitched)
+    # upload_large re-chunks the file itself, reading one chunk at a time
+    cloudinary.uploader.upload_large(stitched, public_id=meta['stored'],
+                                     resource_type=meta['res_type'],
+                                     chunk_size=CHUNK_UPLOAD_SIZE)
+    os.remove(stitched)
+    # The session stays, holding only its state, for the browser's status poll
+    meta['state'] = 'stored'
+    _save_chunk_session(directory, meta)
+
+def fail_chunked_upload(upload_id):
+    """Dead-job hook: report the session as failed to the browser's status poll."""
+    directory = _chunk_session_dir(upload_id)
+    with open(os.path.join(directory, 'session.json')) as f:
+        meta = json.load(f)
+    if meta.get('state') == 'storing':
+        meta['state'] = 'failed'
+        _save_chunk_session(directory, meta)
+    print(f'[ERROR] Chunked upload {upload_id} could not be stored')
+
+# ─────────────────────────── Content Dedup ──────────────────────────
+# Identical uploads share one stored object. stored_objects maps
+# (sha256, extension) to the object and counts the rows that reference it;
+# StorageService.delete only removes the object with its last reference.
+def store_object(ingested, stored_name, file_ext):
+    """
+    Upload an IngestedFile unless identical content is already stored.
+    The reference is counted later, by claim_stored_object, in the same
+    transaction as the row that uses it.
+    """
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            'SELECT stored_filename, storage_resource_type, delivery_url FROM stored_objects '
+            'WHERE sha256 = ? AND file_ext = ? AND ref_count > 0',
+            (ingested.sha256, file_ext)
+        ).fetchone()
+    finally:
+        conn.close()
+    obj = {'sha256': ingested.sha256, 'ext': file_ext, 'size': ingested.size}
+    if row:
+        print(f'[UPLOAD] Reusing stored object {row["stored_filename"]} for identical content')
+        return dict(obj, stored_name=row['stored_filename'], res_type=row['storage_resource_type'],
+                    url=row['delivery_url'], reused=True)
+    res_type, url = StorageService.upload_with_url(ingested, stored_name)
+    return dict(obj, stored_name=stored_name, res_type=res_type, url=url, reused=False)
+
+def claim_stored_object(conn, obj):
+    """
+    Count one more reference to obj inside the caller's transaction and
+    point obj at the object actually referenced. If an identical upload won
+    a race, obj['orphan'] names our now-unused copy, to destroy after commit.
+    """
+    conn.execute(
+        'INSERT INTO stored_objects (sha256, file_ext, stored_filename, storage_resource_type, '
+        'delivery_url, size, ref_count) VALUES (?, ?, ?, ?, ?, ?, 1) '
+        'ON CONFLICT (sha256, file_ext) DO UPDATE SET ref_count = stored_objects.ref_count + 1',
+        (obj['sha256'], obj['ext'], obj['stored_name'], obj['res_type'], obj['url'], obj['size'])
+    )
+    row = conn.execute(
+        'SELECT stored_filename, storage_resource_type, delivery_url, ref_count FROM stored_objects '
+        'WHERE sha256 = ? AND file_ext = ?', (obj['sha256'], obj['ext'])
+    ).fetchone()
+    if obj['reused'] and row['ref_count'] == 1:
+        # The last reference was released after store_object looked; that object is being removed
+        raise ValueError('An identical file was just deleted. Please upload again.')
+    if row['stored_filename'] != obj['stored_name'] and not obj['reused']:
+        obj['orphan'] = obj['stored_name']
+    obj.update(stored_name=row['stored_filename'], res_type=row['storage_resource_type'],
+               url=row['delivery_url'])
+    return obj
+
+def discard_orphan(obj):
+    """Queue removal of a copy that lost an upload race (see claim_stored_object)."""
+    if obj.get('orphan'):
+        conn = get_db_connection()
+        try:
+            job_queue.enqueue(conn, 'storage_delete', {'stored_name': obj['orphan'], 'res_type': obj['res_type']})
+            conn.commit()
+        finally:
+            conn.close()
+
+def release_stored_object(stored_name, conn=None):
+    """
+    Drop one reference; True if nothing references the object any more.
+    With conn, the change joins the caller's transaction.
+    """
+    own = conn is None
+    conn = conn or get_db_connection()
+    try:
+        conn.execute('UPDATE stored_objects SET ref_count = ref_count - 1 WHERE stored_filename = ?',
+                     (stored_name,))
+        row = conn.execute('SELECT ref_count FROM stored_objects WHERE stored_filename = ?',
+                           (stored_name,)).fetchone()
+        if row and row['ref_count'] <= 0:
+            conn.execute('DELETE FROM stored_objects WHERE stored_filename = ?', (stored_name,))
+        if own:
+            conn.commit()
+    finally:
+        if own:
+            conn.close()
+    # Objects stored before dedup, or not yet hashed, are not tracked: delete as before
+    return row is None or row['ref_count'] <= 0
+
+# Every column that can hold a stored object's name: uploads, their previews
+# and image variants. Reconciliation lists and re-checks against all of them.
+OBJECT_NAME_COLUMNS = [(table, column) for _, table, column in DIRECT_UPLOAD_KINDS.values()] + [
+    ('files', 'preview_name'), ('image_variants', 'stored_filename')]
+
+def _object_referenced(conn, stored_name):
+    return any(
+        conn.execute(f'SELECT 1 FROM {table} WHERE {column} = ?', (stored_name,)).fetchone()
+        for table, column in OBJECT_NAME_COLUMNS
+    )
+
+def _hash_stored_object(stored_name, res_type):
+    fd, path = tempfile.mkstemp(prefix='dedup_')
+    os.close(fd)
+    try:
+        _download_object(stored_name, res_type, path)
+        digest, size = hashlib.sha256(), 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        return digest.hexdigest(), size
+    finally:
+        _discard_spool(path)
+
+def backfill_object_hash(table, column, row):
+    """Hash one untracked object and claim it; returns True if it was merged into an identical one."""
+    stored_name, res_type = row['stored_name'], row['storage_resource_type']
+    sha256, size = _hash_stored_object(stored_name, res_type)
+    ext = stored_name.rsplit('.', 1)[1].lower() if '.' in stored_name else ''
+    obj = {'sha256': sha256, 'ext': ext, 'size': size, 'stored_name': stored_name,
+           'res_type': res_type, 'url': row['image_url'], 'reused': False}
+    conn = get_db_connection()
+    try:
+        claim_stored_object(conn, obj)
+        if obj.get('orphan'):
+            conn.execute(f'UPDATE {table} SET {column} = ?, storage_resource_type = ? WHERE id = ?',
+                         (obj['stored_name'], obj['res_type'], row['id']))
+            if table == 'events':
+                conn.execute('UPDATE events SET image_url = ? WHERE id = ?', (obj['url'], row['id']))
+        conn.commit()
+        # Another row may still point at the duplicate until its own turn comes
+        if obj.get('orphan') and _object_referenced(conn, obj['orphan']):
+            obj.pop('orphan')
+    finally:
+        conn.close()
+    discard_orphan(obj)
+    return 'orphan' in obj
+
+# ─────────────────────────── Background Jobs ────────────────────────
+job_queue = JobQueue(
+    get_db_connection,
+    workers=JOB_WORKERS,
+    poll_interval=JOB_POLL_INTERVAL,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    backoff=JOB_BACKOFF,
+)
+
+@job_queue.every(FACETS_RECOMPUTE_INTERVAL)
+def _recompute_facets_periodically():
+    # Upload and delete keep the counts current; this only corrects drift
+    conn = get_db_connection()
+    try:
+        recompute_facets(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    facets_cache.invalidate()
+
+@job_queue.handler('storage_delete')
+def _job_storage_delete(payload):
+    StorageService.destroy(payload['stored_name'], payload.get('res_type'))
+
+@job_queue.handler('extract_content')
+def _job_extract_content(payload):
+    path = _fetch_for_extraction(payload['stored_name'], payload.get('res_type'), payload['ext'])
+    try:
+        if not content_extractor.process(payload['file_id'], path, payload['ext']):
+            raise RuntimeError('extraction failed or timed out')
+    finally:
+        _discard_spool(path)
+
+def _job_chunked_upload_dead(payload):
+    fail_chunked_upload(payload['upload_id'])
+
+@job_queue.handler('push_chunked_upload', on_dead=_job_chunked_upload_dead)
+def _job_push_chunked_upload(payload):
+    push_chunked_upload(payload['upload_id'])
+
+@job_queue.handler('storage_delete_batch')
+def _job_storage_delete_batch(payload):
+    results = StorageService.destroy_many([tuple(item) for item in payload['items']])
+    failed = {k: v for k, v in results.items() if v not in ('deleted', 'not_found')}
+    if failed:
+        # Deletes are idempotent, so the retry simply repeats the whole batch
+        raise RuntimeError(f'{len(failed)} objects not deleted, e.g. {next(iter(failed.items()))}')
+
+def schedule_storage_delete(conn, stored_name, res_type=None, preview_name=None):
+    """
+    Release a reference inside the caller's transaction and, if it was the
+    last one, queue the object (and its preview) for removal. The request
+    only waits for the DB. Returns True if the object was queued.
+    """
+    signed_url_cache.discard_where(lambda key: key[0] == stored_name)
+    object_cache.discard(stored_name)
+    if not release_stored_object(stored_name, conn):
+        return False
+    job_queue.enqueue(conn, 'storage_delete', {'stored_name': stored_name, 'res_type': res_type})
+    derived = release_image_variants(conn, [stored_name]) + ([preview_name] if preview_name else [])
+    for name in derived:
+        job_queue.enqueue(conn, 'storage_delete', {'stored_name': name, 'res_type': 'image'})
+    return True
+
+@app.before_request
+def start_job_workers():
+    # Started on first use so that forked workers each get their own threads
+    job_queue.start()
+
+# ─────────────────────────── Previews ───────────────────────────────
+# Small WebP previews (PDF first page, downscaled image, text snippet) are
+# rendered by a job after upload and stored next to the original. Their
+# names carry PREVIEW_VERSION, so the URLs can be cached as immutable.
+PREVIEW_VERSION = 1
+
+preview_renderer = PreviewRenderer(
+    workers=PREVIEW_WORKERS,
+    width=PREVIEW_WIDTH,
+    time_budget=PREVIEW_TIME_BUDGET,
+    memory_mb=PREVIEW_MEMORY_MB,
+)
+
+def preview_name_for(stored_name):
+    stem = stored_name.rsplit('.', 1)[0] if '.' in stored_name else stored_name
+    return f'{stem}_preview{PREVIEW_VERSION}.webp'
+
+def make_preview(stored_name, res_type, file_ext):
+    """
+    Render and store the preview for a stored object and point every row
+    using it at the preview. Returns False when the type has no preview.
+    """
+    target = preview_name_for(stored_name)
+    conn = get_db_connection()
+    try:
+        current = {r['preview_name'] for r in conn.execute(
+            'SELECT DISTINCT preview_name FROM files WHERE stored_filename = ?', (stored_name,)).fetchall()}
+    finally:
+        conn.close()
+
+    if target not in current:
+        path = _fetch_for_extraction(stored_name, res_type, file_ext)
+        try:
+            data = preview_renderer.render(path, file_ext)
+        finally:
+            _discard_spool(path)
+        if data is None:
+            return False
+        with IngestedFile.from_stream(BytesIO(data), target, 'image/webp') as f:
+            StorageService.upload_with_url(f, target)
+
+    conn = get_db_connection()
+    try:
+        updated = conn.execute('UPDATE files SET preview_name = ? WHERE stored_filename = ?',
+                               (target, stored_name)).rowcount
+        # Previews from an older PREVIEW_VERSION, or ours if the file was deleted meanwhile
+        stale = {name for name in current if name and name != target}
+        if not updated:
+            stale.add(target)
+        for name in stale:
+            job_queue.enqueue(conn, 'storage_delete', {'stored_name': name, 'res_type': 'image'})
+        conn.commit()
+    finally:
+        conn.close()
+    return bool(updated)
+
+@job_queue.handler('make_preview')
+def _job_make_preview(payload):
+    make_preview(payload['stored_name'], payload.get('res_type'), payload['ext'])
+
+def serve_immutable(name):
+    """Serve a stored WebP (preview or image variant) with a year-long immutable lifetime."""
+    storage = get_storage_type()
+    if storage == 'cloudinary':
+        public_id, _ = _cloudinary_public_id(name, 'image')
+        url, _ = cloudinary.utils.cloudinary_url(public_id, resource_type='image', format='webp', secure=True)
+        return redirect_immutable(url)
+    if storage == 's3':
+        resp = serve_object_inline(name, 'raw')
+    else:
+        resp = send_from_directory(app.config['UPLOAD_FOLDER'], name, mimetype='image/webp')
+    resp.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return resp
+
+# ─────────────────────────── Image Variants ─────────────────────────
+# Event images get WebP copies at EVENT_IMAGE_WIDTHS, rendered by a job after
+# upload, so listings can offer a srcset instead of the full-size original.
+# Cloudinary resizes on the fly from transformation URLs, so it needs none.
+def variant_name_for(stored_name, width):
+    stem = stored_name.rsplit('.', 1)[0] if '.' in stored_name else stored_name
+    return f'{stem}_w{width}.webp'
+
+def make_image_variants(stored_name, res_type, file_ext):
+    """Render, store and record the variants of a stored image; returns how many were made."""
+    path = _fetch_for_extraction(stored_name, res_type, file_ext)
+    try:
+        variants = preview_renderer.render_variants(path, EVENT_IMAGE_WIDTHS)
+    finally:
+        _discard_spool(path)
+    for width, data in variants.items():
+        with IngestedFile.from_stream(BytesIO(data), variant_name_for(stored_name, width), 'image/webp') as f:
+            StorageService.upload_with_url(f, f.filename)
+
+    conn = get_db_connection()
+    try:
+        for width in variants:
+            conn.execute(
+                'INSERT INTO image_variants (stored_filename, source_filename, width, storage_resource_type) '
+                'VALUES (?, ?, ?, ?) ON CONFLICT (stored_filename) DO NOTHING',
+                (variant_name_for(stored_name, width), stored_name, width, 'image')
+            )
+        # The image may have been deleted while its variants were rendering
+        if variants and not _object_referenced(conn, stored_name):
+            for name in release_image_variants(conn, [stored_name]):
+                job_queue.enqueue(conn, 'storage_delete', {'stored_name': name, 'res_type': 'image'})
+        conn.commit()
+    finally:
+        conn.close()
+    return len(variants)
+
+@job_queue.handler('make_image_variants')
+def _job_make_image_variants(payload):
+    make_image_variants(payload['stored_name'], payload.get('res_type'), payload['ext'])
+
+def release_image_variants(conn, source_names):
+    """Forget the variants of the given images in the caller's transaction; returns their names."""
+    names = []
+    for i in range(0, len(source_names), BULK_DELETE_CHUNK):
+        chunk = source_names[i:i + BULK_DELETE_CHUNK]
+        marks = ', '.join('?' * len(chunk))
+        names += [r['stored_filename'] for r in conn.execute(
+            f'SELECT stored_filename FROM image_variants WHERE source_filename IN ({marks})', chunk).fetchall()]
+        conn.execute(f'DELETE FROM image_variants WHERE source_filename IN ({marks})', chunk)
+    return names
+
+def _snap_width(width):
+    """The smallest configured width covering the request, else the largest."""
+    return next((w for w in EVENT_IMAGE_WIDTHS if w >= width), EVENT_IMAGE_WIDTHS[-1])
+
+def attach_image_widths(conn, events):
+    """Events as dicts with ``image_widths``: the widths their image can be served at."""
+    events = [dict(e) for e in events]
+    if get_storage_type() == 'cloudinary':
+        for e in events:
+            e['image_widths'] = EVENT_IMAGE_WIDTHS if e['image_filename'] else []
+        return events
+    names = list({e['image_filename'] for e in events if e['image_filename']})
+    widths = {}
+    if names:
+        marks = ', '.join('?' * len(names))
+        for r in conn.execute(f'SELECT source_filename, width FROM image_variants '
+                              f'WHERE source_filename IN ({marks}) ORDER BY width', names).fetchall():
+            widths.setdefault(r['source_filename'], []).append(r['width'])
+    for e in events:
+        e['image_widths'] = widths.get(e['image_filename'], [])
+    return events
+
+def serve_image_variant(stored_name, res_type, width):
+    """Response for an image at the requested width, or None if no variant exists."""
+    width = _snap_width(width)
+    if get_storage_type() == 'cloudinary':
+        public_id, _ = _cloudinary_public_id(stored_name, _cloudinary_res_type(stored_name, res_type))
+        url, _ = cloudinary.utils.cloudinary_url(
+            public_id, resource_type='image', secure=True,
+            transformation=[{'width': width, 'crop': 'limit', 'fetch_format': 'auto', 'quality': 'auto'}])
+        return redirect_immutable(url)
+    conn = get_db_connection()
+    rows = conn.execute('SELECT stored_filename, width FROM image_variants WHERE source_filename = ? '
+                        'ORDER BY width', (stored_name,)).fetchall()
+    conn.close()
+    if not rows:
+        return None
+    chosen = next((r for r in rows if r['width'] >= width), rows[-1])
+    return serve_immutable(chosen['stored_filename'])
+
+# ─────────────────────────── Bulk Delete ────────────────────────────
+BULK_DELETE_CHUNK = 500   # ids per IN (...) query
+
+def bulk_delete(ids):
+    """
+    Delete many files, events and circulars in one transaction.
+    ``ids`` maps a kind ('files', 'events', 'circulars') to a list of ids.
+    Objects that lose their last reference are queued for removal in
+    storage-sized batches. Returns {kind: {id: {'status', 'storage'}}}.
+    """
+    results = {kind: {} for kind in ids}
+    doomed  = []
+    conn = get_db_connection()
+    try:
+        for kind, id_list in ids.items():
+            _, table, column = DIRECT_UPLOAD_KINDS[kind]
+            id_list = list(dict.fromkeys(id_list))
+            for i in range(0, len(id_list), BULK_DELETE_CHUNK):
+                chunk = id_list[i:i + BULK_DELETE_CHUNK]
+                marks = ', '.join('?' * len(chunk))
+                rows  = {r['id']: r for r in conn.execute(
+                    f'SELECT * FROM {table} WHERE id IN ({marks})', chunk).fetchall()}
+                for item_id in chunk:
+                    if item_id not in rows:
+                        results[kind][item_id] = {'status': 'not_found', 'storage': None}
+                if not rows:
+                    continue
+                found = list(rows)
+                found_marks = ', '.join('?' * len(found))
+                conn.execute(f'DELETE FROM {table} WHERE id IN ({found_marks})', found)
+                if kind == 'files':
+                    conn.execute(f'DELETE FROM file_contents WHERE file_id IN ({found_marks})', found)
+
+                for item_id, row in rows.items():
+                    if kind == 'files':
+                        adjust_facets(conn, dict(row), -1)
+                    stored_name = row[column]
+                    if not stored_name or (kind == 'files' and row['file_type'] == 'link'):
+                        storage = None
+                    elif release_stored_object(stored_name, conn):
+                        doomed.append((stored_name, _cloudinary_res_type(stored_name, row['storage_resource_type'])))
+                        preview_name = dict(row).get('preview_name') if kind == 'files' else None
+                        if preview_name:
+                            doomed.append((preview_name, 'image'))
+                        storage = 'queued'
+                    else:
+                        storage = 'shared'    # another upload still uses the object
+                    results[kind][item_id] = {'status': 'deleted', 'storage': storage}
+
+        doomed += [(name, 'image') for name in release_image_variants(conn, [n for n, _ in doomed])]
+        batch = 1000 if get_storage_type() == 's3' else 100
+        for i in range(0, len(doomed), batch):
+            job_queue.enqueue(conn, 'storage_delete_batch', {'items': doomed[i:i + batch]})
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if results.get('files'):
+        facets_cache.invalidate()
+    for name, _ in doomed:
+        signed_url_cache.discard_where(lambda key, name=name: key[0] == name)
+        object_cache.discard(name)
+    return results
+
+# ─────────────────────────── Reconciliation ─────────────────────────
+# Storage and the database are listed as name-sorted streams and
+# merge-joined, so memory stays flat however many objects there are.
+TABLE_KINDS = {table: kind for kind, (_, table, _) in DIRECT_UPLOAD_KINDS.items()}
+
+def iter_storage_objects(local_dir=None):
+    """(name, size, mtime, res_type) for every stored object, sorted by name."""
+    storage = 'local' if local_dir else get_storage_type()
+    if storage == 's3':
+        # list_objects_v2 already returns keys in order
+        pages = get_s3_client().get_paginator('list_objects_v2').paginate(
+            Bucket=S3_BUCKET_NAME, PaginationConfig={'PageSize': 1000})
+        for page in pages:
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['Size'], int(obj['LastModified'].timestamp()), 'raw'
+    elif storage == 'cloudinary':
+        # The Admin API lists by upload time, so each resource type is sorted on disk first
+        yield from heapq.merge(*(external_sort(_iter_cloudinary_resources(rt)) for rt in ('image', 'raw')))
+    else:
+        yield from external_sort(list_directory(local_dir or app.config['UPLOAD_FOLDER']))
+
+def _iter_cloudinary_resources(res_type):
+    cursor = None
+    while True:
+        page = with_retry(max_attempts=3, circuit_breaker=storage_cb)(cloudinary.api.resources)(
+            type='upload', resource_type=res_type, max_results=500, next_cursor=cursor)
+        for r in page.get('resources', []):
+            name = r['public_id']
+            if res_type == 'image' and r.get('format'):
+                name = f"{name}.{r['format']}"
+            created = datetime.strptime(r['created_at'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+            yield name, r.get('bytes', 0), int(created.timestamp()), res_type
+        cursor = page.get('next_cursor')
+        if not cursor:
+            return
+
+def iter_referenced_names(batch_size=1000):
+    """(name, table, id, res_type) for every row that points at a stored object, sorted by name."""
+    return heapq.merge(*(_iter_table_names(table, column, batch_size)
+                         for table, column in OBJECT_NAME_COLUMNS))
+
+def _iter_table_names(table, column, batch_size):
+    col = f'{column} COLLATE "C"' if DATABASE_URL else column
+    links = " AND file_type != 'link'" if column == 'stored_filename' and table == 'files' else ''
+    label = {'preview_name': 'previews'}.get(column, 'variants' if table == 'image_variants' else table)
+    sql = (f'SELECT id, {column} AS name, storage_resource_type FROM {table} '
+           f'WHERE {column} IS NOT NULL{links} AND ({col} > ? OR ({col} = ? AND id > ?)) '
+           f'ORDER BY {col}, id LIMIT ?')
+    last_name, last_id = '', 0
+    while True:
+        # A short-lived connection per page, so a long run holds no pool slot
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(sql, (last_name, last_name, last_id, batch_size)).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            yield row['name'], label, row['id'], row['storage_resource_type']
+        if len(rows) < batch_size:
+            return
+        last_name, last_id = rows[-1]['name'], rows[-1]['id']
+
+def _object_exists(name, res_type, local_dir=None):
+    storage = 'local' if local_dir else get_storage_type()
+    try:
+        if storage == 's3':
+            get_s3_client().head_object(Bucket=S3_BUCKET_NAME, Key=name)
+        elif storage == 'cloudinary':
+            public_id, _ = _cloudinary_public_id(name, _cloudinary_res_type(name, res_type))
+            try:
+                cloudinary.api.resource(public_id, resource_type=_cloudinary_res_type(name, res_type))
+            except cloudinary.exceptions.NotFound:
+                return False
+        else:
+            return os.path.exists(os.path.join(local_dir or app.config['UPLOAD_FOLDER'], name))
+        return True
+    except Exception as e:
+        # botocore's ClientError carries the HTTP status of the failed HEAD
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+def purge_orphans(objects, local_dir=None):
+    """
+    Remove objects the database does not reference, re-checking each one
+    first since rows may have been added while the listing ran.
+    """
+    conn = get_db_connection()
+    try:
+        doomed = [(name, res_type) for name, _, _, res_type in objects
+                  if not _object_referenced(conn, name)]
+        if doomed:
+            marks = ', '.join('?' * len(doomed))
+            conn.execute(f'DELETE FROM stored_objects WHERE stored_filename IN ({marks})',
+                         [name for name, _ in doomed])
+        conn.commit()
+    finally:
+        conn.close()
+    if local_dir:
+        for name, _ in doomed:
+            try: os.remove(os.path.join(local_dir, name))
+            except FileNotFoundError: pass
+        return len(doomed)
+    results = StorageService.destroy_many(doomed)
+    return sum(status in ('deleted', 'not_found') for status in results.values())
+
+def purge_dangling(refs, local_dir=None):
+    """
+    Delete rows whose object is gone, re-checking storage for each one
+    first. A missing preview or image variant only drops the reference to it.
+    """
+    ids, previews, variants = {}, [], []
+    for name, table, row_id, res_type in refs:
+        if table in ('previews', 'variants'):
+            if not _object_exists(name, 'image', local_dir):
+                (previews if table == 'previews' else variants).append(row_id)
+        elif not _object_exists(name, res_type, local_dir):
+            ids.setdefault(TABLE_KINDS[table], []).append(row_id)
+    purged = 0
+    if previews or variants:
+        conn = get_db_connection()
+        try:
+            for sql, row_ids in (('UPDATE files SET preview_name = NULL WHERE id IN ({})', previews),
+                                 ('DELETE FROM image_variants WHERE id IN ({})', variants)):
+                if row_ids:
+                    purged += conn.execute(sql.format(', '.join('?' * len(row_ids))), row_ids).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+    if ids:
+        results = bulk_delete(ids)
+        purged += sum(r['status'] == 'deleted' for kind in results.values() for r in kind.values())
+    return purged
+
+def reconcile_storage(min_age=86400, batch_size=1000, purge=False, purge_rows=False,
+                      local_dir=None, report=None):
+    """
+    Merge-join storage against the database. Orphaned objects younger than
+    ``min_age`` seconds are skipped, since uploads land in storage before
+    their row commits. Returns counts by outcome.
+    """
+    counts  = {'objects': 0, 'matched': 0, 'orphans': 0, 'young_orphans': 0,
+               'dangling': 0, 'purged_objects': 0, 'purged_rows': 0}
+    cutoff  = time.time() - min_age
+    pending_objects, pending_rows = [], []
+
+    def flush():
+        if pending_objects:
+            counts['purged_objects'] += purge_orphans(pending_objects, local_dir)
+            pending_objects.clear()
+        if pending_rows:
+            counts['purged_rows'] += purge_dangling(pending_rows, local_dir)
+            pending_rows.clear()
+
+    objects = ascending(iter_storage_objects(local_dir), 'storage listing')
+    refs    = ascending(iter_referenced_names(batch_size), 'database listing')
+    for outcome, item in merge_join(objects, refs):
+        if outcome != 'dangling':
+            counts['objects'] += 1
+            if counts['objects'] % 100_000 == 0:
+                print(f'[RECONCILE] {counts["objects"]} objects checked')
+        if outcome == 'matched':
+            counts['matched'] += 1
+            continue
+        if outcome == 'orphan' and item[2] > cutoff:
+            counts['young_orphans'] += 1
+            continue
+        counts['orphans' if outcome == 'orphan' else 'dangling'] += 1
+        if report:
+            report.write('\t'.join(str(v) for v in (outcome,) + tuple(item)) + '\n')
+        if outcome == 'orphan' and purge:
+            pending_objects.append(item)
+        elif outcome == 'dangling' and purge_rows:
+            pending_rows.append(item)
+        if len(pending_objects) >= batch_size or len(pending_rows) >= batch_size:
+            flush()
+    flush()
+    return counts
+
+# ─────────────────────────── Pagination ─────────────────────────────
+def _encode_cursor(row, sort_col):
+    """Opaque keyset cursor for the row a page ended on: (sort value, id)."""
+    value = row[sort_col]
+    if isinstance(value, Decimal):
+        value = str(value)   # exact; Postgres casts it back to numeric in the comparison
+    elif hasattr(value, 'isoformat'):
+        value = value.isoformat(sep=' ') if hasattr(value, 'hour') else value.isoformat()
+    raw = json.dumps([value, row['id']], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, row_id = json.loads(raw)
+        return value, int(row_id)
+    except Exception:
+        abort(400)
+
+def fetch_page(conn, sql, params, sort_col, items_per_page, descending=True):
+    """
+    Run a listing query one page at a time, ordered by (sort_col, id).
+
+    ``?after=<cursor>`` seeks past the last row of the previous page using the
+    index; legacy ``?page=N`` links still fall back to OFFSET. One extra row is
+    fetched so ``has_more`` is exact. Returns (rows, page, has_more, next_cursor).
+    """
+    after = request.args.get('after', '')
+    page  = max(int(request.args.get('page', 1)), 1)
+    direction, op = ('DESC', '<') if descending else ('ASC', '>')
+    params = list(params)
+
+    if after:
+        value, row_id = _decode_cursor(after)
+        sql += f' AND ({sort_col}, id) {op} (?, ?)'
+        params += [value, row_id]
+
+    sql += f' ORDER BY {sort_col} {direction}, id {direction} LIMIT ?'
+    params.append(items_per_page + 1)
+    if not after and page > 1:
+        sql += ' OFFSET ?'
+        params.append((page - 1) * items_per_page)
+
+    rows = conn.execute(sql, params).fetchall()
+    has_more = len(rows) > items_per_page
+    rows = rows[:items_per_page]
+    next_cursor = _encode_cursor(rows[-1], sort_col) if has_more else None
+    return rows, page, has_more, next_cursor
+
 # ─────────────────────────── Routes ─────────────────────────────────
 @app.route('/monitoring')
 def monitoring():
     if session.get('role') != 'admin':
         abort(403)
-    return jsonify(get_monitoring_stats())
+    return jsonify(dict(get_monitoring_stats(), db_pool=db_pool.stats(),
+                        object_cache=object_cache.stats(),
+                        jobs=job_queue.stats(recent=0)['counts'],
+                        startup=boot_timer.report(),
+                        caches=[notifications_cache.stats(), facets_cache.stats(),
+                                signed_url_cache.stats()]))
+
+@app.route('/metrics')
+def prometheus_metrics():
+    from flask import Response
+    supplied = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(supplied.encode(),
+                                                           f'Bearer {METRICS_TOKEN}'.encode())
+    if not token_ok and session.get('role') != 'admin':
+        abort(403)
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/health')
 def health():
@@ -587,19 +2857,19 @@ def home():
     conn = get_db_connection()
     
     # Handle AJAX for pagination if needed
-    page = int(request.args.get('page', 1))
     items_per_page = 6
     
-    sql = 'SELECT * FROM files ORDER BY upload_date DESC LIMIT ? OFFSET ?'
-    files = conn.execute(sql, [items_per_page, (page - 1) * items_per_page]).fetchall()
-    has_more = len(files) == items_per_page
+    files, page, has_more, next_cursor = fetch_page(
+        conn, 'SELECT * FROM files WHERE 1=1', [], 'upload_date', items_per_page)
     
     conn.close()
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return render_template('_latest_uploads.html', latest_files=files, page=page, has_more=has_more)
+        return render_template('_latest_uploads.html', latest_files=files, page=page,
+                               has_more=has_more, next_cursor=next_cursor)
         
-    return render_template('home.html', latest_files=files, page=page, has_more=has_more)
+    return render_template('home.html', latest_files=files, page=page,
+                           has_more=has_more, next_cursor=next_cursor)
 
 @app.route('/notes')
 def notes():
@@ -609,99 +2879,89 @@ def notes():
     semester = request.args.get('semester', '')
     category = request.args.get('category', '')
     dept     = request.args.get('dept', '')
-    page     = int(request.args.get('page', 1))
     items_per_page = 9
 
+    sort_col = 'upload_date'
     sql, params = 'SELECT * FROM files WHERE 1=1', []
     if q:
-        sql += ' AND (original_filename LIKE ? OR subject LIKE ?)'
-        params += [f'%{q}%', f'%{q}%']
+        sql, params = search_query('files', q)
+        sort_col = 'search_rank'
+    # Dropdown values match exactly so the composite indexes apply
     if subject:
-        sql += ' AND subject LIKE ?';  params.append(f'%{subject}%')
+        sql += ' AND subject = ?';  params.append(canonical_facet_value('subject', subject))
     if semester:
-        sql += ' AND semester LIKE ?'; params.append(f'%{semester}%')
+        sql += ' AND semester = ?'; params.append(canonical_facet_value('semester', semester))
     if category:
-        sql += ' AND category LIKE ?'; params.append(f'%{category}%')
+        sql += ' AND category = ?'; params.append(canonical_facet_value('category', category))
     if dept:
-        sql += ' AND dept LIKE ?';     params.append(f'%{dept}%')
+        sql += ' AND dept = ?';     params.append(canonical_facet_value('dept', dept))
 
-    sql += ' ORDER BY upload_date DESC LIMIT ? OFFSET ?'
-    params += [items_per_page, (page - 1) * items_per_page]
-    files = conn.execute(sql, params).fetchall()
+    files, page, has_more, next_cursor = fetch_page(conn, sql, params, sort_col, items_per_page)
 
-    subjects_query = conn.execute("SELECT DISTINCT subject FROM files WHERE subject IS NOT NULL AND subject != '' ORDER BY subject ASC").fetchall()
-    all_subjects = [r['subject'] for r in subjects_query]
-
-    has_more = len(files) == items_per_page
     conn.close()
-    return render_template('notes.html', files=files, page=page, has_more=has_more, all_subjects=all_subjects)
+    return render_template('notes.html', files=files, page=page, has_more=has_more,
+                           next_cursor=next_cursor, facets=facets_cache.get())
 
 @app.route('/inter')
 def inter_events_route():
     conn = get_db_connection()
     q = request.args.get('q', '')
-    page = int(request.args.get('page', 1))
     items_per_page = 6
 
-    evt_q = ''
-    evt_params = []
     if q:
-        evt_q += ' AND (title LIKE ? OR description LIKE ? OR organizer LIKE ?)'
-        evt_params += [f'%{q}%', f'%{q}%', f'%{q}%']
-
-    inter_sql = f"SELECT * FROM events WHERE event_type='inter'{evt_q} ORDER BY event_date ASC LIMIT ? OFFSET ?"
-    inter_params = evt_params + [items_per_page, (page - 1) * items_per_page]
-    events = conn.execute(inter_sql, inter_params).fetchall()
+        inter_sql, evt_params = search_query('events', q)
+        inter_sql += " AND event_type='inter'"
+        events, page, has_more, next_cursor = fetch_page(
+            conn, inter_sql, evt_params, 'search_rank', items_per_page)
+    else:
+        inter_sql = "SELECT * FROM events WHERE event_type='inter'"
+        events, page, has_more, next_cursor = fetch_page(
+            conn, inter_sql, [], 'event_date', items_per_page, descending=False)
 
-    has_more = len(events) == items_per_page
+    events = attach_image_widths(conn, events)
     conn.close()
-    return render_template('inter.html', events=events, page=page, has_more=has_more)
+    return render_template('inter.html', events=events, page=page, has_more=has_more, next_cursor=next_cursor)
 
 @app.route('/intra')
 def intra_events_route():
     conn = get_db_connection()
     q = request.args.get('q', '')
-    page = int(request.args.get('page', 1))
     items_per_page = 6
 
-    evt_q = ''
-    evt_params = []
     if q:
-        evt_q += ' AND (title LIKE ? OR description LIKE ? OR organizer LIKE ?)'
-        evt_params += [f'%{q}%', f'%{q}%', f'%{q}%']
-
-    intra_sql = f"SELECT * FROM events WHERE event_type='intra'{evt_q} ORDER BY event_date ASC LIMIT ? OFFSET ?"
-    intra_params = evt_params + [items_per_page, (page - 1) * items_per_page]
-    events = conn.execute(intra_sql, intra_params).fetchall()
+        intra_sql, evt_params = search_query('events', q)
+        intra_sql += " AND event_type='intra'"
+        events, page, has_more, next_cursor = fetch_page(
+            conn, intra_sql, evt_params, 'search_rank', items_per_page)
+    else:
+        intra_sql = "SELECT * FROM events WHERE event_type='intra'"
+        events, page, has_more, next_cursor = fetch_page(
+            conn, intra_sql, [], 'event_date', items_per_page, descending=False)
 
-    has_more = len(events) == items_per_page
+    events = attach_image_widths(conn, events)
     conn.close()
-    return render_template('intra.html', events=events, page=page, has_more=has_more)
+    return render_template('intra.html', events=events, page=page, has_more=has_more, next_cursor=next_cursor)
 
 @app.route('/circulars')
 def circulars_route():
     conn = get_db_connection()
     q = request.args.get('q', '')
     dept = request.args.get('dept', '')
-    page = int(request.args.get('page', 1))
     items_per_page = 8
 
-    circ_q = ''
-    circ_params = []
+    sort_col = 'created_at'
+    circ_sql, circ_params = 'SELECT * FROM circulars WHERE 1=1', []
     if q:
-        circ_q += ' AND (title LIKE ? OR description LIKE ?)'
-        circ_params += [f'%{q}%', f'%{q}%']
+        circ_sql, circ_params = search_query('circulars', q)
+        sort_col = 'search_rank'
     if dept:
-        circ_q += ' AND (dept = ? OR dept = ?)'
+        circ_sql += ' AND (dept = ? OR dept = ?)'
         circ_params += [dept, 'All']
 
-    circ_sql = f"SELECT * FROM circulars WHERE 1=1{circ_q} ORDER BY created_at DESC LIMIT ? OFFSET ?"
-    circ_params += [items_per_page, (page - 1) * items_per_page]
-    circulars = conn.execute(circ_sql, circ_params).fetchall()
+    circulars, page, has_more, next_cursor = fetch_page(conn, circ_sql, circ_params, sort_col, items_per_page)
 
-    has_more = len(circulars) == items_per_page
     conn.close()
-    return render_template('circulars.html', circulars=circulars, page=page, has_more=has_more)
+    return render_template('circulars.html', circulars=circulars, page=page, has_more=has_more, next_cursor=next_cursor)
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -734,7 +2994,8 @@ def relogin():
 @app.route('/auth/firebase', methods=['POST'])
 def firebase_login_token():
     # ... (existing initialization checks)
-    if not firebase_admin._apps:
+    firebase_auth = get_firebase_auth()
+    if firebase_auth is None:
         return jsonify({'error': 'Authentication service unavailable.'}), 500
     
     token = request.json.get('token')
@@ -743,13 +3004,12 @@ def firebase_login_token():
     
     try:
         try:
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = firebase_auth.verify_id_token(token)
         except Exception as e:
             # Handle clock skew: if token is "too early", wait and retry
             if 'Token used too early' in str(e):
-                import time
-                time.sleep(2)
-                decoded_token = auth.verify_id_token(token)
+                cooperative_sleep(2)
+                decoded_token = firebase_auth.verify_id_token(token)
             else:
                 raise e
 
@@ -784,6 +3044,89 @@ def firebase_login_token():
         print(f'[AUTH ERROR] {e}')
         return jsonify({'error': str(e)}), 401
 
+@app.route('/upload/sign', methods=['POST'])
+def direct_upload_sign():
+    if session.get('role') != 'admin':
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    try:
+        ticket = direct_upload_ticket(data.get('kind', ''), data.get('filename', ''),
+                                      int(data.get('size') or 0))
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(ticket)
+
+@app.route('/upload/direct/<token>', methods=['POST'])
+@csrf.exempt
+def direct_upload_local(token):
+    """Local-storage stand-in for the Cloudinary/S3 upload endpoints."""
+    if get_storage_type() != 'local':
+        abort(404)
+    try:
+        ticket = _direct_upload_signer.loads(token, max_age=DIRECT_UPLOAD_TTL)
+    except BadSignature:
+        abort(403)
+    if ticket['user'] != session.get('user_id'):
+        abort(403)
+    file = request.files.get('file')
+    if not file:
+        abort(400)
+
+    ingested = ingest_upload(file)
+    if ingested.size > ticket.get('max', DIRECT_UPLOAD_MAX_BYTES):
+        abort(413)
+    if not ingested.matches_extension(ticket['ext']):
+        abort(415)
+    target = os.path.join(app.config['UPLOAD_FOLDER'], ticket['stored'])
+    tmp = f'{target}.{uuid.uuid4().hex}.part'
+    ingested.save(tmp)
+    try:
+        # Tickets are single-use: linking fails if a replay already stored the object
+        os.link(tmp, target)
+    except FileExistsError:
+        abort(409)
+    finally:
+        os.remove(tmp)
+    return '', 204
+
+@app.route('/upload/chunks', methods=['POST'])
+def chunked_upload_start():
+    if session.get('role') != 'admin':
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    try:
+        meta = start_chunked_upload(data.get('kind', ''), data.get('filename', ''),
+                                    int(data.get('size') or 0))
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(upload_id=meta['id'], chunk_size=meta['chunk_size'],
+                   chunks=meta['chunks'], received=[])
+
+@app.route('/upload/chunks/<upload_id>')
+def chunked_upload_status(upload_id):
+    directory, meta = load_chunk_session(upload_id)
+    return jsonify(upload_id=upload_id, chunk_size=meta['chunk_size'], chunks=meta['chunks'],
+                   received=received_chunks(directory), state=meta.get('state', 'uploading'))
+
+@app.route('/upload/chunks/<upload_id>/<int:index>', methods=['PUT'])
+def chunked_upload_put(upload_id, index):
+    directory, meta = load_chunk_session(upload_id)
+    try:
+        store_chunk(directory, meta, index, request.stream)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(received=index)
+
+@app.route('/upload/chunks/<upload_id>/complete', methods=['POST'])
+def chunked_upload_complete(upload_id):
+    directory, meta = load_chunk_session(upload_id)
+    try:
+        token, stored = complete_chunked_upload(directory, meta)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    # 202: the token is valid once GET /upload/chunks/<id> reports state 'stored'
+    return jsonify(token=token, stored=stored), 200 if stored else 202
+
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_file():
     if 'user_id' not in session:
@@ -796,10 +3139,10 @@ def upload_file():
     if request.method == 'POST':
         file       = request.files.get('file')
         drive_link = request.form.get('drive_link', '').strip()
-        subject    = request.form.get('subject', '').strip()
-        semester   = request.form.get('semester', '1')
-        category   = request.form.get('category', 'Study Material')
-        dept       = request.form.get('dept', 'General')
+        subject    = canonical_facet_value('subject', request.form.get('subject', ''))
+        semester   = canonical_facet_value('semester', request.form.get('semester', '1'))
+        category   = canonical_facet_value('category', request.form.get('category', 'Study Material'))
+        dept       = canonical_facet_value('dept', request.form.get('dept', 'General'))
         description = request.form.get('description', '').strip()
         circular_type = request.form.get('circular_type', 'standalone')
         related_ids   = request.form.get('related_circular_ids', '').strip()
@@ -833,7 +3176,10 @@ def upload_file():
                 if session.get('role') == 'admin' and file_id:
                     conn.execute('INSERT INTO notifications (message, link) VALUES (?, ?)',
                                  (f'New {subject} link by Admin', url_for('view_file_page', file_id=file_id)))
+                adjust_facets(conn, {'subject': subject, 'dept': dept, 'semester': semester, 'category': category}, 1)
                 conn.commit()
+                notifications_cache.invalidate()
+                facets_cache.invalidate()
                 flash('Link shared successfully!', 'success')
                 return redirect(url_for('notes'))
             except Exception as e:
@@ -843,36 +3189,60 @@ def upload_file():
             finally:
                 conn.close()
 
-        # ── File upload ──
-        if not file or file.filename == '':
-            flash('No file selected', 'error')
-            return redirect(request.url)
+        # ── Direct upload: the browser already put the file in storage ──
+        upload_token = request.form.get('upload_token')
+        if upload_token:
+            try:
+                direct = finalize_direct_upload(upload_token, 'files')
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(request.url)
+            original_filename = direct['original_filename']
+            file_ext          = direct['file_ext']
+            stored_name       = direct['stored_name']
+            file_length       = direct['size']
+            res_type          = direct['res_type']
+            extract_path      = None
+            stored            = None
+        else:
+            # ── File upload ──
+            if not file or file.filename == '':
+                flash('No file selected', 'error')
+                return redirect(request.url)
 
-        if not allowed_file(file.filename):
-            flash('File type not allowed', 'error')
-            return redirect(request.url)
+            if not allowed_file(file.filename):
+                flash('File type not allowed', 'error')
+                return redirect(request.url)
 
-        file.seek(0, os.SEEK_END)
-        file_length = file.tell()
-        file.seek(0)
+            ingested    = ingest_upload(file)
+            file_length = ingested.size
 
-        if file_length > 30 * 1024 * 1024:
-            flash('File too large (Max 30MB). Use the Drive Link option.', 'error')
-            return redirect(request.url)
+            if file_length > 30 * 1024 * 1024:
+                flash('File too large (Max 30MB). Use the Drive Link option.', 'error')
+                return redirect(request.url)
 
-        original_filename = secure_filename(file.filename)
-        file_ext          = original_filename.rsplit('.', 1)[1].lower()
-        stored_name       = sanitize_public_id(original_filename) + '.' + file_ext
-        res_type          = 'auto'
+            original_filename = secure_filename(file.filename)
+            file_ext          = original_filename.rsplit('.', 1)[1].lower()
+            if not ingested.matches_extension(file_ext):
+                flash('File content does not match its extension', 'error')
+                return redirect(request.url)
 
-        try:
-            res_type = StorageService.upload(file, stored_name)
-        except Exception as e:
-            flash(f'Upload failed after retries: {e}', 'error')
-            return redirect(request.url)
+            stored_name       = sanitize_public_id(original_filename) + '.' + file_ext
+            res_type          = 'auto'
+            extract_path      = _spool_for_extraction(ingested, file_ext)
+
+            try:
+                stored = store_object(ingested, stored_name, file_ext)
+            except Exception as e:
+                _discard_spool(extract_path)
+                flash(f'Upload failed after retries: {e}', 'error')
+                return redirect(request.url)
 
         conn = get_db_connection()
         try:
+            if stored:
+                claim_stored_object(conn, stored)
+                stored_name, res_type = stored['stored_name'], stored['res_type']
             cursor = conn.cursor()
             if DATABASE_URL:
                 sql = ('INSERT INTO files (original_filename, stored_filename, uploader_username, '
@@ -895,13 +3265,32 @@ def upload_file():
                 conn.execute('INSERT INTO notifications (message, link) VALUES (?, ?)',
                              (f'New {subject} note by Admin: {original_filename}',
                               url_for('view_file_page', file_id=file_id)))
+            adjust_facets(conn, {'subject': subject, 'dept': dept, 'semester': semester, 'category': category}, 1)
+            if upload_token and file_id and file_ext in EXTRACTABLE_EXTENSIONS:
+                # The file never passed through this server; a job fetches it for extraction
+                job_queue.enqueue(conn, 'extract_content', {'file_id': file_id, 'stored_name': stored_name,
+                                                            'res_type': res_type, 'ext': file_ext},
+                                  max_attempts=2)
+            if file_id and file_ext in PREVIEWABLE_EXTENSIONS:
+                job_queue.enqueue(conn, 'make_preview', {'stored_name': stored_name, 'res_type': res_type,
+                                                         'ext': file_ext}, max_attempts=2)
             conn.commit()
+            notifications_cache.invalidate()
+            facets_cache.invalidate()
         except Exception as e:
             print(f'[UPLOAD DB ERROR] {e}')
+            _discard_spool(extract_path)
             flash(f'Database error: {e}', 'error')
             return redirect(request.url)
         finally:
             conn.close()
+        if stored:
+            discard_orphan(stored)
+
+        if extract_path and file_id:
+            content_extractor.submit(file_id, extract_path, file_ext)
+        else:
+            _discard_spool(extract_path)
 
         flash('File uploaded successfully!', 'success')
         return redirect(url_for('notes'))
@@ -933,37 +3322,60 @@ def upload_event():
 
         res_type = None
         stored_name = None
-        if file and file.filename != '':
+        image_url = None
+        stored = None
+        if request.form.get('upload_token'):
+            try:
+                direct = finalize_direct_upload(request.form['upload_token'], 'events')
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(request.url)
+            stored_name, res_type, image_url = direct['stored_name'], direct['res_type'], direct['image_url']
+        elif file and file.filename != '':
             if not allowed_file(file.filename):
                 flash('File type not allowed', 'error')
                 return redirect(request.url)
             original_filename = secure_filename(file.filename)
             file_ext = original_filename.rsplit('.', 1)[1].lower()
+            ingested = ingest_upload(file)
+            if not ingested.matches_extension(file_ext):
+                flash('File content does not match its extension', 'error')
+                return redirect(request.url)
             stored_name = 'event_' + sanitize_public_id(file.filename) + '.' + file_ext
             try:
-                res_type = StorageService.upload(file, stored_name)
+                stored = store_object(ingested, stored_name, file_ext)
             except Exception as e:
                 flash(f'Upload failed: {e}', 'error')
                 return redirect(request.url)
 
         conn = get_db_connection()
         try:
+            if stored:
+                claim_stored_object(conn, stored)
+                stored_name, res_type, image_url = stored['stored_name'], stored['res_type'], stored['url']
             if DATABASE_URL:
-                sql = ('INSERT INTO events (title, description, event_date, event_type, venue, organizer, register_link, image_filename, storage_resource_type, uploader_username) '
-                       'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id')
+                sql = ('INSERT INTO events (title, description, event_date, event_type, venue, organizer, register_link, image_filename, storage_resource_type, image_url, uploader_username) '
+                       'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id')
                 pg_cur = conn.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-                pg_cur.execute(sql, (title, description, event_date, event_type, venue, organizer, register_link, stored_name, res_type, session['username']))
+                pg_cur.execute(sql, (title, description, event_date, event_type, venue, organizer, register_link, stored_name, res_type, image_url, session['username']))
                 row = pg_cur.fetchone()
                 event_id = row['id'] if row else None
             else:
-                sql = ('INSERT INTO events (title, description, event_date, event_type, venue, organizer, register_link, image_filename, storage_resource_type, uploader_username) '
-                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
-                cursor = conn.execute(sql, (title, description, event_date, event_type, venue, organizer, register_link, stored_name, res_type, session['username']))
+                sql = ('INSERT INTO events (title, description, event_date, event_type, venue, organizer, register_link, image_filename, storage_resource_type, image_url, uploader_username) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+                cursor = conn.execute(sql, (title, description, event_date, event_type, venue, organizer, register_link, stored_name, res_type, image_url, session['username']))
                 event_id = cursor.lastrowid
             if session.get('role') == 'admin' and event_id:
                 conn.execute('INSERT INTO notifications (message, link) VALUES (?, ?)',
                              (f'New {event_type} event: {title}', url_for('inter_events_route' if event_type == 'inter' else 'intra_events_route')))
+            image_ext = stored_name.rsplit('.', 1)[1].lower() if stored_name and '.' in stored_name else ''
+            if event_id and image_ext in IMAGE_EXTENSIONS and get_storage_type() != 'cloudinary':
+                job_queue.enqueue(conn, 'make_image_variants', {'stored_name': stored_name, 'res_type': res_type,
+                                                                'ext': image_ext}, max_attempts=2)
             conn.commit()
+            notifications_cache.invalidate()
+            if stored:
+                discard_orphan(stored)
             flash('Event created successfully!', 'success')
             return redirect(url_for('inter_events_route' if event_type == 'inter' else 'intra_events_route'))
         except Exception as e:
@@ -998,21 +3410,37 @@ def upload_circular():
         stored_name = None
         original_filename = None
         file_ext = None
-        if file and file.filename != '':
+        stored = None
+        if request.form.get('upload_token'):
+            try:
+                direct = finalize_direct_upload(request.form['upload_token'], 'circulars')
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(request.url)
+            original_filename, file_ext = direct['original_filename'], direct['file_ext']
+            stored_name, res_type = direct['stored_name'], direct['res_type']
+        elif file and file.filename != '':
             if not allowed_file(file.filename):
                 flash('File type not allowed', 'error')
                 return redirect(request.url)
             original_filename = secure_filename(file.filename)
             file_ext = original_filename.rsplit('.', 1)[1].lower()
+            ingested = ingest_upload(file)
+            if not ingested.matches_extension(file_ext):
+                flash('File content does not match its extension', 'error')
+                return redirect(request.url)
             stored_name = 'circular_' + sanitize_public_id(file.filename) + '.' + file_ext
             try:
-                res_type = StorageService.upload(file, stored_name)
+                stored = store_object(ingested, stored_name, file_ext)
             except Exception as e:
                 flash(f'Upload failed: {e}', 'error')
                 return redirect(request.url)
 
         conn = get_db_connection()
         try:
+            if stored:
+                claim_stored_object(conn, stored)
+                stored_name, res_type = stored['stored_name'], stored['res_type']
             if DATABASE_URL:
                 sql = ('INSERT INTO circulars (title, description, dept, stored_filename, original_filename, file_type, storage_resource_type, uploader_username) '
                        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id')
@@ -1028,6 +3456,9 @@ def upload_circular():
             conn.execute('INSERT INTO notifications (message, link) VALUES (?, ?)',
                          (f'New Circular: {title}', url_for('circulars_route')))
             conn.commit()
+            notifications_cache.invalidate()
+            if stored:
+                discard_orphan(stored)
             flash('Circular published successfully!', 'success')
             return redirect(url_for('circulars_route'))
         except Exception as e:
@@ -1073,38 +3504,10 @@ def file_content(file_id):
 
     # For cloud storage (Cloudinary/S3), we need to fetch the file and stream it back inline
     # to avoid the forced "Content-Disposition: attachment" headers from the CDN.
-    import requests
-    from flask import Response
-
-    if storage == 'cloudinary':
-        stored_name = file_data['stored_filename']
-        res_type = _cloudinary_res_type(stored_name, file_data.get('storage_resource_type'))
-        
-        if res_type == 'image' and '.' in stored_name:
-            public_id = stored_name.rsplit('.', 1)[0]
-            fmt       = stored_name.rsplit('.', 1)[1].lower()
-        else:
-            public_id = stored_name
-            fmt       = ''
-
-        url = cloudinary.utils.private_download_url(
-            public_id, fmt, resource_type=res_type,
-            type='upload', attachment=False, 
-            expires_at=int(__import__('time').time()) + 3600
-        )
-        
-    elif storage == 's3':
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': S3_BUCKET_NAME, 'Key': file_data['stored_filename']},
-            ExpiresIn=3600
-        )
-
     try:
-        req = requests.get(url, stream=True)
-        return Response(req.iter_content(chunk_size=1024 * 1024),
-                        content_type=req.headers.get('content-type'),
-                        direct_passthrough=True)
+        return serve_object_inline(file_data['stored_filename'], file_data['storage_resource_type'])
+    except HTTPException:
+        raise
     except Exception as e:
         print(f'[ERROR] Inline proxy failed: {e}')
         abort(500)
@@ -1126,38 +3529,10 @@ def circular_content(circular_id):
             as_attachment=False
         )
 
-    import requests
-    from flask import Response
-
-    if storage == 'cloudinary':
-        stored_name = circular['stored_filename']
-        res_type = _cloudinary_res_type(stored_name, circular.get('storage_resource_type'))
-        
-        if res_type == 'image' and '.' in stored_name:
-            public_id = stored_name.rsplit('.', 1)[0]
-            fmt       = stored_name.rsplit('.', 1)[1].lower()
-        else:
-            public_id = stored_name
-            fmt       = ''
-
-        url = cloudinary.utils.private_download_url(
-            public_id, fmt, resource_type=res_type,
-            type='upload', attachment=False, 
-            expires_at=int(__import__('time').time()) + 3600
-        )
-        
-    elif storage == 's3':
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': S3_BUCKET_NAME, 'Key': circular['stored_filename']},
-            ExpiresIn=3600
-        )
-
     try:
-        req = requests.get(url, stream=True)
-        return Response(req.iter_content(chunk_size=1024 * 1024),
-                        content_type=req.headers.get('content-type'),
-                        direct_passthrough=True)
+        return serve_object_inline(circular['stored_filename'], circular['storage_resource_type'])
+    except HTTPException:
+        raise
     except Exception as e:
         print(f'[ERROR] Inline proxy failed: {e}')
         abort(500)
@@ -1170,6 +3545,12 @@ def event_image(event_id):
     if not event or not event['image_filename']:
         abort(404)
 
+    width = request.args.get('w', type=int)
+    if width:
+        resp = serve_image_variant(event['image_filename'], event['storage_resource_type'], width)
+        if resp is not None:
+            return resp
+
     storage = get_storage_type()
 
     if storage == 'local':
@@ -1180,12 +3561,19 @@ def event_image(event_id):
         )
 
     if storage == 'cloudinary':
+        if event['image_url']:
+            return redirect_immutable(event['image_url'])
         stored_name = event['image_filename']
-        res_type = _cloudinary_res_type(stored_name, event.get('storage_resource_type'))
+        res_type = _cloudinary_res_type(stored_name, event['storage_resource_type'])
         try:
-            # Fetch the real URL directly from Cloudinary to avoid public_id extension issues
+            # Fetch the real URL directly from Cloudinary to avoid public_id extension issues,
+            # then keep it on the row so later views skip the Admin API entirely
             result = cloudinary.api.resource(stored_name, resource_type=res_type)
-            return redirect(result['secure_url'])
+            conn = get_db_connection()
+            conn.execute('UPDATE events SET image_url = ? WHERE id = ?', (result['secure_url'], event_id))
+            conn.commit()
+            conn.close()
+            return redirect_immutable(result['secure_url'])
         except Exception:
             # Fallback: strip extension and let Cloudinary reconstruct URL
             public_id = stored_name.rsplit('.', 1)[0] if '.' in stored_name else stored_name
@@ -1193,12 +3581,16 @@ def event_image(event_id):
             return redirect(url)
         
     elif storage == 's3':
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': S3_BUCKET_NAME, 'Key': event['image_filename']},
-            ExpiresIn=3600
-        )
-        return redirect(url)
+        return redirect_signed(*signed_object_url(event['image_filename']))
+
+@app.route('/preview/<name>')
+def file_preview(name):
+    conn = get_db_connection()
+    known = conn.execute('SELECT 1 FROM files WHERE preview_name = ?', (name,)).fetchone()
+    conn.close()
+    if not known:
+        abort(404)
+    return serve_immutable(name)
 
 @app.route('/download/<int:file_id>')
 def download_file(file_id):
@@ -1214,54 +3606,19 @@ def download_file(file_id):
 
     storage = get_storage_type()
 
-    if storage == 'cloudinary':
+    if storage in ('cloudinary', 's3'):
         try:
-            stored_name   = file_data['stored_filename']
-            res_type      = _cloudinary_res_type(stored_name, file_data.get('storage_resource_type'))
-
-            # Debug confirmed files are stored as raw type with public_id = uuid.pdf
-            # For image type: public_id has no extension, format passed separately
-            # For raw type:  public_id INCLUDES extension, format must be ''
-            if res_type == 'image' and '.' in stored_name:
-                public_id = stored_name.rsplit('.', 1)[0]
-                fmt       = stored_name.rsplit('.', 1)[1].lower()
-            else:
-                public_id = stored_name   # e.g. "3ecfbddc-ad51-4aaf-b635-650cde3288e6.pdf"
-                fmt       = ''            # MUST be empty for raw — extension is in public_id
-
-            # private_download_url generates a signed API URL (identical to Cloudinary console)
-            # This works for ALL resource types and forces browser download.
-            import time as _time
-            url = cloudinary.utils.private_download_url(
-                public_id,
-                fmt,
-                resource_type=res_type,
-                type='upload',
+            # Cloudinary: private_download_url is a signed API URL that works for
+            # all resource types and forces a download. S3: presigned GET with an
+            # attachment Content-Disposition.
+            return redirect_signed(*signed_object_url(
+                file_data['stored_filename'],
+                file_data['storage_resource_type'],
                 attachment=True,
-                expires_at=int(_time.time()) + 3600
-            )
-            return redirect(url)
+                download_name=file_data['original_filename'],
+            ))
         except Exception as e:
-            print(f'[ERROR] Cloudinary download: {e}')
-            abort(500)
-
-
-
-
-    if storage == 's3':
-        try:
-            url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={
-                    'Bucket': S3_BUCKET_NAME,
-                    'Key':    file_data['stored_filename'],
-                    'ResponseContentDisposition': f'attachment; filename="{file_data["original_filename"]}"'
-                },
-                ExpiresIn=3600
-            )
-            return redirect(url)
-        except Exception as e:
-            print(f'[ERROR] S3 download: {e}')
+            print(f'[ERROR] {storage} download: {e}')
             abort(500)
 
     # Local fallback
@@ -1285,12 +3642,9 @@ def delete_file(file_id):
         conn.close(); abort(403)
 
     filename = file_data['stored_filename']
-    try:
-        if file_data['file_type'] != 'link':
-            res_type = _cloudinary_res_type(filename, file_data.get('storage_resource_type'))
-            StorageService.delete(filename, res_type=res_type)
-    except Exception as e:
-        print(f'[WARN] Storage delete error: {e}')
+    if file_data['file_type'] != 'link':
+        res_type = _cloudinary_res_type(filename, file_data['storage_resource_type'])
+        schedule_storage_delete(conn, filename, res_type, dict(file_data).get('preview_name'))
 
     if conn.is_pg:
         cur = conn.conn.cursor()
@@ -1300,9 +3654,13 @@ def delete_file(file_id):
     else:
         cur = conn.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
         count = cur.rowcount
+    conn.execute('DELETE FROM file_contents WHERE file_id = ?', (file_id,))
+    if count > 0:
+        adjust_facets(conn, dict(file_data), -1)
 
     conn.commit()
     conn.close()
+    facets_cache.invalidate()
     print(f'[DELETE] File {file_id} deleted (rowcount={count})')
     
     if count > 0:
@@ -1325,11 +3683,8 @@ def delete_event(event_id):
         conn.close(); abort(403)
 
     if event_data['image_filename']:
-        try:
-            res_type = _cloudinary_res_type(event_data['image_filename'], event_data.get('storage_resource_type'))
-            StorageService.delete(event_data['image_filename'], res_type=res_type)
-        except Exception as e:
-            print(f'[WARN] Storage delete error: {e}')
+        res_type = _cloudinary_res_type(event_data['image_filename'], event_data['storage_resource_type'])
+        schedule_storage_delete(conn, event_data['image_filename'], res_type)
 
     if conn.is_pg:
         cur = conn.conn.cursor()
@@ -1361,11 +3716,8 @@ def delete_circular(circular_id):
         conn.close(); abort(404)
 
     if circular_data['stored_filename']:
-        try:
-            res_type = _cloudinary_res_type(circular_data['stored_filename'], circular_data.get('storage_resource_type'))
-            StorageService.delete(circular_data['stored_filename'], res_type=res_type)
-        except Exception as e:
-            print(f'[WARN] Storage delete error: {e}')
+        res_type = _cloudinary_res_type(circular_data['stored_filename'], circular_data['storage_resource_type'])
+        schedule_storage_delete(conn, circular_data['stored_filename'], res_type)
 
     if conn.is_pg:
         cur = conn.conn.cursor()
@@ -1549,6 +3901,90 @@ def admin_cleanup():
     conn.close()
     return render_template('cleanup.html', files=files, events=events, circulars=circulars)
 
+@app.route('/admin/bulk_delete', methods=['POST'])
+def admin_bulk_delete():
+    if session.get('role') != 'admin':
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = {kind: [int(i) for i in data.get(kind) or []]
+               for kind in DIRECT_UPLOAD_KINDS if data.get(kind)}
+    except (TypeError, ValueError):
+        return jsonify(error='ids must be integers'), 400
+    if not ids:
+        return jsonify(error='Nothing selected'), 400
+
+    try:
+        results = bulk_delete(ids)
+    except Exception as e:
+        print(f'[BULK DELETE ERROR] {e}')
+        return jsonify(error='Bulk delete failed; nothing was deleted'), 500
+    deleted = sum(r['status'] == 'deleted' for kind in results.values() for r in kind.values())
+    print(f'[DELETE] Bulk delete removed {deleted} items')
+    return jsonify(deleted=deleted, results=results)
+
+@app.route('/admin/jobs')
+def admin_jobs():
+    if session.get('role') != 'admin':
+        abort(403)
+    return jsonify(job_queue.stats())
+
+@app.route('/admin/jobs/<int:job_id>')
+def admin_job_status(job_id):
+    if session.get('role') != 'admin':
+        abort(403)
+    job = job_queue.get(job_id)
+    if not job:
+        abort(404)
+    return jsonify(job)
+
+@app.route('/admin/jobs/<int:job_id>/retry', methods=['POST'])
+def admin_job_retry(job_id):
+    if session.get('role') != 'admin':
+        abort(403)
+    if not job_queue.retry(job_id):
+        return jsonify(error='Only dead jobs can be retried'), 409
+    return jsonify(job_queue.get(job_id))
+
+# ─────────────────────────── Process Lifecycle ──────────────────────
+# With preload_app, gunicorn imports this module once in the master and forks
+# the workers from it. State built at import is then either shared read-only
+# (config, compiled templates, imported SDKs) or rebuilt in each worker.
+# gunicorn.conf.py calls these hooks around the fork.
+def prefork_init():
+    """Master, before forking: warm what workers can share, drop what they cannot."""
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(name)
+        except Exception as e:
+            print(f'[WARN] Template {name} failed to compile: {e}')
+    # Imported here, an SDK's memory is shared copy-on-write by every worker;
+    # clients and sessions are still created per worker on first use
+    backend = {'cloudinary': cloudinary, 's3': boto3}.get(STORAGE_TYPE)
+    if backend is not None:
+        backend.load()
+    if DATABASE_URL:
+        psycopg2.load()
+    # The schema check left a pooled connection behind; a socket must not be shared
+    db_pool.close_all()
+    boot_timer.deferred('pre-fork warmup', time.perf_counter() - started)
+    # Keep the collector from touching (and so copying) objects every worker inherits
+    gc.collect()
+    gc.freeze()
+
+def postfork_init():
+    """Worker, right after forking: start per-process connections, pools and sessions afresh."""
+    global _http_session, _s3_client
+    db_pool.after_fork()
+    preview_renderer.after_fork()
+    metrics.after_fork()
+    _http_session = None
+    _s3_client = None
+
 # ─────────────────────────── Entry Point ────────────────────────────
+boot_timer.mark('routes and workers')
+boot_timer.finish()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=True, port=5000)
@@ -0,0 +1,181 @@
+import os
+import re
+import sys
+import queue
+import logging
+import zipfile
+import threading
+import subprocess
+from xml.etree import ElementTree
+
+# ─────────────────────────── Logging Configuration ──────────────────
+logger = logging.getLogger('noteshare.extract')
+
+# ─────────────────────────── Extractors ─────────────────────────────
+TEXT_EXTENSIONS = {'txt', 'csv', 'py', 'java', 'cpp', 'c', 'js', 'html', 'css'}
+EXTRACTABLE_EXTENSIONS = TEXT_EXTENSIONS | {'pdf', 'docx', 'pptx'}
+
+_W_TEXT = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}t'
+_A_TEXT = '{http://schemas.openxmlformats.org/drawingml/2006/main}t'
+
+
+def _xml_text(zf, member, tag):
+    root = ElementTree.fromstring(zf.read(member))
+    return ' '.join(el.text for el in root.iter(tag) if el.text)
+
+
+def _extract_docx(path, max_chars):
+    with zipfile.ZipFile(path) as zf:
+        return _xml_text(zf, 'word/document.xml', _W_TEXT)[:max_chars]
+
+
+def _extract_pptx(path, max_chars):
+    with zipfile.ZipFile(path) as zf:
+        slides = [n for n in zf.namelist() if re.fullmatch(r'ppt/slides/slide\d+\.xml', n)]
+        slides.sort(key=lambda n: int(re.search(r'(\d+)\.xml$', n).group(1)))
+        parts, total = [], 0
+        for name in slides:
+            text = _xml_text(zf, name, _A_TEXT)
+            parts.append(text)
+            total += len(text)
+            if total >= max_chars:
+                break
+        return '\n'.join(parts)[:max_chars]
+
+
+def _extract_pdf(path, max_chars):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        logger.warning('pypdf is not installed; skipping PDF text extraction')
+        return ''
+    parts, total = [], 0
+    for page in PdfReader(path).pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        total += len(text)
+        if total >= max_chars:
+            break
+    return '\n'.join(parts)[:max_chars]
+
+
+def _extract_plain(path, max_chars):
+    # UTF-8 is at most 4 bytes per character, so this read bounds memory too
+    with open(path, 'rb') as f:
+        return f.read(max_chars * 4).decode('utf-8', errors='replace')[:max_chars]
+
+
+def extract_text(path, ext, max_chars=200_000):
+    """Return the plain text of a document, truncated to max_chars."""
+    ext = ext.lower()
+    if ext == 'pdf':
+        text = _extract_pdf(path, max_chars)
+    elif ext == 'docx':
+        text = _extract_docx(path, max_chars)
+    elif ext == 'pptx':
+        text = _extract_pptx(path, max_chars)
+    elif ext in TEXT_EXTENSIONS:
+        text = _extract_plain(path, max_chars)
+    else:
+        return ''
+    # Collapse runs of whitespace; the index does not care about layout
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+# ─────────────────────────── Sandboxed Runner ───────────────────────
+def run_extraction(path, ext, time_budget=20, memory_mb=256, max_chars=200_000):
+    """
+    Extract text in a separate interpreter with an address-space cap and a
+    wall-clock budget, so a pathological file cannot stall or bloat the
+    calling worker. Returns the text, or None if the child failed or timed out.
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), path, ext, str(max_chars), str(memory_mb)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, timeout=time_budget)
+    except subprocess.TimeoutExpired:
+        logger.warning(f'Extraction of {path} exceeded {time_budget}s budget; killed')
+        return None
+    if proc.returncode != 0:
+        err = proc.stderr.decode('utf-8', errors='replace').strip().splitlines()
+        logger.warning(f'Extraction of {path} failed: {err[-1] if err else proc.returncode}')
+        return None
+    return proc.stdout.decode('utf-8', errors='replace')
+
+
+def _child_main(argv):
+    path, ext, max_chars, memory_mb = argv[0], argv[1], int(argv[2]), int(argv[3])
+    try:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass  # not enforceable on this platform; the time budget still applies
+    sys.stdout.buffer.write(extract_text(path, ext, max_chars).encode('utf-8'))
+
+
+# ─────────────────────────── Background Worker ──────────────────────
+class ExtractionWorker:
+    """
+    Bounded background queue that extracts uploaded documents and hands the
+    text to ``store(file_id, text)``. Jobs are dropped, not queued without
+    limit, when the backlog is full; the backfill command picks them up later.
+    Each job owns its temp file and removes it when done.
+    """
+    def __init__(self, store, workers=1, max_pending=32, time_budget=20,
+                 memory_mb=256, max_chars=200_000):
+        self.store       = store
+        self.workers     = workers
+        self.time_budget = time_budget
+        self.memory_mb   = memory_mb
+        self.max_chars   = max_chars
+        self._queue      = queue.Queue(maxsize=max_pending)
+        self._threads    = []
+        self._lock       = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'extract-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, file_id, path, ext):
+        """Queue a temp file for extraction. Returns False if the queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((file_id, path, ext))
+            return True
+        except queue.Full:
+            logger.warning(f'Extraction queue full; skipping file {file_id}')
+            _remove_quietly(path)
+            return False
+
+    def process(self, file_id, path, ext):
+        """Extract one file synchronously and store the result."""
+        text = run_extraction(path, ext, self.time_budget, self.memory_mb, self.max_chars)
+        if text is not None:
+            # Empty text is stored too, so the backfill counts the file as done
+            self.store(file_id, text)
+        return text is not None
+
+    def _run(self):
+        while True:
+            file_id, path, ext = self._queue.get()
+            try:
+                self.process(file_id, path, ext)
+            except Exception as e:
+                logger.error(f'Extraction job for file {file_id} failed: {e}')
+            finally:
+                _remove_quietly(path)
+                self._queue.task_done()
+
+
+def _remove_quietly(path):
+    try: os.remove(path)
+    except OSError: pass
+
+
+if __name__ == '__main__':
+    _child_main(sys.argv[1:])
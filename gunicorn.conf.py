@@ -0,0 +1,82 @@
+import os
+import sys
+import shutil
+import tempfile
+
+# ─────────────────────────── Workers ────────────────────────────────
+# gthread (the default) serves each worker's requests on a thread pool, so a
+# slow storage download or retry backoff holds one thread, not the worker.
+# gevent runs every request as a greenlet; it needs `gevent` and, for
+# Postgres, `psycogreen` so database calls yield instead of blocking the hub.
+worker_class       = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers            = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads            = int(os.getenv('GUNICORN_THREADS', '8'))                 # gthread only
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '200'))    # gevent only
+timeout            = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout   = 30
+keepalive          = 5
+
+if worker_class == 'gevent':
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print('[WARN] gevent is not installed; falling back to gthread workers')
+        worker_class = 'gthread'
+
+# ─────────────────────────── Preloading ─────────────────────────────
+# The app is imported once in the master (schema check, config, templates,
+# storage SDK) and workers are forked from it, sharing that memory. gevent
+# must patch the standard library before the app is imported, so it loads
+# the app in each worker instead.
+preload_app = os.getenv('GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1') == '1'
+
+# ─────────────────────────── Metrics ────────────────────────────────
+# Workers write their metrics to one directory so /metrics on any worker
+# reports the whole server. Unless METRICS_DIR is set, each server start
+# gets a fresh directory that is removed again on shutdown.
+_own_metrics_dir = 'METRICS_DIR' not in os.environ
+metrics_dir = os.environ.setdefault(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), f'noteshare-metrics-{os.getpid()}'))
+
+
+def _app_module():
+    # Loaded as app:app; absent until a worker imports it when not preloading
+    return sys.modules.get('app')
+
+
+# ─────────────────────────── Hooks ──────────────────────────────────
+def on_starting(server):
+    from metrics import reset_directory
+    reset_directory(metrics_dir)
+
+
+def when_ready(server):
+    module = _app_module()
+    if preload_app and module is not None:
+        module.prefork_init()
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning('psycogreen is not installed; Postgres queries will block other greenlets')
+    module = _app_module()
+    if module is not None:
+        module.postfork_init()
+
+
+def child_exit(server, worker):
+    # Fold the worker's totals into the shared file so counters keep growing
+    from metrics import retire_process
+    try:
+        retire_process(metrics_dir, worker.pid)
+    except OSError as e:
+        server.log.warning(f'Could not retire metrics for worker {worker.pid}: {e}')
+
+
+def on_exit(server):
+    if _own_metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,160 @@
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+
+# ─────────────────────────── Content Sniffing ───────────────────────
+SNIFF_BYTES = 512
+
+_MAGIC = (
+    (b'%PDF-', 'pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'PK\x03\x04', 'zip'),                         # docx, pptx, xlsx
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'),   # doc, ppt, xls
+)
+
+_TEXT = {'text'}
+EXPECTED_KINDS = {
+    'pdf': {'pdf'}, 'png': {'png'}, 'jpg': {'jpg'}, 'jpeg': {'jpg'},
+    'gif': {'gif'}, 'bmp': {'bmp'}, 'webp': {'webp'},
+    'docx': {'zip'}, 'pptx': {'zip'}, 'xlsx': {'zip'},
+    'doc': {'ole'}, 'ppt': {'ole'}, 'xls': {'ole'},
+    'svg': _TEXT, 'txt': _TEXT, 'csv': _TEXT, 'py': _TEXT, 'java': _TEXT,
+    'cpp': _TEXT, 'c': _TEXT, 'js': _TEXT, 'html': _TEXT, 'css': _TEXT,
+}
+
+
+def sniff(head):
+    """Return the set of content kinds the leading bytes of a file are consistent with."""
+    kinds = {kind for magic, kind in _MAGIC if head.startswith(magic)}
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        kinds.add('webp')
+    # Checked alongside the magic numbers: a text file may well start with "BM"
+    if b'\x00' not in head:
+        kinds.add('text')
+    return kinds
+
+
+def content_matches(head, ext):
+    """True if leading bytes look like what the extension claims; unknown extensions pass."""
+    expected = EXPECTED_KINDS.get(ext.lower())
+    return expected is None or bool(expected & sniff(head))
+
+
+# ─────────────────────────── Ingested File ──────────────────────────
+class IngestedFile:
+    """
+    Writable spool that records an upload's size, SHA-256 and leading bytes
+    as it is written, so one pass over the incoming stream is enough. Data
+    stays in memory up to ``max_memory`` bytes and then moves to a temp file.
+    Once written it reads like an ordinary file; ``close()`` removes the spool.
+    """
+    def __init__(self, filename=None, content_type=None, max_memory=1024 * 1024):
+        self.filename     = filename
+        self.content_type = content_type
+        self.size         = 0
+        self.head         = b''
+        self.path         = None    # set once the spool has moved to disk
+        self._max_memory  = max_memory
+        self._hash        = hashlib.sha256()
+        self._file        = io.BytesIO()
+
+    @classmethod
+    def from_stream(cls, stream, filename=None, content_type=None, **kwargs):
+        """Ingest any readable stream and return the result rewound."""
+        ingested = cls(filename, content_type, **kwargs)
+        shutil.copyfileobj(stream, ingested, 1024 * 1024)
+        return ingested.rewind()
+
+    # ── Writing (one pass) ──
+    def write(self, data):
+        if len(self.head) < SNIFF_BYTES:
+            self.head += bytes(data[:SNIFF_BYTES - len(self.head)])
+        self._hash.update(data)
+        self.size += len(data)
+        if self.path is None and self.size > self._max_memory:
+            self._rollover()
+        return self._file.write(data)
+
+    def _rollover(self):
+        fd, self.path = tempfile.mkstemp(prefix='ingest_')
+        disk = os.fdopen(fd, 'w+b')
+        disk.write(self._file.getvalue())
+        self._file = disk
+
+    # ── Results ──
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    @property
+    def ext(self):
+        name = self.filename or ''
+        return name.rsplit('.', 1)[1].lower() if '.' in name else ''
+
+    def matches_extension(self, ext=None):
+        """True if the content looks like what its extension claims; unknown extensions pass."""
+        return content_matches(self.head, ext or self.ext)
+
+    def getvalue(self):
+        """The whole content as bytes; only sensible while it is still in memory."""
+        self._file.seek(0)
+        return self._file.read()
+
+    # ── Handing the content on ──
+    def rewind(self):
+        self._file.seek(0)
+        return self
+
+    def save(self, dest):
+        """Write the content to dest, hard-linking the spool when it is on disk."""
+        if self.path:
+            try:
+                os.link(self.path, dest)
+                return
+            except OSError:
+                pass    # different filesystem or dest exists; fall back to copying
+        self.rewind()
+        with open(dest, 'wb') as out:
+            shutil.copyfileobj(self._file, out, 1024 * 1024)
+        self.rewind()
+
+    def copy_to_temp(self, prefix='ingest_', suffix=''):
+        """Give another owner (e.g. a background job) its own temp file of the content."""
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix)
+        os.close(fd)
+        os.remove(path)
+        self.save(path)
+        return path
+
+    # ── File protocol ──
+    def read(self, size=-1):   return self._file.read(size)
+    def readinto(self, b):     return self._file.readinto(b)
+    def seek(self, pos, whence=0): return self._file.seek(pos, whence)
+    def tell(self):            return self._file.tell()
+    def flush(self):           self._file.flush()
+    def readable(self):        return True
+    def writable(self):        return True
+    def seekable(self):        return True
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+        if self.path:
+            try: os.remove(self.path)
+            except OSError: pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
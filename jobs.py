@@ -0,0 +1,246 @@
+import json
+import time
+import random
+import socket
+import logging
+import threading
+
+# ─────────────────────────── Logging Configuration ──────────────────
+logger = logging.getLogger('noteshare.jobs')
+
+
+# ─────────────────────────── Job Queue ──────────────────────────────
+class JobQueue:
+    """
+    Durable job queue kept in the application's own ``jobs`` table, so it
+    works the same on SQLite and Postgres. ``connect()`` must return a
+    DBWrapper-style connection (``?`` placeholders, ``is_pg``).
+
+    Jobs are enqueued on the caller's connection, so they commit or roll back
+    with the change that produced them. Workers claim one job at a time; a
+    failed job is retried with exponential backoff and marked ``dead`` once
+    it has used up its attempts. Jobs left ``running`` by a crashed worker
+    are requeued after ``lock_timeout`` seconds. Finished jobs are purged
+    after ``retention`` seconds. Maintenance registered with ``every()`` runs
+    on the same worker threads.
+
+    A job enqueued with ``local=True`` is claimed only by workers on the same
+    ``host``, for work that reads files the enqueuing process left on disk.
+    """
+    def __init__(self, connect, workers=1, poll_interval=2.0, max_attempts=5,
+                 backoff=30, lock_timeout=600, retention=7 * 86400, host=None):
+        self.connect       = connect
+        self.host          = host or socket.gethostname()
+        self.workers       = workers
+        self.poll_interval = poll_interval
+        self.max_attempts  = max_attempts
+        self.backoff       = backoff
+        self.lock_timeout  = lock_timeout
+        self.retention     = retention
+        self._next_purge   = 0
+        self._next_reap    = 0
+        self._handlers     = {}
+        self._on_dead      = {}
+        self._periodic     = []    # [interval, fn, next run]
+        self._threads      = []
+        self._lock         = threading.Lock()
+        self._wake         = threading.Event()
+        self._stop         = threading.Event()
+
+    def handler(self, kind, on_dead=None):
+        """
+        Register ``fn(payload)`` as the handler for a job kind. ``on_dead(payload)``
+        is called once a job of that kind has used up its attempts.
+        """
+        def register(fn):
+            self._handlers[kind] = fn
+            if on_dead is not None:
+                self._on_dead[kind] = on_dead
+            return fn
+        return register
+
+    def every(self, interval):
+        """Register ``fn()`` to run every ``interval`` seconds in each worker process."""
+        def register(fn):
+            self._periodic.append([interval, fn, time.time() + interval])
+            return fn
+        return register
+
+    # ── Producing ──
+    def enqueue(self, conn, kind, payload, max_attempts=None, delay=0, local=False):
+        """Add a job on the caller's connection; it becomes visible on commit."""
+        now = int(time.time())
+        conn.execute(
+            'INSERT INTO jobs (kind, payload, status, attempts, max_attempts, run_after, host, created_at, updated_at) '
+            "VALUES (?, ?, 'queued', 0, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), max_attempts or self.max_attempts, now + delay,
+             self.host if local else None, now, now)
+        )
+        self._wake.set()
+
+    # ── Consuming ──
+    def claim(self):
+        """Mark the next due job running and return it, or None when idle."""
+        conn = self.connect()
+        try:
+            now = int(time.time())
+            if now >= self._next_reap:
+                self._next_reap = now + 60
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running' AND locked_at < ?",
+                    (now, now - self.lock_timeout)
+                )
+            sql = ("SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ? "
+                   "AND (host IS NULL OR host = ?) ORDER BY run_after, id LIMIT 1")
+            if conn.is_pg:
+                sql += ' FOR UPDATE SKIP LOCKED'
+            row = conn.execute(sql, (now, self.host)).fetchone()
+            if not row:
+                conn.commit()
+                return None
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'queued'", (now, now, row['id'])
+            ).rowcount
+            job = conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone() if claimed else None
+            conn.commit()
+            return dict(job) if job else None
+        finally:
+            conn.close()
+
+    def _finish(self, job, error=None):
+        now, dead = int(time.time()), False
+        conn = self.connect()
+        try:
+            if error is None:
+                conn.execute("UPDATE jobs SET status = 'done', last_error = NULL, updated_at = ? WHERE id = ?",
+                             (now, job['id']))
+            elif job['attempts'] >= job['max_attempts']:
+                logger.error(f'Job {job["id"]} ({job["kind"]}) dead after {job["attempts"]} attempts: {error}')
+                conn.execute("UPDATE jobs SET status = 'dead', last_error = ?, updated_at = ? WHERE id = ?",
+                             (error, now, job['id']))
+                dead = True
+            else:
+                delay = self.backoff * (2 ** (job['attempts'] - 1)) * random.uniform(0.8, 1.2)
+                conn.execute("UPDATE jobs SET status = 'queued', last_error = ?, run_after = ?, updated_at = ? "
+                             "WHERE id = ?", (error, now + int(delay), now, job['id']))
+            conn.commit()
+        finally:
+            conn.close()
+        on_dead = self._on_dead.get(job['kind']) if dead else None
+        if on_dead is not None:
+            try:
+                on_dead(json.loads(job['payload']))
+            except Exception as e:
+                logger.error(f'Job {job["id"]} ({job["kind"]}) dead-job hook failed: {e}')
+
+    def run_once(self):
+        """Run one due job. Returns False when there was nothing to do."""
+        job = self.claim()
+        if not job:
+            return False
+        handler = self._handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise LookupError(f'No handler for job kind {job["kind"]!r}')
+            handler(json.loads(job['payload']))
+        except Exception as e:
+            logger.warning(f'Job {job["id"]} ({job["kind"]}) attempt {job["attempts"]} failed: {e}')
+            self._finish(job, f'{type(e).__name__}: {e}'[:1000])
+        else:
+            self._finish(job)
+        return True
+
+    def run_periodic(self):
+        """Run whichever ``every()`` tasks are due; each runs on one thread at a time."""
+        for task in self._periodic:
+            interval, fn, due = task
+            with self._lock:
+                if time.time() < due:
+                    continue
+                task[2] = time.time() + interval
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f'Periodic task {fn.__name__} failed: {e}')
+
+    def run_forever(self):
+        """Process jobs until stop() is called; used by worker threads and the CLI."""
+        while not self._stop.is_set():
+            try:
+                if time.time() >= self._next_purge:
+                    self._next_purge = time.time() + 3600
+                    self.purge(self.retention)
+                self.run_periodic()
+                busy = self.run_once()
+            except Exception as e:
+                logger.error(f'Job worker error: {e}')
+                busy = False
+            if not busy:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def start(self):
+        """Start the in-process worker threads once; a no-op when workers is 0."""
+        if self._threads or self.workers <= 0:
+            return
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self.run_forever, name=f'jobs-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    # ── Inspection ──
+    def stats(self, recent=20):
+        """Counts by status plus the most recent failures."""
+        conn = self.connect()
+        try:
+            counts = {r['status']: r['n'] for r in conn.execute(
+                'SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()}
+            failures = [dict(r) for r in conn.execute(
+                "SELECT id, kind, status, attempts, max_attempts, last_error, updated_at FROM jobs "
+                "WHERE last_error IS NOT NULL AND status != 'done' ORDER BY updated_at DESC LIMIT ?",
+                (recent,)).fetchall()]
+            return {'counts': counts, 'failures': failures, 'workers': len(self._threads)}
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def retry(self, job_id):
+        """Requeue a dead job with a fresh set of attempts. Returns False if it is not dead."""
+        conn = self.connect()
+        try:
+            now = int(time.time())
+            changed = conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, run_after = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'dead'", (now, now, job_id)
+            ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        self._wake.set()
+        return bool(changed)
+
+    def purge(self, older_than):
+        """Delete finished jobs last touched more than older_than seconds ago."""
+        conn = self.connect()
+        try:
+            removed = conn.execute("DELETE FROM jobs WHERE status = 'done' AND updated_at < ?",
+                                   (int(time.time()) - older_than,)).rowcount
+            conn.commit()
+            return removed
+        finally:
+            conn.close()
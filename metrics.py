@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import threading
+
+# ─────────────────────────── Logging Configuration ──────────────────
+logger = logging.getLogger('noteshare.metrics')
+
+# ─────────────────────────── Registry ───────────────────────────────
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RETIRED_FILE    = 'retired.json'
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms in the Prometheus data model.
+
+    Each process records into its own dicts under a lock. With a
+    ``directory``, a background thread writes this process's values to
+    ``<directory>/<pid>.json`` every ``flush_interval`` seconds, and
+    ``render()`` merges every file so any worker can answer a scrape for the
+    whole server: counters and histograms are summed, and gauges are
+    reported per live process with a ``pid`` label. Without a directory only
+    this process is reported.
+    """
+    def __init__(self, directory=None, prefix='', flush_interval=5.0):
+        self.directory      = directory
+        self.prefix         = prefix
+        self.flush_interval = flush_interval
+        self._meta          = {}     # name -> (kind, help, buckets)
+        self._collectors    = []
+        self._lock          = threading.Lock()
+        self._start_process()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def _start_process(self):
+        self._pid     = os.getpid()
+        self._values  = {}   # (name, labels) -> number, counters and gauges
+        self._hists   = {}   # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self._flusher = None
+
+    def _check_process(self):
+        # Called under the lock. A forked worker starts from zero rather than
+        # reporting the master's values a second time under its own pid.
+        if os.getpid() != self._pid:
+            self._start_process()
+        if self.directory and self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self._flusher.start()
+
+    def after_fork(self):
+        """In a forked child: the parent's lock may have been held mid-flush."""
+        self._lock = threading.Lock()
+        self._start_process()
+
+    # ── Declaring ──
+    def counter(self, name, help):
+        self._meta[name] = ('counter', help, None)
+
+    def gauge(self, name, help):
+        self._meta[name] = ('gauge', help, None)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        self._meta[name] = ('histogram', help, tuple(sorted(buckets)))
+
+    def add_collector(self, fn):
+        """Call ``fn()`` before each flush or scrape, to set gauges from live state."""
+        self._collectors.append(fn)
+
+    # ── Recording ──
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_process()
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge, or a counter this process already keeps a running total of."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_process()
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_process()
+            counts = self._hists.get(key)
+            if counts is None:
+                counts = self._hists[key] = [0] * (len(buckets) + 2)
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-1] += value
+
+    # ── Sharing between processes ──
+    def _collect(self):
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                logger.warning(f'Metrics collector {getattr(fn, "__name__", fn)} failed: {e}')
+
+    def snapshot(self):
+        self._collect()
+        with self._lock:
+            self._check_process()
+            return {
+                'pid':        self._pid,
+                'values':     [[n, list(map(list, l)), v] for (n, l), v in self._values.items()],
+                'histograms': [[n, list(map(list, l)), list(c)] for (n, l), c in self._hists.items()],
+            }
+
+    def flush(self):
+        if not self.directory:
+            return
+        snap = self.snapshot()
+        _write_json(os.path.join(self.directory, f'{snap["pid"]}.json'), snap)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f'Metrics flush failed: {e}')
+
+    def _snapshots(self):
+        own = self.snapshot()
+        if not self.directory:
+            return [own]
+        snaps = [own]
+        for entry in os.listdir(self.directory):
+            if not entry.endswith('.json') or entry == f'{own["pid"]}.json':
+                continue
+            snap = _read_json(os.path.join(self.directory, entry))
+            if snap is not None:
+                snaps.append(snap)
+        return snaps
+
+    # ── Exposition ──
+    def render(self):
+        """Every declared metric in the Prometheus text exposition format (0.0.4)."""
+        values, hists = {}, {}
+        for snap in self._snapshots():
+            live = snap.get('pid') and _alive(snap['pid'])
+            for name, labels, value in snap.get('values', ()):
+                meta = self._meta.get(name)
+                if meta is None:
+                    continue
+                labels = tuple(map(tuple, labels))
+                if meta[0] == 'gauge':
+                    if not live:
+                        continue
+                    labels += (('pid', str(snap['pid'])),)
+                key = (name, labels)
+                values[key] = values.get(key, 0) + value
+            for name, labels, counts in snap.get('histograms', ()):
+                meta = self._meta.get(name)
+                if meta is None or len(counts) != len(meta[2]) + 2:
+                    continue   # declared with other buckets by an older deploy
+                key = (name, tuple(map(tuple, labels)))
+                merged = hists.setdefault(key, [0] * len(counts))
+                for i, c in enumerate(counts):
+                    merged[i] += c
+
+        lines = []
+        for name, (kind, help, buckets) in self._meta.items():
+            full = self.prefix + name
+            lines.append(f'# HELP {full} {_escape_help(help)}')
+            lines.append(f'# TYPE {full} {kind}')
+            if kind != 'histogram':
+                for (n, labels), value in sorted(values.items()):
+                    if n == name:
+                        lines.append(f'{full}{_labels(labels)} {_number(value)}')
+                continue
+            for (n, labels), counts in sorted(hists.items()):
+                if n != name:
+                    continue
+                running = 0
+                for bound, c in zip(buckets + (float('inf'),), counts):
+                    running += c
+                    le = '+Inf' if bound == float('inf') else _number(bound)
+                    lines.append(f'{full}_bucket{_labels(labels + (("le", le),))} {running}')
+                lines.append(f'{full}_sum{_labels(labels)} {_number(counts[-1])}')
+                lines.append(f'{full}_count{_labels(labels)} {running}')
+        return '\n'.join(lines) + '\n'
+
+
+# ─────────────────────────── Process Files ──────────────────────────
+def reset_directory(directory):
+    """Start a server with no values left over from a previous run."""
+    os.makedirs(directory, exist_ok=True)
+    for entry in os.listdir(directory):
+        if entry.endswith('.json') or entry.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(directory, entry))
+            except OSError:
+                pass
+
+def retire_process(directory, pid):
+    """
+    Fold an exited worker's counters and histograms into one shared file so
+    totals never go backwards while worker restarts do not pile up files.
+    Its gauges are dropped. Meant to run in one process only (the master).
+    """
+    path = os.path.join(directory, f'{pid}.json')
+    snap = _read_json(path)
+    if snap is None:
+        return
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    retired = _read_json(retired_path) or {'pid': 0, 'values': [], 'histograms': []}
+    values = {(n, json.dumps(l)): v for n, l, v in retired['values']}
+    hists  = {(n, json.dumps(l)): c for n, l, c in retired['histograms']}
+    # Gauges come along too but are never reported: pid 0 is not a live process
+    for name, labels, value in snap.get('values', ()):
+        key = (name, json.dumps(labels))
+        values[key] = values.get(key, 0) + value
+    for name, labels, counts in snap.get('histograms', ()):
+        key = (name, json.dumps(labels))
+        merged = hists.get(key)
+        if merged is None or len(merged) != len(counts):
+            hists[key] = list(counts)
+        else:
+            hists[key] = [a + b for a, b in zip(merged, counts)]
+    _write_json(retired_path, {
+        'pid': 0,
+        'values': [[n, json.loads(l), v] for (n, l), v in values.items()],
+        'histograms': [[n, json.loads(l), c] for (n, l), c in hists.items()],
+    })
+    os.remove(path)
+
+def _write_json(path, data):
+    tmp = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)   # readers see the old file or the new one, never half of it
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# ─────────────────────────── Text Format ────────────────────────────
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    def esc(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in labels) + '}'
@@ -0,0 +1,181 @@
+import io
+import logging
+import threading
+import multiprocessing
+
+from extract import TEXT_EXTENSIONS
+
+# ─────────────────────────── Logging Configuration ──────────────────
+logger = logging.getLogger('noteshare.preview')
+
+# ─────────────────────────── Renderers ──────────────────────────────
+IMAGE_EXTENSIONS       = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+PREVIEWABLE_EXTENSIONS = IMAGE_EXTENSIONS | TEXT_EXTENSIONS | {'pdf'}
+
+SNIPPET_LINES = 24
+SNIPPET_CHARS = 60
+
+
+def _render_image(Image, path, box):
+    from PIL import ImageOps
+    img = Image.open(path)
+    img.draft('RGB', box)       # lets JPEG decode at a reduced scale
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail(box)
+    return img
+
+
+def _render_pdf(Image, path, box):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        logger.warning('pypdfium2 is not installed; skipping PDF previews')
+        return None
+    pdf = pdfium.PdfDocument(path)
+    try:
+        page = pdf[0]
+        scale = box[0] / page.get_width()
+        img = page.render(scale=scale).to_pil()
+    finally:
+        pdf.close()
+    img.thumbnail(box)
+    return img
+
+
+def _render_text(Image, path, box):
+    from PIL import ImageDraw, ImageFont
+    with open(path, 'rb') as f:
+        head = f.read(SNIPPET_LINES * SNIPPET_CHARS * 4).decode('utf-8', errors='replace')
+    lines = [line.expandtabs(4)[:SNIPPET_CHARS] for line in head.splitlines()[:SNIPPET_LINES]]
+    img = Image.new('RGB', box, (15, 17, 26))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default()
+    y = 10
+    for line in lines:
+        draw.text((10, y), line, fill=(203, 213, 225), font=font)
+        y += 14
+    return img
+
+
+def render_preview(path, ext, width=320, quality=75):
+    """
+    Return a WebP preview of a file as bytes: the first page of a PDF, a
+    downscaled image, or a snippet of a text/code file. Returns None for
+    other types or when the imaging libraries are not installed.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.warning('Pillow is not installed; skipping previews')
+        return None
+    ext = ext.lower()
+    box = (width, width * 4 // 3)
+    if ext in IMAGE_EXTENSIONS:
+        img = _render_image(Image, path, box)
+    elif ext == 'pdf':
+        img = _render_pdf(Image, path, box)
+    elif ext in TEXT_EXTENSIONS:
+        img = _render_text(Image, path, box)
+    else:
+        return None
+    if img is None:
+        return None
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    buf = io.BytesIO()
+    img.save(buf, 'WEBP', quality=quality, method=4)
+    return buf.getvalue()
+
+
+def render_variants(path, widths, quality=80):
+    """
+    Return {width: WebP bytes} for each width the image reaches.
+    Empty when the image is already small or Pillow is not installed.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.warning('Pillow is not installed; skipping image variants')
+        return {}
+    img = _render_image(Image, path, (max(widths), max(widths) * 4))
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    variants = {}
+    for width in sorted(widths):
+        if width > img.width:
+            break
+        copy = img.copy()
+        copy.thumbnail((width, img.height))
+        buf = io.BytesIO()
+        copy.save(buf, 'WEBP', quality=quality, method=4)
+        variants[width] = buf.getvalue()
+    return variants
+
+
+# ─────────────────────────── Process Pool ───────────────────────────
+def _limit_memory(memory_mb):
+    try:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass  # not enforceable on this platform; the time budget still applies
+    try:
+        from PIL import Image
+        Image.MAX_IMAGE_PIXELS = 64_000_000   # refuse decompression bombs outright
+    except ImportError:
+        pass
+
+
+class PreviewRenderer:
+    """
+    Pool of rendering processes, started on first use so that forked web
+    workers each get their own. Each process runs under a memory cap; a
+    render that overruns ``time_budget`` seconds is abandoned and the pool
+    is replaced, since a stuck child cannot be interrupted any other way.
+    """
+    def __init__(self, workers=2, width=320, time_budget=20, memory_mb=256, max_tasks=50):
+        self.workers     = workers
+        self.width       = width
+        self.time_budget = time_budget
+        self.memory_mb   = memory_mb
+        self.max_tasks   = max_tasks
+        self._pool       = None
+        self._lock       = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a threaded web worker can copy held locks into the child
+                ctx = multiprocessing.get_context('spawn')
+                self._pool = ctx.Pool(self.workers, initializer=_limit_memory,
+                                      initargs=(self.memory_mb,), maxtasksperchild=self.max_tasks)
+            return self._pool
+
+    def render(self, path, ext):
+        """WebP bytes for the file, or None if it has no preview. Raises if rendering fails."""
+        return self._run(render_preview, path, ext, self.width)
+
+    def render_variants(self, path, widths):
+        """{width: WebP bytes} for an image, skipping widths it does not exceed."""
+        return self._run(render_variants, path, list(widths))
+
+    def _run(self, fn, path, *args):
+        pool = self._get_pool()
+        try:
+            return pool.apply_async(fn, (path, *args)).get(self.time_budget)
+        except multiprocessing.TimeoutError:
+            logger.warning(f'Rendering {path} exceeded {self.time_budget}s budget; restarting pool')
+            self.close(pool)
+            raise
+
+    def after_fork(self):
+        """In a forked child: the parent's pool processes are not ours to use or stop."""
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def close(self, pool=None):
+        with self._lock:
+            if self._pool is not None and (pool is None or pool is self._pool):
+                self._pool.terminate()
+                self._pool = None
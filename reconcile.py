@@ -0,0 +1,86 @@
+import os
+import json
+import heapq
+import tempfile
+
+# ─────────────────────────── Sorted Streams ─────────────────────────
+# Names are compared as Python strings (code point order), which matches
+# S3's UTF-8 key order and the "C" collation on Postgres.
+
+def external_sort(items, run_size=100_000, tmpdir=None):
+    """
+    Sort an iterable of tuples (name first) with bounded memory: runs of
+    ``run_size`` items are sorted and spilled to temp files, then merged.
+    """
+    runs, run = [], []
+    try:
+        for item in items:
+            run.append(item)
+            if len(run) >= run_size:
+                runs.append(_spill(sorted(run), tmpdir))
+                run = []
+        run.sort()
+        if not runs:
+            yield from run
+            return
+        runs.append(_spill(run, tmpdir))
+        yield from heapq.merge(*(_read_run(f) for f in runs))
+    finally:
+        for f in runs:
+            f.close()
+
+def _spill(run, tmpdir):
+    f = tempfile.TemporaryFile('w+', dir=tmpdir)   # removed on close
+    for item in run:
+        f.write(json.dumps(item) + '\n')
+    f.seek(0)
+    return f
+
+def _read_run(f):
+    for line in f:
+        yield tuple(json.loads(line))
+
+def ascending(items, label):
+    """Pass a sorted stream through, failing loudly if it ever goes backwards."""
+    last = None
+    for item in items:
+        if last is not None and item[0] < last:
+            raise ValueError(f'{label} is not sorted: {item[0]!r} came after {last!r}')
+        last = item[0]
+        yield item
+
+
+# ─────────────────────────── Merge Join ─────────────────────────────
+def merge_join(objects, refs):
+    """
+    Walk two name-sorted streams in step: ``objects`` holds what storage has,
+    ``refs`` what the database points at (a name may appear more than once).
+    Yields ('matched', obj), ('orphan', obj) for objects nothing references
+    and ('dangling', ref) for rows whose object is missing.
+    """
+    objects, refs = iter(objects), iter(refs)
+    obj, ref = next(objects, None), next(refs, None)
+    while obj is not None or ref is not None:
+        if ref is None or (obj is not None and obj[0] < ref[0]):
+            yield 'orphan', obj
+            obj = next(objects, None)
+        elif obj is None or ref[0] < obj[0]:
+            yield 'dangling', ref
+            ref = next(refs, None)
+        else:
+            name = obj[0]
+            while obj is not None and obj[0] == name:
+                yield 'matched', obj
+                obj = next(objects, None)
+            while ref is not None and ref[0] == name:
+                ref = next(refs, None)
+
+
+# ─────────────────────────── Local Listing ──────────────────────────
+def list_directory(path, res_type='raw'):
+    """(name, size, mtime, res_type) for each file in a directory, unsorted."""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                yield entry.name, st.st_size, int(st.st_mtime), res_type
@@ -0,0 +1,158 @@
+// Direct-to-storage uploads: forms marked data-direct-upload send the file
+// straight to Cloudinary/S3 with a signed ticket, then submit the form with
+// the ticket token instead of the file. Files above data-direct-max go through
+// the resumable chunked protocol instead. On any failure the form is
+// submitted as a regular upload.
+(function () {
+    const PARALLEL_CHUNKS = 3;
+    const CHUNK_ATTEMPTS = 4;
+    const STORE_POLL_MS = 3000;
+    const STORE_WAIT_MS = 30 * 60 * 1000;
+
+    function csrfHeaders(form, extra) {
+        const csrf = form.querySelector('input[name="csrf_token"]').value;
+        return Object.assign({ 'X-CSRFToken': csrf }, extra || {});
+    }
+
+    async function postJSON(form, url, payload) {
+        const res = await fetch(url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: csrfHeaders(form, { 'Content-Type': 'application/json' }),
+            body: JSON.stringify(payload || {})
+        });
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || 'Upload request failed');
+        return data;
+    }
+
+    function showProgress(form, text) {
+        const display = form.querySelector('#filename-display');
+        if (display) display.textContent = text;
+    }
+
+    async function sendToStorage(form, file) {
+        const ticket = await postJSON(form, form.dataset.signUrl,
+            { kind: form.dataset.directUpload, filename: file.name, size: file.size });
+
+        const body = new FormData();
+        Object.entries(ticket.fields).forEach(([name, value]) => body.append(name, value));
+        body.append('file', file);  // must come last for S3
+        const sameOrigin = ticket.url.startsWith('/');
+        const uploaded = await fetch(ticket.url, {
+            method: 'POST',
+            body: body,
+            credentials: sameOrigin ? 'same-origin' : 'omit'
+        });
+        if (!uploaded.ok) throw new Error('Storage rejected the upload');
+        return ticket.token;
+    }
+
+    async function putChunk(form, url, blob) {
+        for (let attempt = 1; ; attempt++) {
+            try {
+                const res = await fetch(url, {
+                    method: 'PUT', credentials: 'same-origin',
+                    headers: csrfHeaders(form), body: blob
+                });
+                if (res.ok) return;
+                if (res.status < 500) throw Object.assign(new Error('Chunk rejected'), { fatal: true });
+            } catch (err) {
+                if (err.fatal || attempt >= CHUNK_ATTEMPTS) throw err;
+            }
+            await new Promise(r => setTimeout(r, 1000 * 2 ** attempt));
+        }
+    }
+
+    async function sendInChunks(form, file) {
+        const base = form.dataset.chunkUrl;
+        // Resume an unfinished session for the same file after a dropped connection or reload
+        const resumeKey = `chunked-upload:${form.dataset.directUpload}:${file.name}:${file.size}:${file.lastModified}`;
+        let state = null;
+        const saved = localStorage.getItem(resumeKey);
+        if (saved) {
+            const res = await fetch(`${base}/${saved}`, { credentials: 'same-origin' });
+            if (res.ok) state = await res.json();
+            // A session whose storing failed cannot be resumed; start over
+            if (state && state.state === 'failed') state = null;
+        }
+        if (!state) {
+            state = await postJSON(form, base,
+                { kind: form.dataset.directUpload, filename: file.name, size: file.size });
+            localStorage.setItem(resumeKey, state.upload_id);
+        }
+
+        const done = new Set(state.received);
+        const pending = [];
+        // A session already being stored only needs its completion re-checked
+        const sending = !state.state || state.state === 'uploading';
+        for (let i = 0; sending && i < state.chunks; i++) if (!done.has(i)) pending.push(i);
+        if (!sending) for (let i = 0; i < state.chunks; i++) done.add(i);
+        showProgress(form, `⏫ Uploading ${file.name}… ${Math.round(100 * done.size / state.chunks)}%`);
+
+        async function worker() {
+            while (pending.length) {
+                const index = pending.shift();
+                const start = index * state.chunk_size;
+                await putChunk(form, `${base}/${state.upload_id}/${index}`,
+                    file.slice(start, start + state.chunk_size));
+                done.add(index);
+                showProgress(form, `⏫ Uploading ${file.name}… ${Math.round(100 * done.size / state.chunks)}%`);
+            }
+        }
+        await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, worker));
+
+        showProgress(form, `⏳ Finishing ${file.name}…`);
+        const result = await postJSON(form, `${base}/${state.upload_id}/complete`);
+        if (!result.stored) await waitUntilStored(`${base}/${state.upload_id}`);
+        localStorage.removeItem(resumeKey);
+        return result.token;
+    }
+
+    // Cloudinary receives the assembled file from a background job; the
+    // token is only good once the session reports the object as stored
+    async function waitUntilStored(url) {
+        for (let waited = 0; waited < STORE_WAIT_MS; waited += STORE_POLL_MS) {
+            await new Promise(r => setTimeout(r, STORE_POLL_MS));
+            const res = await fetch(url, { credentials: 'same-origin' });
+            if (!res.ok) throw new Error('Upload session expired');
+            const { state } = await res.json();
+            if (state === 'stored') return;
+            if (state === 'failed') throw new Error('Storing the upload failed. Please upload it again.');
+        }
+        throw new Error('Storage is taking longer than usual');
+    }
+
+    document.querySelectorAll('form[data-direct-upload]').forEach(function (form) {
+        form.addEventListener('submit', async function (event) {
+            const input = form.querySelector('input[type="file"][name="file"]');
+            if (form.dataset.submitting || !input || !input.files.length) return;
+            event.preventDefault();
+            form.dataset.submitting = '1';
+
+            const file = input.files[0];
+            const chunked = form.dataset.chunkUrl && file.size > Number(form.dataset.directMax);
+            const button = form.querySelector('button[type="submit"]');
+            if (button) button.disabled = true;
+            try {
+                const token = chunked ? await sendInChunks(form, file) : await sendToStorage(form, file);
+                const hidden = document.createElement('input');
+                hidden.type = 'hidden';
+                hidden.name = 'upload_token';
+                hidden.value = token;
+                form.appendChild(hidden);
+                input.disabled = true;  // the file is already in storage
+            } catch (err) {
+                if (chunked) {
+                    // Too large for a regular upload; keep the chunks so a retry resumes
+                    showProgress(form, `🛑 Upload interrupted: ${err.message}. Submit again to resume.`);
+                    delete form.dataset.submitting;
+                    if (button) button.disabled = false;
+                    return;
+                }
+                console.warn('Direct upload failed, sending through the server:', err);
+            }
+            form.submit();
+        });
+    });
+})();
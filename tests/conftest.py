@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Local SQLite and local storage, no background threads, nothing from the host's .env
+TEST_ENV = {
+    'SECRET_KEY': 'test-secret',
+    'JOB_WORKERS': '0',
+    'DATABASE_URL': '',
+    'CLOUDINARY_CLOUD_NAME': '', 'CLOUDINARY_API_KEY': '', 'CLOUDINARY_API_SECRET': '',
+    'S3_BUCKET_NAME': '', 'AWS_ACCESS_KEY_ID': '', 'AWS_SECRET_ACCESS_KEY': '',
+    'METRICS_DIR': '',
+}
+
+
+def run_fresh(workdir, code):
+    """Run ``code`` in a new interpreter that imports the app from an empty directory."""
+    env = dict(os.environ, **TEST_ENV, PYTHONPATH=ROOT)
+    for var in [k for k, v in env.items() if v == '']:
+        del env[var]
+    return subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env,
+                          capture_output=True, text=True, timeout=120)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp('app')
+    os.chdir(workdir)   # users.db and uploads/ are relative to the working directory
+    for var, value in TEST_ENV.items():
+        if value:
+            os.environ[var] = value
+        else:
+            os.environ.pop(var, None)
+    import app
+    # send_from_directory resolves relative paths against the app's root, not the cwd
+    app.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False,
+                          UPLOAD_FOLDER=str(workdir / 'uploads'))
+    return app
+
+
+@pytest.fixture
+def admin_client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(user_id=1, username='admin', role='admin')
+    return client
+
+
+def queued_deletes(app_module, names):
+    """The given names that have a storage delete queued."""
+    conn = app_module.get_db_connection()
+    try:
+        rows = conn.execute("SELECT kind, payload FROM jobs WHERE kind LIKE 'storage_delete%'").fetchall()
+    finally:
+        conn.close()
+    queued = set()
+    for row in rows:
+        payload = json.loads(row['payload'])
+        items = payload.get('items') or [(payload['stored_name'], payload.get('res_type'))]
+        queued.update(name for name, _ in items)
+    return queued & set(names)
@@ -0,0 +1,20 @@
+"""
+The app with cloud storage pointed at a local origin, for test_slow_downloads.
+
+Served with ``gunicorn -c gunicorn.conf.py slow_storage_app:app`` and
+``SLOW_ORIGIN`` set to the origin's base URL, inline file views are proxied
+from that origin exactly as they would be from S3 or Cloudinary.
+"""
+import os
+
+import app as noteshare   # gunicorn.conf.py's hooks find it in sys.modules as 'app'
+
+
+def _origin_url(stored_name, res_type=None, attachment=False, download_name=None):
+    return f"{os.environ['SLOW_ORIGIN']}/{stored_name}", None
+
+
+noteshare.get_storage_type  = lambda: 's3'
+noteshare.signed_object_url = _origin_url
+
+app = noteshare.app
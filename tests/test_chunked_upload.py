@@ -0,0 +1,76 @@
+import os
+
+from jobs import JobQueue
+
+
+def _cloudinary_session(app_module, admin_client, monkeypatch):
+    """A Cloudinary chunked upload with every chunk sent; returns (upload_id, size)."""
+    monkeypatch.setattr(app_module, 'get_storage_type', lambda: 'cloudinary')
+    monkeypatch.setattr(app_module, '_cloudinary_res_type', lambda name, res_type=None: 'raw')
+    size = app_module.CHUNK_UPLOAD_SIZE + 10
+    start = admin_client.post('/upload/chunks', json={'kind': 'files', 'filename': 'big.pdf', 'size': size})
+    assert start.status_code == 200, start.get_data(as_text=True)
+    upload_id = start.get_json()['upload_id']
+    for index, length in enumerate((app_module.CHUNK_UPLOAD_SIZE, 10)):
+        body = (b'%PDF-1.4' if index == 0 else b'') + b'0' * (length - (8 if index == 0 else 0))
+        assert admin_client.put(f'/upload/chunks/{upload_id}/{index}', data=body).status_code == 200
+    return upload_id, size
+
+
+def test_cloudinary_completion_is_queued_not_run_inline(app_module, admin_client, monkeypatch):
+    upload_id, size = _cloudinary_session(app_module, admin_client, monkeypatch)
+
+    uploaded = []
+    monkeypatch.setattr(app_module.cloudinary.uploader, 'upload_large',
+                        lambda path, **kw: uploaded.append((os.path.getsize(path), kw['public_id'])))
+
+    complete = admin_client.post(f'/upload/chunks/{upload_id}/complete')
+    assert complete.status_code == 202
+    assert complete.get_json()['stored'] is False
+    assert uploaded == []   # nothing sent to Cloudinary inside the request
+    assert admin_client.get(f'/upload/chunks/{upload_id}').get_json()['state'] == 'storing'
+
+    # A repeated completion does not queue a second push
+    assert admin_client.post(f'/upload/chunks/{upload_id}/complete').status_code == 202
+    conn = app_module.get_db_connection()
+    try:
+        jobs = conn.execute("SELECT id FROM jobs WHERE kind = 'push_chunked_upload' AND status = 'queued'"
+                            ).fetchall()
+    finally:
+        conn.close()
+    assert len(jobs) == 1
+
+    while app_module.job_queue.run_once():
+        pass
+
+    assert len(uploaded) == 1 and uploaded[0][0] == size
+    status = admin_client.get(f'/upload/chunks/{upload_id}').get_json()
+    assert status['state'] == 'stored'
+    done = admin_client.post(f'/upload/chunks/{upload_id}/complete')
+    assert done.status_code == 200 and done.get_json()['stored'] is True
+
+
+def test_chunk_push_runs_only_on_the_host_holding_the_chunks(app_module, admin_client, monkeypatch):
+    upload_id, _ = _cloudinary_session(app_module, admin_client, monkeypatch)
+    assert admin_client.post(f'/upload/chunks/{upload_id}/complete').status_code == 202
+
+    elsewhere = JobQueue(app_module.get_db_connection, workers=0, host='another-host')
+    while (job := elsewhere.claim()) is not None:
+        assert job['kind'] != 'push_chunked_upload'
+        elsewhere._finish(job)
+
+    def unreachable(path, **kw):
+        raise ConnectionError('Cloudinary is unreachable')
+    monkeypatch.setattr(app_module.cloudinary.uploader, 'upload_large', unreachable)
+    conn = app_module.get_db_connection()
+    try:
+        conn.execute("UPDATE jobs SET max_attempts = 1 WHERE kind = 'push_chunked_upload' AND status = 'queued'")
+        conn.commit()
+    finally:
+        conn.close()
+    while app_module.job_queue.run_once():
+        pass
+
+    # The dead job is reported to the browser instead of leaving it polling
+    assert admin_client.get(f'/upload/chunks/{upload_id}').get_json()['state'] == 'failed'
+    assert admin_client.post(f'/upload/chunks/{upload_id}/complete').status_code == 400
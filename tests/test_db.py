@@ -0,0 +1,39 @@
+def test_nested_close_keeps_the_request_transaction(app_module):
+    with app_module.app.test_request_context('/'):
+        conn = app_module.get_db_connection()
+        conn.execute("INSERT INTO notifications (message) VALUES ('pending write')")
+
+        helper = app_module.get_db_connection()
+        assert helper is conn
+        helper.execute('SELECT 1').fetchone()
+        helper.close()
+
+        conn.commit()
+
+    conn = app_module.get_db_connection()
+    try:
+        assert conn.execute("SELECT 1 FROM notifications WHERE message = 'pending write'").fetchone()
+    finally:
+        conn.close()
+
+
+def test_teardown_rolls_back_uncommitted_work(app_module):
+    with app_module.app.test_request_context('/'):
+        conn = app_module.get_db_connection()
+        conn.execute("INSERT INTO notifications (message) VALUES ('abandoned write')")
+        conn.close()
+
+    conn = app_module.get_db_connection()
+    try:
+        assert conn.execute("SELECT 1 FROM notifications WHERE message = 'abandoned write'").fetchone() is None
+    finally:
+        conn.close()
+
+
+def test_close_all_leaves_checked_out_connections_poolable(app_module):
+    pool = app_module.db_pool
+    held = pool.acquire()
+    pool.close_all()
+    pool.release(held)
+    assert pool.acquire() is held
+    pool.release(held)
@@ -0,0 +1,59 @@
+import os
+import uuid
+
+import pytest
+
+from conftest import queued_deletes
+
+
+def _add_file(app_module, preview_name=None, file_type='pdf'):
+    stored = f'{uuid.uuid4().hex}.pdf'
+    with open(os.path.join(app_module.app.config['UPLOAD_FOLDER'], stored), 'wb') as f:
+        f.write(b'%PDF-1.4 test')
+    conn = app_module.get_db_connection()
+    try:
+        cur = conn.execute(
+            'INSERT INTO files (original_filename, stored_filename, uploader_username, subject, '
+            'semester, file_type, file_size, preview_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ('notes.pdf', stored, 'admin', 'Maths', '1', file_type, 13, preview_name))
+        file_id = cur.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    return file_id, stored
+
+
+def _file_exists(app_module, file_id):
+    conn = app_module.get_db_connection()
+    try:
+        return conn.execute('SELECT 1 FROM files WHERE id = ?', (file_id,)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('preview_name', [None, 'stem_preview1.webp'])
+def test_delete_file_queues_object_and_preview(app_module, admin_client, preview_name):
+    preview_name = preview_name and f'{uuid.uuid4().hex}_preview1.webp'
+    file_id, stored = _add_file(app_module, preview_name)
+
+    resp = admin_client.post(f'/delete/{file_id}')
+
+    assert resp.status_code == 302
+    assert not _file_exists(app_module, file_id)
+    expected = {stored} | ({preview_name} if preview_name else set())
+    assert queued_deletes(app_module, [stored, preview_name]) == expected
+
+
+def test_bulk_delete_tolerates_missing_preview(app_module, admin_client):
+    plain_id, plain = _add_file(app_module)
+    preview_name = f'{uuid.uuid4().hex}_preview1.webp'
+    previewed_id, previewed = _add_file(app_module, preview_name)
+
+    resp = admin_client.post('/admin/bulk_delete',
+                             json={'files': [plain_id, previewed_id, 999999]})
+
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    results = resp.get_json()['results']['files']
+    assert results[str(plain_id)] == {'status': 'deleted', 'storage': 'queued'}
+    assert results['999999']['status'] == 'not_found'
+    assert queued_deletes(app_module, [plain, previewed, preview_name]) == {plain, previewed, preview_name}
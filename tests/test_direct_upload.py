@@ -0,0 +1,108 @@
+import io
+import os
+import uuid
+
+import pytest
+
+PDF = b'%PDF-1.4\n' + b'0' * 64
+
+
+def _sign(client, filename='notes.pdf', size=len(PDF)):
+    resp = client.post('/upload/sign', json={'kind': 'files', 'filename': filename, 'size': size})
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    return resp.get_json()
+
+
+def test_local_direct_upload_ticket_is_single_use(app_module, admin_client):
+    ticket = _sign(admin_client)
+    first = admin_client.post(ticket['url'], data={'file': (io.BytesIO(PDF), 'notes.pdf')})
+    assert first.status_code == 204
+
+    replay = admin_client.post(ticket['url'], data={'file': (io.BytesIO(b'%PDF-1.4 other'), 'notes.pdf')})
+    assert replay.status_code == 409
+
+    stored = app_module._direct_upload_signer.loads(ticket['token'])
+    folder = app_module.app.config['UPLOAD_FOLDER']
+    with open(os.path.join(folder, stored['stored']), 'rb') as f:
+        assert f.read() == PDF
+    assert not [n for n in os.listdir(folder) if n.endswith('.part')]
+
+
+class _FakeS3:
+    def __init__(self, body, content_type):
+        self.body, self.content_type = body, content_type
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.body), 'ContentType': self.content_type}
+
+    def get_object(self, Bucket, Key, Range=None):
+        end = int(Range.rsplit('-', 1)[1]) + 1 if Range else None
+        return {'Body': io.BytesIO(self.body[:end])}
+
+
+def test_s3_direct_upload_type_comes_from_content(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'get_storage_type', lambda: 's3')
+    ticket = {'stored': 'x.pdf', 'ext': 'pdf', 'type': 'application/pdf'}
+
+    # The browser claims a PDF but sent an executable
+    monkeypatch.setattr(app_module, 'get_s3_client', lambda: _FakeS3(b'MZ\x90\x00\x03\x00', 'application/pdf'))
+    _, fmt, _ = app_module._inspect_direct_upload(ticket)
+    assert not app_module._same_format(fmt, 'pdf')
+
+    # A real PDF passes whatever Content-Type came with it
+    monkeypatch.setattr(app_module, 'get_s3_client', lambda: _FakeS3(PDF, 'binary/octet-stream'))
+    size, fmt, _ = app_module._inspect_direct_upload(ticket)
+    assert size == len(PDF) and fmt == 'pdf'
+
+
+def _finalize(app_module, token):
+    from flask import session
+    with app_module.app.test_request_context():
+        session['user_id'] = 1
+        return app_module.finalize_direct_upload(token, 'files')
+
+
+def test_local_direct_upload_type_comes_from_content(app_module):
+    # Stitched chunked uploads land in the folder without passing the upload route
+    folder = app_module.app.config['UPLOAD_FOLDER']
+    ticket = {'stored': f'{uuid.uuid4().hex}.pdf', 'ext': 'pdf'}
+    for body, expected in ((b'MZ\x90\x00\x03\x00', ''), (PDF, 'pdf')):
+        with open(os.path.join(folder, ticket['stored']), 'wb') as f:
+            f.write(body)
+        assert app_module._inspect_direct_upload(ticket)[1] == expected
+
+
+def test_direct_upload_is_published_once(app_module, admin_client):
+    ticket = _sign(admin_client)
+    assert admin_client.post(ticket['url'], data={'file': (io.BytesIO(PDF), 'notes.pdf')}).status_code == 204
+    assert _finalize(app_module, ticket['token'])['size'] == len(PDF)
+    with pytest.raises(ValueError, match='already been published'):
+        _finalize(app_module, ticket['token'])
+
+
+class _FakeResponse:
+    def __init__(self, body):
+        self.raw = self
+        self.body = body
+
+    def read(self, n, decode_content=False):
+        return self.body[:n]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_cloudinary_raw_direct_upload_type_comes_from_content(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'get_storage_type', lambda: 'cloudinary')
+    # Raw resources carry no format, so only the bytes can tell
+    monkeypatch.setattr(app_module.cloudinary.api, 'resource', lambda public_id, resource_type: {
+        'bytes': 70, 'secure_url': 'https://cdn.example/raw/x.pdf'})
+    ticket = {'stored': 'x.pdf', 'ext': 'pdf', 'res_type': 'raw'}
+
+    for body, expected in ((b'MZ\x90\x00\x03\x00', ''), (PDF, 'pdf')):
+        session = type('Session', (), {'get': lambda self, url, **kw: _FakeResponse(body)})()
+        monkeypatch.setattr(app_module, 'get_http_session', lambda: session)
+        assert app_module._inspect_direct_upload(ticket)[1] == expected
@@ -0,0 +1,68 @@
+import os
+
+from utils import DiskCache
+
+
+def test_too_large_objects_are_not_fetched_again(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1024)
+    calls = []
+
+    def refuse(f):
+        calls.append(1)
+        f.write(b'x' * 100)
+        return False
+
+    assert cache.fill('big.pdf', refuse) is None
+    assert cache.fill('big.pdf', refuse) is None
+    assert len(calls) == 1
+    assert cache.stats()['too_large'] == 1
+
+    # A deleted-and-reuploaded name is judged afresh
+    cache.discard('big.pdf')
+    assert cache.fill('big.pdf', lambda f: f.write(b'small')) is not None
+
+
+def test_lock_files_are_bounded_and_survive_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=2000)
+    for i in range(400):
+        assert cache.fill(f'obj{i}.txt', lambda f: f.write(b'y' * 100))
+
+    names = os.listdir(tmp_path)
+    locks = [n for n in names if n.endswith('.lock')]
+    entries = [n for n in names if not n.endswith('.lock')]
+    assert len(locks) <= DiskCache.LOCK_STRIPES
+    assert len(entries) <= 20
+    assert cache.stats()['evictions'] >= 380
+
+    cache.discard('obj399.txt')
+    assert len([n for n in os.listdir(tmp_path) if n.endswith('.lock')]) == len(locks)
+
+
+def _stripe(cache, key):
+    return int(os.path.basename(cache.path_for(key))[:8], 16) % DiskCache.LOCK_STRIPES
+
+
+def test_eviction_skips_entries_whose_stripe_is_busy(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=500)
+    busy = cache.fill('busy.txt', lambda f: f.write(b'z' * 100))
+    others = [k for k in (f'other{i}.txt' for i in range(40)) if _stripe(cache, k) != _stripe(cache, 'busy.txt')]
+
+    # As if another request were filling or checking busy.txt
+    with cache._stripe_lock(busy):
+        for key in others[:10]:
+            cache.fill(key, lambda f: f.write(b'y' * 100))
+        assert os.path.exists(busy)
+
+    cache.fill(others[10], lambda f: f.write(b'y' * 100))
+    assert not os.path.exists(busy)
+
+
+def test_evicted_entry_is_proxied_instead(app_module, monkeypatch):
+    class Evicted:
+        enabled = True
+        def get(self, key):
+            return os.path.join(app_module.OBJECT_CACHE_DIR, 'gone.pdf')
+    monkeypatch.setattr(app_module, 'object_cache', Evicted())
+    monkeypatch.setattr(app_module, 'proxy_object', lambda name, res_type=None: 'proxied')
+    with app_module.app.test_request_context():
+        assert app_module.serve_object_inline('gone.pdf') == 'proxied'
@@ -0,0 +1,32 @@
+import uuid
+
+
+def test_backfill_looks_up_image_events_without_their_extension(app_module, monkeypatch):
+    public_id = f'event_{uuid.uuid4().hex}'
+    conn = app_module.get_db_connection()
+    try:
+        event_id = conn.execute(
+            'INSERT INTO events (title, event_type, image_filename, uploader_username) VALUES (?, ?, ?, ?)',
+            ('Fest', 'inter', f'{public_id}.jpg', 'admin')).lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+
+    asked = []
+    def resources_by_ids(ids, resource_type, max_results):
+        asked.extend(ids)
+        return {'resources': [{'public_id': i, 'secure_url': f'https://cdn.example/{i}.jpg'}
+                              for i in ids if resource_type == 'image']}
+    monkeypatch.setattr(app_module, 'get_storage_type', lambda: 'cloudinary')
+    monkeypatch.setattr(app_module.cloudinary.api, 'resources_by_ids', resources_by_ids)
+
+    result = app_module.app.test_cli_runner().invoke(args=['event-urls-backfill'])
+    assert result.exit_code == 0, result.output
+    assert public_id in asked
+
+    conn = app_module.get_db_connection()
+    try:
+        row = conn.execute('SELECT image_url FROM events WHERE id = ?', (event_id,)).fetchone()
+    finally:
+        conn.close()
+    assert row['image_url'] == f'https://cdn.example/{public_id}.jpg'
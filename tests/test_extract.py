@@ -0,0 +1,28 @@
+import uuid
+
+
+def test_file_without_text_is_marked_extracted(app_module, tmp_path):
+    stored = f'{uuid.uuid4().hex}.txt'
+    (tmp_path / 'blank.txt').write_text('   \n')
+    conn = app_module.get_db_connection()
+    try:
+        file_id = conn.execute(
+            'INSERT INTO files (original_filename, stored_filename, uploader_username, subject, '
+            'semester, file_type, file_size) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ('blank.txt', stored, 'admin', 'Empty', '1', 'txt', 4)).lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert app_module.content_extractor.process(file_id, str(tmp_path / 'blank.txt'), 'txt')
+
+    conn = app_module.get_db_connection()
+    try:
+        row = conn.execute('SELECT content FROM file_contents WHERE file_id = ?', (file_id,)).fetchone()
+        # The backfill's selection no longer picks it up
+        pending = conn.execute('SELECT 1 FROM files WHERE id = ? AND id NOT IN '
+                               '(SELECT file_id FROM file_contents)', (file_id,)).fetchone()
+    finally:
+        conn.close()
+    assert row is not None and row['content'] == ''
+    assert pending is None
@@ -0,0 +1,40 @@
+def _facet_count(app_module, value):
+    conn = app_module.get_db_connection()
+    try:
+        row = conn.execute("SELECT doc_count FROM facet_counts WHERE facet = 'subject' AND value = ?",
+                           (value,)).fetchone()
+    finally:
+        conn.close()
+    return row['doc_count'] if row else None
+
+
+def _drift(app_module, value):
+    conn = app_module.get_db_connection()
+    try:
+        conn.execute(
+            'INSERT INTO files (original_filename, stored_filename, uploader_username, subject, '
+            "semester, file_type, file_size) VALUES ('a.pdf', 'a.pdf', 'admin', ?, '1', 'pdf', 1)", (value,))
+        conn.execute("INSERT INTO facet_counts (facet, value, doc_count) VALUES ('subject', ?, 999)", (value,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_notes_page_never_recomputes_facets(app_module, admin_client, monkeypatch):
+    def fail(conn):
+        raise AssertionError('GET /notes wrote facet counts')
+    monkeypatch.setattr(app_module, 'recompute_facets', fail)
+    monkeypatch.setattr(app_module, 'FACETS_RECOMPUTE_INTERVAL', 0)
+    app_module.facets_cache.invalidate()
+
+    assert admin_client.get('/notes').status_code == 200
+
+
+def test_job_workers_correct_facet_drift(app_module):
+    _drift(app_module, 'Drifted subject')
+    for task in app_module.job_queue._periodic:
+        task[2] = 0   # due now
+
+    app_module.job_queue.run_periodic()
+
+    assert _facet_count(app_module, 'Drifted subject') == 1
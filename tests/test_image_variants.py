@@ -0,0 +1,66 @@
+import os
+import uuid
+
+import pytest
+
+from conftest import queued_deletes
+
+PIL = pytest.importorskip('PIL.Image')
+
+
+def _add_event(app_module, width):
+    stored = f'event_{uuid.uuid4().hex}.png'
+    PIL.new('RGB', (width, width // 2), (30, 90, 200)).save(
+        os.path.join(app_module.app.config['UPLOAD_FOLDER'], stored))
+    conn = app_module.get_db_connection()
+    try:
+        cur = conn.execute(
+            'INSERT INTO events (title, event_type, image_filename, uploader_username) VALUES (?, ?, ?, ?)',
+            ('Fest', 'inter', stored, 'admin'))
+        event_id = cur.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    return event_id, stored
+
+
+def _variant_widths(app_module, stored):
+    conn = app_module.get_db_connection()
+    try:
+        return [r['width'] for r in conn.execute(
+            'SELECT width FROM image_variants WHERE source_filename = ? ORDER BY width', (stored,)).fetchall()]
+    finally:
+        conn.close()
+
+
+def test_variants_are_made_served_and_released(app_module, admin_client):
+    event_id, stored = _add_event(app_module, 700)
+
+    # Widths wider than the original are skipped
+    assert app_module.make_image_variants(stored, 'raw', 'png') == 2
+    assert _variant_widths(app_module, stored) == [320, 640]
+
+    resp = admin_client.get(f'/event_image/{event_id}?w=300')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'image/webp'
+    assert resp.get_data()[8:12] == b'WEBP'
+
+    variants = [app_module.variant_name_for(stored, w) for w in (320, 640)]
+    assert admin_client.post(f'/delete_event/{event_id}').status_code == 302
+    assert _variant_widths(app_module, stored) == []
+    assert queued_deletes(app_module, [stored] + variants) == {stored, *variants}
+
+
+def test_variants_of_an_image_deleted_while_rendering_are_released(app_module):
+    event_id, stored = _add_event(app_module, 400)
+    conn = app_module.get_db_connection()
+    try:
+        conn.execute('DELETE FROM events WHERE id = ?', (event_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert app_module.make_image_variants(stored, 'raw', 'png') == 1
+    assert _variant_widths(app_module, stored) == []
+    variant = app_module.variant_name_for(stored, 320)
+    assert queued_deletes(app_module, [variant]) == {variant}
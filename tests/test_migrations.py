@@ -0,0 +1,37 @@
+from conftest import run_fresh
+
+
+def test_fresh_database_reaches_schema_version(tmp_path):
+    result = run_fresh(tmp_path, (
+        'import app\n'
+        'conn = app.get_db_connection()\n'
+        'print(app._current_schema_version(conn), app.SCHEMA_VERSION)\n'
+    ))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert '[ERROR]' not in result.stdout
+    current, expected = result.stdout.split()[-2:]
+    assert current == expected
+
+
+def test_current_database_boots_without_migrating(tmp_path):
+    assert run_fresh(tmp_path, 'import app').returncode == 0
+    result = run_fresh(tmp_path, 'import app')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'Migration' not in result.stdout
+
+
+def test_failed_migration_stops_boot(tmp_path):
+    result = run_fresh(tmp_path, (
+        'import utils\n'
+        'utils.cooperative_sleep = lambda s: None\n'
+        'import sqlite3\n'
+        'conn = sqlite3.connect("users.db")\n'
+        'conn.execute("CREATE TABLE schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL,'
+        ' applied_at TIMESTAMP)")\n'
+        # Claim the base tables exist when they do not, so migration 2 fails
+        'conn.execute("INSERT INTO schema_version (version, name) VALUES (1, \'base tables\')")\n'
+        'conn.commit()\n'
+        'import app\n'
+    ))
+    assert result.returncode != 0
+    assert '[ERROR] DB init' in result.stdout
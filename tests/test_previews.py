@@ -0,0 +1,31 @@
+import os
+import uuid
+
+import pytest
+
+PIL = pytest.importorskip('PIL.Image')
+
+
+def test_make_preview_stores_and_serves_webp(app_module, admin_client):
+    stored = f'{uuid.uuid4().hex}.png'
+    PIL.new('RGB', (800, 600), (200, 30, 30)).save(
+        os.path.join(app_module.app.config['UPLOAD_FOLDER'], stored))
+    conn = app_module.get_db_connection()
+    try:
+        conn.execute(
+            'INSERT INTO files (original_filename, stored_filename, uploader_username, subject, '
+            'semester, file_type, file_size) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ('poster.png', stored, 'admin', 'Art', '1', 'png', 1))
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert app_module.make_preview(stored, 'raw', 'png')
+
+    name = app_module.preview_name_for(stored)
+    resp = admin_client.get(f'/preview/{name}')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'image/webp'
+    assert 'immutable' in resp.headers['Cache-Control']
+    assert resp.get_data()[8:12] == b'WEBP'
+    assert admin_client.get('/preview/unknown_preview1.webp').status_code == 404
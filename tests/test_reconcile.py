@@ -0,0 +1,26 @@
+import uuid
+
+
+def test_purge_rechecks_previews_and_variants(app_module, tmp_path):
+    source = f'{uuid.uuid4().hex}.png'
+    preview, variant, orphan = (f'{kind}_{uuid.uuid4().hex}.webp' for kind in ('preview', 'variant', 'orphan'))
+    for name in (preview, variant, orphan):
+        (tmp_path / name).write_bytes(b'RIFF')
+
+    # Rows committed after the storage listing was taken
+    conn = app_module.get_db_connection()
+    try:
+        conn.execute(
+            'INSERT INTO files (original_filename, stored_filename, uploader_username, subject, '
+            'semester, file_type, file_size, preview_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ('pic.png', source, 'admin', 'Maths', '1', 'png', 4, preview))
+        conn.execute(
+            'INSERT INTO image_variants (stored_filename, source_filename, width, storage_resource_type) '
+            'VALUES (?, ?, ?, ?)', (variant, source, 480, 'image'))
+        conn.commit()
+    finally:
+        conn.close()
+
+    listed = [(name, 4, 0, 'image') for name in (preview, variant, orphan)]
+    assert app_module.purge_orphans(listed, local_dir=str(tmp_path)) == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted([preview, variant])
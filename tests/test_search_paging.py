@@ -0,0 +1,41 @@
+from decimal import Decimal
+
+
+def _page_through(app_module, q, per_page):
+    sql, params = app_module.search_query('files', q)
+    seen, cursor = [], ''
+    while True:
+        with app_module.app.test_request_context(f'/notes?after={cursor}'):
+            conn = app_module.get_db_connection()
+            rows, _, has_more, cursor = app_module.fetch_page(conn, sql, params, 'search_rank', per_page)
+            seen += [r['id'] for r in rows]
+        if not has_more:
+            return seen
+
+
+def test_search_pages_neither_repeat_nor_skip(app_module):
+    conn = app_module.get_db_connection()
+    try:
+        for i in range(23):
+            # Varying length varies the rank; repeats force ties broken by id
+            conn.execute(
+                'INSERT INTO files (original_filename, stored_filename, uploader_username, subject, '
+                'semester, file_type, file_size, description) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (f'zebrafish{i}.pdf', f'zf{i}.pdf', 'admin', 'Zebrafish biology', '1', 'pdf', 1,
+                 'zebrafish ' * (i % 4 + 1)))
+        conn.commit()
+        expected = {r['id'] for r in conn.execute(
+            "SELECT id FROM files WHERE subject = 'Zebrafish biology'").fetchall()}
+    finally:
+        conn.close()
+
+    seen = _page_through(app_module, 'zebrafish', per_page=5)
+
+    assert len(seen) == len(set(seen))
+    assert set(seen) == expected
+
+
+def test_numeric_rank_cursor_round_trips_exactly(app_module):
+    token = app_module._encode_cursor({'search_rank': Decimal('0.060793'), 'id': 42}, 'search_rank')
+    with app_module.app.test_request_context('/'):
+        assert app_module._decode_cursor(token) == ('0.060793', 42)
@@ -0,0 +1,16 @@
+class _FakeS3:
+    def generate_presigned_url(self, op, Params, ExpiresIn):
+        return 'https://s3.example/' + Params['Key'] + '?cd=' + Params.get('ResponseContentDisposition', '')
+
+
+def test_shared_object_downloads_keep_each_uploaders_filename(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'get_storage_type', lambda: 's3')
+    monkeypatch.setattr(app_module, 'get_s3_client', lambda: _FakeS3())
+    app_module.signed_url_cache.discard_where(lambda key: key[0] == 'shared.pdf')
+
+    first, _ = app_module.signed_object_url('shared.pdf', attachment=True, download_name='alice.pdf')
+    second, _ = app_module.signed_object_url('shared.pdf', attachment=True, download_name='bob.pdf')
+    again, _ = app_module.signed_object_url('shared.pdf', attachment=True, download_name='alice.pdf')
+
+    assert 'alice.pdf' in first and 'bob.pdf' in second
+    assert again == first
@@ -0,0 +1,172 @@
+"""
+Load check for the web workers: slow proxied downloads must not starve page
+requests. Each case runs gunicorn with gunicorn.conf.py against an origin
+that trickles bytes, holds some inline file views open on it and times
+page requests made meanwhile. A sync worker is run as the control, to show
+the check notices starvation when there is some.
+"""
+import os
+import re
+import sys
+import time
+import socket
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from conftest import ROOT, TEST_ENV, run_fresh
+
+pytest.importorskip('gunicorn')
+requests = pytest.importorskip('requests')
+
+DOWNLOAD_SECONDS = 4.0    # how long the origin takes to send each object
+DOWNLOAD_BYTES   = 40
+PAGE_REQUESTS    = 5
+PAGE_BUDGET      = 1.0    # slowest page allowed while downloads are running
+
+
+class SlowOrigin(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _TrickleHandler)
+        self.active = 0
+        self.active_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class _TrickleHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.active_lock:
+            self.server.active += 1
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(DOWNLOAD_BYTES))
+            self.end_headers()
+            for _ in range(DOWNLOAD_BYTES):
+                self.wfile.write(b'x')
+                self.wfile.flush()
+                time.sleep(DOWNLOAD_SECONDS / DOWNLOAD_BYTES)
+        finally:
+            with self.server.active_lock:
+                self.server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _add_file(workdir):
+    result = run_fresh(workdir, (
+        'import app\n'
+        'conn = app.get_db_connection()\n'
+        'cur = conn.execute("INSERT INTO files (original_filename, stored_filename, uploader_username, '
+        'subject, semester, file_type, file_size) VALUES (?, ?, ?, ?, ?, ?, ?)", '
+        f'("notes.pdf", "slow.pdf", "admin", "Maths", "1", "pdf", {DOWNLOAD_BYTES}))\n'
+        'conn.commit()\n'
+        'print(cur.lastrowid)\n'))
+    assert result.returncode == 0, result.stderr
+    return int(result.stdout.split()[-1])
+
+
+def _run_server(workdir, origin, worker_class, threads):
+    port = _free_port()
+    env = dict(os.environ, **TEST_ENV,
+               PYTHONPATH=os.pathsep.join([ROOT, os.path.join(ROOT, 'tests')]),
+               GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY='1',
+               GUNICORN_THREADS=str(threads), OBJECT_CACHE_MAX_BYTES='0',
+               SLOW_ORIGIN=origin.url)
+    for var in [k for k, v in env.items() if v == '']:
+        del env[var]
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '-b', f'127.0.0.1:{port}', 'slow_storage_app:app'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{base}/health', timeout=2).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.2)
+    proc.kill()
+    pytest.fail(f'gunicorn ({worker_class}) did not come up')
+
+
+def _login(base):
+    """Cookies of the default admin's session."""
+    client = requests.Session()
+    form = client.get(f'{base}/login', timeout=10).text
+    token = re.search(r'name="csrf_token" value="([^"]+)"', form).group(1)
+    resp = client.post(f'{base}/login', timeout=10, allow_redirects=False, data={
+        'csrf_token': token, 'username': 'DSCEAdmin', 'password': 'DSCE@Admin2552'})
+    assert resp.status_code == 302 and 'login' not in resp.headers['Location']
+    return client.cookies
+
+
+def slowest_page(workdir, worker_class, downloads, threads=4):
+    """Seconds taken by the slowest page request while ``downloads`` slow views run."""
+    file_id = _add_file(workdir)
+    origin = SlowOrigin()
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    proc, base = _run_server(workdir, origin, worker_class, threads)
+    received = []
+
+    def download():
+        resp = requests.get(f'{base}/file_content/{file_id}', cookies=cookies,
+                            timeout=DOWNLOAD_SECONDS * 10)
+        received.append(len(resp.content))
+
+    try:
+        cookies = _login(base)
+        clients = [threading.Thread(target=download) for _ in range(downloads)]
+        for c in clients:
+            c.start()
+        # Page timings count only once the server has every download in flight
+        in_flight = downloads if worker_class == 'gevent' else min(downloads, threads)
+        deadline = time.monotonic() + DOWNLOAD_SECONDS
+        while origin.active < in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        slowest = 0.0
+        for _ in range(PAGE_REQUESTS):
+            started = time.monotonic()
+            assert requests.get(f'{base}/', timeout=DOWNLOAD_SECONDS * 10).status_code == 200
+            slowest = max(slowest, time.monotonic() - started)
+        for c in clients:
+            c.join()
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        origin.shutdown()
+        origin.server_close()
+    assert received == [DOWNLOAD_BYTES] * downloads
+    return slowest
+
+
+def test_sync_worker_starves_pages(tmp_path):
+    # The control: one slow download takes the only worker
+    assert slowest_page(tmp_path, 'sync', downloads=1, threads=1) > DOWNLOAD_SECONDS / 2
+
+
+def test_gthread_serves_pages_during_slow_downloads(tmp_path):
+    assert slowest_page(tmp_path, 'gthread', downloads=3, threads=4) < PAGE_BUDGET
+
+
+def test_gevent_serves_pages_during_slow_downloads(tmp_path):
+    pytest.importorskip('gevent')
+    assert slowest_page(tmp_path, 'gevent', downloads=20) < PAGE_BUDGET
@@ -1,7 +1,15 @@
+import os
+import sys
 import time
 import logging
 import random
+import hashlib
+import tempfile
+import contextlib
+import collections
 import functools
+import importlib
+import threading
 from datetime import datetime, timedelta
 
 # ─────────────────────────── Logging Configuration ──────────────────
@@ -61,6 +69,18 @@ class CircuitBreaker:
         return True
 
 # ─────────────────────────── Retry Decorator ────────────────────────
+def cooperative_sleep(seconds):
+    """
+    Sleep without holding up other requests. Under gevent workers this
+    yields to the hub even if ``time`` was not monkey-patched; with thread
+    workers only the calling thread waits.
+    """
+    gevent = sys.modules.get('gevent')
+    if gevent is not None:
+        gevent.sleep(seconds)
+    else:
+        time.sleep(seconds)
+
 def with_retry(max_attempts=3, base_delay=1, max_delay=10, 
                exceptions=(Exception,), circuit_breaker=None):
     """
@@ -106,9 +126,556 @@ def with_retry(max_attempts=3, base_delay=1, max_delay=10,
                     
                     logger.info(f"Retrying in {sleep_time:.2f}s...")
                     _MONITORING_STATS['total_retries'] += 1
-                    time.sleep(sleep_time)
+                    cooperative_sleep(sleep_time)
                     attempt += 1
             
             return None # Should not reach here
         return wrapper
     return decorator
+
+# ─────────────────────────── Connection Pool ────────────────────────
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections with bounded size and health checks.
+
+    Idle connections are reused LIFO so the warmest socket goes out first.
+    A connection that has sat idle longer than ``ping_after`` seconds is run
+    through ``validate`` before it is handed out; idle connections beyond
+    ``min_size`` are closed once they exceed ``max_idle`` seconds.
+    """
+    def __init__(self, factory, min_size=1, max_size=10, timeout=10,
+                 validate=None, ping_after=30, max_idle=300, name='db'):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f'Invalid pool bounds: min={min_size} max={max_size}')
+        self.factory    = factory
+        self.min_size   = min_size
+        self.max_size   = max_size
+        self.timeout    = timeout
+        self.validate   = validate
+        self.ping_after = ping_after
+        self.max_idle   = max_idle
+        self.name       = name
+        self._idle      = []      # [(conn, released_at)]
+        self._size      = 0       # open connections, idle + checked out
+        self._cond      = threading.Condition()
+        self._stats     = {
+            'checkouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'failed_health_checks': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_time_ms': 0.0,
+        }
+
+    def _close_quietly(self, conn):
+        try: conn.close()
+        except Exception: pass
+
+    def _is_healthy(self, conn, idle_for):
+        # psycopg2 flags sockets it already knows are dead; that check is free
+        if getattr(conn, 'closed', False):
+            return False
+        if self.validate is None or idle_for < self.ping_after:
+            return True
+        try:
+            return bool(self.validate(conn))
+        except Exception as e:
+            logger.warning(f"Pool '{self.name}': health check failed: {e}")
+            return False
+
+    def _reap_idle(self):
+        """Close idle connections above min_size that outlived max_idle. Caller holds the lock."""
+        now = time.monotonic()
+        keep = []
+        for conn, released_at in self._idle:
+            if self._size > self.min_size and now - released_at > self.max_idle:
+                self._close_quietly(conn)
+                self._size -= 1
+                self._stats['discarded'] += 1
+            else:
+                keep.append((conn, released_at))
+        self._idle = keep
+
+    def acquire(self):
+        """Check out a healthy connection, creating one if the pool has room."""
+        deadline = time.monotonic() + self.timeout
+        waited_since = None
+        while True:
+            with self._cond:
+                self._reap_idle()
+                candidate = None
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1   # reserve a slot; connect outside the lock
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"Pool '{self.name}' exhausted ({self.max_size} connections in use)"
+                        )
+                    if waited_since is None:
+                        waited_since = time.monotonic()
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+                    continue
+
+            if candidate is not None:
+                conn, released_at = candidate
+                if self._is_healthy(conn, time.monotonic() - released_at):
+                    return self._checked_out(conn, waited_since)
+                self._discard(conn, failed_check=True)
+                continue
+
+            try:
+                conn = self.factory()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+            return self._checked_out(conn, waited_since)
+
+    def _checked_out(self, conn, waited_since):
+        with self._cond:
+            self._stats['checkouts'] += 1
+            if waited_since is not None:
+                self._stats['wait_time_ms'] += (time.monotonic() - waited_since) * 1000
+        return conn
+
+    def _discard(self, conn, failed_check=False):
+        self._close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            if failed_check:
+                self._stats['failed_health_checks'] += 1
+            self._cond.notify()
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is known to be broken."""
+        if discard:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def warm(self):
+        """Open connections until min_size are idle or checked out."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self.factory()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def after_fork(self):
+        """
+        In a forked child, forget the parent's connections without closing
+        them: closing would also end the parent's sessions on the server.
+        """
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+
+    def close_all(self):
+        """
+        Close every idle connection. Connections checked out at the time are
+        left alone and rejoin the idle list when released.
+        """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return dict(self._stats,
+                        name=self.name,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        size=self._size,
+                        idle=idle,
+                        in_use=self._size - idle)
+
+# ─────────────────────────── Cached Value ───────────────────────────
+class CachedValue:
+    """
+    Lazily loaded value with a TTL and a cross-process invalidation stamp.
+
+    ``invalidate()`` drops the local copy and touches ``stamp_path``; every
+    process sharing that file notices the new mtime on its next ``get()`` and
+    reloads. Processes on other hosts fall back to the TTL, so staleness is
+    bounded by ``ttl`` seconds everywhere.
+    """
+    def __init__(self, loader, ttl=30, stamp_path=None, name='cache'):
+        self.loader     = loader
+        self.ttl        = ttl
+        self.stamp_path = stamp_path
+        self.name       = name
+        self._value     = None
+        self._loaded_at = None
+        self._stamp     = None
+        self._lock      = threading.Lock()
+        self.hits       = 0
+        self.misses     = 0
+
+    def _read_stamp(self):
+        if not self.stamp_path:
+            return None
+        try:
+            return os.stat(self.stamp_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _is_fresh(self, stamp):
+        return (self._loaded_at is not None
+                and time.monotonic() - self._loaded_at < self.ttl
+                and stamp == self._stamp)
+
+    def get(self):
+        stamp = self._read_stamp()
+        if self._is_fresh(stamp):
+            self.hits += 1
+            return self._value
+        with self._lock:
+            # Another thread may have reloaded while we waited
+            if self._is_fresh(stamp):
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            value = self.loader()
+            self._value, self._loaded_at, self._stamp = value, time.monotonic(), stamp
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+        if self.stamp_path:
+            try:
+                with open(self.stamp_path, 'a'):
+                    pass
+                os.utime(self.stamp_path)
+            except OSError as e:
+                logger.warning(f"Cache '{self.name}': could not touch stamp {self.stamp_path}: {e}")
+
+    def stats(self):
+        return {'name': self.name, 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+# ─────────────────────────── TTL Cache ──────────────────────────────
+class TTLCache:
+    """
+    Thread-safe, size-bounded LRU map whose entries expire at an absolute
+    wall-clock time chosen by the caller (e.g. a signed URL's expiry).
+    """
+    def __init__(self, maxsize=1024, name='ttl'):
+        self.maxsize = maxsize
+        self.name    = name
+        self._data   = collections.OrderedDict()   # key -> (value, expires_at)
+        self._lock   = threading.Lock()
+        self.hits    = 0
+        self.misses  = 0
+
+    def get(self, key, min_remaining=0):
+        """Return (value, expires_at) if it stays valid for at least min_remaining seconds."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] - time.time() < min_remaining:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {'name': self.name, 'size': len(self._data), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses}
+
+# ─────────────────────────── Disk Cache ─────────────────────────────
+try:
+    import fcntl
+except ImportError:   # Windows dev boxes: coalescing stays per-process
+    fcntl = None
+
+
+class DiskCache:
+    """
+    Read-through file cache bounded by total bytes, shared by every process
+    that points at the same directory.
+
+    Entries are written to a temp file and renamed into place, so readers
+    never see partial data. Keys hash onto a fixed set of lock stripes (a
+    thread lock plus a flock'd file that is never removed), so concurrent
+    misses wait for the first fetch instead of all going upstream. The
+    entry's mtime doubles as its last-access time for LRU eviction, which
+    skips entries whose stripe is busy. Keys the writer refused as too
+    large are remembered and not fetched again.
+    """
+    LOCK_STRIPES   = 256
+    MAX_REMEMBERED = 4096   # too-large keys kept per process
+
+    def __init__(self, directory, max_bytes, name='disk'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.name      = name
+        self._locks    = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._too_large = collections.OrderedDict()
+        self._too_large_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats    = {'hits': 0, 'misses': 0, 'fills': 0, 'evictions': 0, 'bytes_written': 0,
+                          'too_large': 0}
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path_for(self, key):
+        ext = os.path.splitext(key)[1].lower()
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest()[:40] + ext)
+
+    def get(self, key):
+        """Return the cached file's path and mark it recently used, or None."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return path
+
+    def fill(self, key, writer):
+        """
+        Populate ``key`` by calling ``writer(fileobj)``. If another thread or
+        process is already filling it, wait and reuse its result. Returns the
+        path, or None if ``writer`` returned False (e.g. object too large).
+        """
+        with self._too_large_lock:
+            too_large = key in self._too_large
+        if too_large:
+            self._count('too_large')
+            return None
+        path = self.path_for(key)
+        with self._stripe_lock(path):
+            if os.path.exists(path):
+                os.utime(path)
+                return path
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    if writer(f) is False:
+                        os.remove(tmp)
+                        self._remember_too_large(key)
+                        return None
+                size = os.path.getsize(tmp)
+                os.replace(tmp, path)
+            except BaseException:
+                try: os.remove(tmp)
+                except OSError: pass
+                raise
+        self._count('fills')
+        self._count('bytes_written', size)
+        self.evict()
+        return path
+
+    def _remember_too_large(self, key):
+        # Stored objects never change, so the verdict holds until discard()
+        with self._too_large_lock:
+            self._too_large[key] = True
+            self._too_large.move_to_end(key)
+            while len(self._too_large) > self.MAX_REMEMBERED:
+                self._too_large.popitem(last=False)
+
+    def _count(self, stat, n=1):
+        with self._stats_lock:
+            self._stats[stat] += n
+
+    @contextlib.contextmanager
+    def _stripe_lock(self, path, blocking=True):
+        """
+        Hold the thread lock and flock of ``path``'s stripe. Without
+        ``blocking``, yields False instead of waiting when either is taken.
+        """
+        stripe = int(os.path.basename(path)[:8], 16) % self.LOCK_STRIPES
+        lock = self._locks[stripe]
+        if not lock.acquire(blocking):
+            yield False
+            return
+        try:
+            with self._flock(os.path.join(self.directory, f'stripe{stripe:02x}.lock'), blocking) as held:
+                yield held
+        finally:
+            lock.release()
+
+    @contextlib.contextmanager
+    def _flock(self, lock_path, blocking=True):
+        if fcntl is None:
+            yield True
+            return
+        with open(lock_path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith(('.lock', '.tmp')) or not e.is_file():
+                    continue
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # An entry being filled or checked right now is skipped, not pulled out from under it
+            with self._stripe_lock(path, blocking=False) as held:
+                if not held:
+                    continue
+                self._remove(path)
+            total -= size
+            self._count('evictions')
+
+    def _remove(self, path):
+        # Lock files stay: another process may hold one while it fills
+        try: os.remove(path)
+        except OSError: pass
+
+    def discard(self, key):
+        if self.enabled:
+            with self._too_large_lock:
+                self._too_large.pop(key, None)
+            self._remove(self.path_for(key))
+
+    def stats(self):
+        usage = sum(size for _, size, _ in self._entries()) if self.enabled else 0
+        with self._stats_lock:
+            counts = dict(self._stats)
+        return dict(counts, name=self.name, max_bytes=self.max_bytes, bytes_used=usage)
+
+# ─────────────────────────── Startup Timing ─────────────────────────
+class BootTimer:
+    """
+    Wall-clock time spent in each startup phase. ``mark(name)`` closes the
+    phase that began at the previous mark; work deferred until first use
+    (lazy imports, SDK clients) is recorded separately with ``deferred``.
+    """
+    def __init__(self, started=None):
+        self.started   = started if started is not None else time.perf_counter()
+        self.phases    = []
+        self.lazy      = []
+        self.total     = None
+        self._last     = self.started
+        self._lock     = threading.Lock()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def deferred(self, name, seconds):
+        with self._lock:
+            self.lazy.append((name, seconds))
+        logger.info(f'{name} took {seconds * 1000:.0f}ms on first use')
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+        parts = ', '.join(f'{name} {secs * 1000:.0f}ms' for name, secs in self.phases)
+        print(f'[BOOT] Ready in {self.total * 1000:.0f}ms ({parts})')
+
+    def report(self):
+        ms = lambda secs: round(secs * 1000, 1)
+        with self._lock:
+            return {'total_ms': ms(self.total or 0),
+                    'phases_ms': {name: ms(secs) for name, secs in self.phases},
+                    'deferred_ms': {name: ms(secs) for name, secs in self.lazy}}
+
+
+# ─────────────────────────── Lazy Imports ───────────────────────────
+class LazyImport:
+    """
+    Stands in for a module until an attribute is first read, then imports it
+    (with the listed submodules) and runs ``setup(module)`` once. Workers
+    that never use a backend never pay for importing its SDK.
+    """
+    def __init__(self, name, submodules=(), setup=None, timer=None):
+        self._name       = name
+        self._submodules = submodules
+        self._setup      = setup
+        self._timer      = timer
+        self._module     = None
+        self._lock       = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        """Import now (e.g. before forking) and return the real module."""
+        with self._lock:
+            if self._module is None:
+                started = time.perf_counter()
+                module = importlib.import_module(self._name)
+                for sub in self._submodules:
+                    importlib.import_module(f'{self._name}.{sub}')
+                if self._setup:
+                    self._setup(module)
+                self._module = module
+                if self._timer:
+                    self._timer.deferred(f'import {self._name}', time.perf_counter() - started)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self.load(), attr)